@@ -18,4 +18,46 @@ FUNC_NONE = 'NONE'
 FUNC_PAUSE = 'PAUSE'
 FUNC_GOTO = 'GOTO'
 FUNC_BS = 'BS'
-FUNC_END = 'END'
\ No newline at end of file
+FUNC_END = 'END'
+
+# PROFILING
+PROFILE_STARTUP = False
+
+# RECORDING SPOOL
+SPOOL_FOLDER = 'cvep_spool'     # Inside MEDUSA's data folder
+REC_FLUSH_INTERVAL = 5.0        # Seconds between consecutive flushes
+
+# RECORDINGS
+CVEP_DATA_KEY = 'cvepspellerdata'   # Attribute of CVEPSpellerData (medusa's)
+
+# CHUNKED RECORDINGS
+CHUNKED_FORMAT = 'chunks'       # Extension: *.cvep.chunks
+CHUNK_DURATION = 10.0           # Seconds of signal per compressed chunk
+TRIAL_WINDOW_PAD = 2.0          # Seconds loaded around each trial (training)
+
+# EEG RING BUFFER
+EEG_RING_BUFFER_LENGTH = 300    # Seconds of EEG kept in shared memory
+
+# ONLINE RETENTION
+MIN_ONLINE_RETENTION = 30.0     # Minimum retention horizon (s)
+
+# CLOCK SYNCHRONIZATION
+CLOCK_SYNC_BURST = 10           # Pings sent when Unity connects
+CLOCK_SYNC_BURST_INTERVAL = 0.05    # Seconds between the pings of the burst
+CLOCK_SYNC_REPORT_EVERY = 12    # Periodic pings between consecutive reports
+
+# PHOTODIODE ALIGNMENT
+PHOTODIODE_MAX_LAG = 0.1        # Maximum display latency of the onsets (s)
+PHOTODIODE_TOLERANCE = 2        # Maximum jitter of the onsets (frames)
+
+# FRAME TIMING
+MAX_MISSED_FRAMES = 0           # Cycles with more dropped frames are flagged
+
+# LANGUAGE MODEL
+LM_ORDER = 4                    # Order of the character n-gram model
+LM_TEMPERATURE = 0.05           # Scale of the classifier scores (correlation)
+
+# CHANNEL SELECTION
+CHANNEL_SELECTION_FOLDS = 5     # Cross-validation folds (groups of trials)
+CHANNEL_SELECTION_TOLERANCE = 0.0   # Accuracy loss allowed to drop channels
+CHANNEL_SELECTION_MIN = 4       # Minimum number of selected channels
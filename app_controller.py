@@ -1,12 +1,18 @@
 # External modules
 import asyncio
+import json
 import subprocess
 import multiprocessing as mp
 import os
+import threading
+import time
 # Medusa modules
 import constants
 from .app_constants import *
 from tcp.async_tcp_server import TCPServer
+from . import utils_session_host
+from . import protocol
+from .clock_sync import ClockSynchronizer
 
 
 class AppController(TCPServer):
@@ -69,6 +75,18 @@ class AppController(TCPServer):
         self.server_state = mp.Value('i', SERVER_DOWN)
         self.unity_state = mp.Value('i', UNITY_DOWN)
 
+        # Session-host mode: Unity is kept open between runs
+        self.unity_closed = threading.Event()
+        self.unity_has_parameters = False
+
+        # Binary onsets (negotiated in the handshake, see protocol.py)
+        self.unity_binary_events = False
+        # Relabel messages (word suggestions), not supported by older builds
+        self.unity_relabel = False
+
+        # Offset of the Unity clock and round-trip latency
+        self.clock_sync = ClockSynchronizer()
+
     def closeEvent(self, event):
         self.close()
         event.accept()
@@ -82,12 +100,42 @@ class AppController(TCPServer):
         try:
             path_to_exe = os.path.dirname(__file__) +  \
                                '/unity/c-VEP Speller.exe'
-            subprocess.call([path_to_exe,
-                             self.app_settings.connection_settings.ip,
-                             str(self.app_settings.connection_settings.port)])
+            if self.app_settings.connection_settings.session_host:
+                self.start_session_host(path_to_exe)
+            else:
+                subprocess.call(
+                    [path_to_exe,
+                     self.app_settings.connection_settings.ip,
+                     str(self.app_settings.connection_settings.port)])
         except Exception as ex:
             raise ex
 
+    def start_session_host(self, path_to_exe):
+        """ Session-host mode: reuses the Unity app of the previous run if it
+        is still open (it reconnects to the server by itself), or starts a
+        detached one otherwise. Blocks until the run is finished. """
+        ip = self.app_settings.connection_settings.ip
+        port = self.app_settings.connection_settings.port
+        session = utils_session_host.read_session()
+        if session is not None and session['ip'] == ip and \
+                session['port'] == port and \
+                utils_session_host.is_process_alive(
+                    session['pid'], session.get('start_time')):
+            print(self.TAG, 'Reusing the Unity app (pid %i)' % session['pid'])
+        else:
+            pid = utils_session_host.start_detached(
+                [path_to_exe, ip, str(port), '--session-host'])
+            session = {'pid': pid, 'ip': ip, 'port': port,
+                       'start_time':
+                           utils_session_host.get_process_start_time(pid),
+                       'parameters': None}
+            utils_session_host.write_session(session)
+        # Unity sends "close" when the run is stopped
+        while not self.unity_closed.wait(0.5):
+            if not utils_session_host.is_process_alive(
+                    session['pid'], session['start_time']):
+                break
+
     def start_server(self):
         """ Starts the TCP server in MEDUSA. """
         try:
@@ -95,8 +143,45 @@ class AppController(TCPServer):
         except Exception as ex:
             raise ex
 
+    def start_clock_sync(self):
+        """ Starts the thread that sends pings to Unity: a burst when it
+        connects and one ping periodically until it is closed. """
+        interval = self.app_settings.connection_settings.clock_sync_interval
+        if interval <= 0:
+            return
+        threading.Thread(target=self.clock_sync_worker, args=(interval,),
+                         name='ClockSyncWorker', daemon=True).start()
+
+    def clock_sync_worker(self, interval):
+        for _ in range(CLOCK_SYNC_BURST):
+            self.send_command(self.clock_sync.make_ping())
+            time.sleep(CLOCK_SYNC_BURST_INTERVAL)
+        time.sleep(interval)
+        print(self.TAG, 'Clock sync: %s' % self.clock_sync.summary())
+        n_pings = 0
+        while self.server_state.value == SERVER_UP:
+            self.send_command(self.clock_sync.make_ping())
+            n_pings += 1
+            if n_pings % CLOCK_SYNC_REPORT_EVERY == 0:
+                print(self.TAG, 'Clock sync: %s' % self.clock_sync.summary())
+            if self.unity_closed.wait(interval):
+                break
+        print(self.TAG, 'Clock sync: %s' % self.clock_sync.summary())
+
+    def correct_onsets(self, msg):
+        """ Converts the onsets of an onset or batch message to the MEDUSA
+        clock, if enabled and the clock offset has been estimated. """
+        if self.app_settings.connection_settings.clock_sync_correction and \
+                self.clock_sync.is_calibrated():
+            onset = self.clock_sync.to_server_time(msg["onset"])
+            msg["onset"] = onset if onset.ndim > 0 else float(onset)
+        return msg
+
     # --------------- SEND MESSAGES TO UNITY --------------- #
-    def send_parameters(self):
+    def send_parameters(self, resume_info=None):
+        """ Sends the parameters of the run. If resume_info is not None,
+        Unity continues an interrupted run from resume_info['trial'] and
+        shows the previous selections (list of [matrix, row, col]). """
         print(self.TAG, "Setting parameters...")
         msg = dict()
         msg["event_type"] = "setParameters"
@@ -133,9 +218,45 @@ class AppController(TCPServer):
         msg["scenario_name"] = self.app_settings.background.scenario_name
         msg["color_background"] = self.app_settings.background.color_background
         msg["scenario_path"] = self.app_settings.background.scenario_path
+        msg["binaryEvents"] = \
+            self.app_settings.connection_settings.binary_events and \
+            self.unity_binary_events
+        msg["onsetBatchCycles"] = \
+            self.app_settings.connection_settings.onset_batch_cycles
+        msg["pipelinedTrials"] = \
+            self.app_settings.run_settings.pipelined_trials
+        # Run-specific parameters (always sent)
+        msg["resumeTrial"] = resume_info['trial'] if \
+            resume_info is not None else 0
+        msg["resumeSelections"] = resume_info['selections'] if \
+            resume_info is not None else None
 
+        if self.app_settings.connection_settings.session_host:
+            msg = self.get_session_host_parameters(msg)
         self.send_command(msg)
 
+    def get_session_host_parameters(self, msg):
+        """ Returns the message to send to a session-host Unity app. If it
+        already has the parameters of a previous run, only the modified ones
+        are sent. The full parameters are stored for the next run. """
+        msg = json.loads(json.dumps(msg))
+        session = utils_session_host.read_session()
+        if session is None:
+            return msg
+        prev_params = session['parameters']
+        session['parameters'] = msg
+        utils_session_host.write_session(session)
+        if not self.unity_has_parameters or prev_params is None:
+            return msg
+        diff = utils_session_host.get_parameters_diff(msg, prev_params)
+        diff["event_type"] = "setParameters"
+        diff["incremental"] = True
+        diff["resumeTrial"] = msg["resumeTrial"]
+        diff["resumeSelections"] = msg["resumeSelections"]
+        print(self.TAG, "Incremental parameters: %s" %
+              ', '.join(sorted(diff.keys())))
+        return diff
+
     def play(self):
         print(self.TAG, "Play!")
         msg = dict()
@@ -160,11 +281,26 @@ class AppController(TCPServer):
         msg["event_type"] = "stop"
         self.send_command(msg)
 
-    def notify_selection(self, selection_coords, selection_label):
+    def notify_selection(self, selection_coords, selection_label,
+                         trial=None):
+        """ Sends the selected command. The index of the decoded trial is
+        sent too, so Unity discards the results it is not waiting for. """
         print(self.TAG, "Notifying selection: " + selection_label)
         msg = dict()
         msg["event_type"] = "selection"
         msg["selection_coords"] = selection_coords
+        if trial is not None:
+            msg["trial"] = int(trial)
+        self.send_command(msg)
+
+    def relabel(self, matrix_idx, cells, texts):
+        """ Changes the text of some cells of a test matrix (e.g., the word
+        suggestions) without sending the parameters again. """
+        msg = dict()
+        msg["event_type"] = "relabel"
+        msg["matrix_idx"] = int(matrix_idx)
+        msg["cells"] = [int(c) for c in cells]
+        msg["texts"] = list(texts)
         self.send_command(msg)
 
     def notify_model_trained(self):
@@ -204,11 +340,19 @@ class AppController(TCPServer):
             JSON encoded string of the message received from the client,
             which will be decoded as a dictionary afterward.
         """
-        client_address, msg = super().on_data_received(
-            client_address, received_message)
+        t_received = time.time()
+        if protocol.is_binary_event(received_message):
+            # Binary onset or batch of onsets (see protocol.py)
+            msg = protocol.decode_binary_event(received_message)
+        else:
+            client_address, msg = super().on_data_received(
+                client_address, received_message)
         # Decoding
         if msg["event_type"] == "waiting":
             # Unity is UP and waiting for the parameters
+            self.unity_has_parameters = msg.get("hasParameters", False)
+            self.unity_binary_events = msg.get("binaryEvents", False)
+            self.unity_relabel = msg.get("relabel", False)
             self.unity_state.value = UNITY_UP
             print(self.TAG, "Unity app is opened.")
         elif msg["event_type"] == "ready":
@@ -219,6 +363,7 @@ class AppController(TCPServer):
         elif msg["event_type"] == "close":
             # Unity has closed the client
             self.unity_state.value = UNITY_DOWN
+            self.unity_closed.set()
             print(self.TAG, "Unity closed the client")
         elif msg["event_type"] == "finish":
             # Unity has finished the stimulation and standby until STOP button
@@ -227,10 +372,19 @@ class AppController(TCPServer):
         elif msg["event_type"] == "train" or msg["event_type"] == "test":
             # Onset information. E.g.: msg = {"event_type":"train","target":"C",
             # "cycle":0,"onset":5393}
-            self.callback.process_event(msg)
+            self.callback.process_event(self.correct_onsets(msg))
+        elif msg["event_type"] in protocol.BATCH_EVENT_TYPES:
+            # Onsets of several cycles (see protocol.py)
+            self.callback.process_event(self.correct_onsets(msg))
+        elif msg["event_type"] == "pong":
+            # Reply to a ping (see clock_sync.py)
+            self.clock_sync.on_pong(msg, t_received)
         elif msg["event_type"] == "resize":
             # Raster latencies information
             self.callback.process_event(msg)
+        elif msg["event_type"] == "frames":
+            # Frame-timing statistics of the cycles of a trial
+            self.callback.process_event(msg)
         elif msg["event_type"] == "trainModelPlease":
             # Unity is requesting MEDUSA to train the model with the
             # received trials
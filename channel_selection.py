@@ -0,0 +1,156 @@
+import numpy as np
+from scipy import signal as sp_signal
+
+
+def get_channel_indexes(l_cha, subset):
+    """ Returns the indexes of the channels of subset in l_cha (in the order
+    of l_cha). Raises ValueError if a channel is missing. """
+    missing = [c for c in subset if c not in l_cha]
+    if len(missing) > 0:
+        raise ValueError('The model uses channels that are not in the EEG '
+                         'stream: %s' % ', '.join(missing))
+    return [i for i, c in enumerate(l_cha) if c in subset]
+
+
+def get_epochs(times, signal, cvep_data, fs, band, order=7):
+    """ Band-pass filters a calibration recording and extracts one epoch
+    (one cycle of the sequence) per onset.
+
+    Returns
+    -------
+    epochs: numpy.ndarray
+        Epochs with shape [n_epochs x n_samples x n_channels].
+    sequences: list
+        Sequence displayed by the target of each epoch.
+    trials: numpy.ndarray
+        Trial of each epoch.
+    """
+    sos = sp_signal.butter(order, band, btype='bandpass', output='sos', fs=fs)
+    filtered = sp_signal.sosfiltfilt(sos, np.asarray(signal, dtype=float),
+                                     axis=0)
+    commands = [cvep_data.commands_info[int(m)][str(int(c))]['sequence']
+                for m, c in zip(cvep_data.matrix_idx, cvep_data.command_idx)]
+    seq_len = len(commands[0])
+    n_samples = int(round(seq_len / float(cvep_data.fps_resolution) * fs))
+    starts = np.searchsorted(times, cvep_data.onsets)
+    valid = starts + n_samples <= filtered.shape[0]
+    epochs = np.stack([filtered[s:s + n_samples] for s in starts[valid]])
+    sequences = [tuple(c) for c, v in zip(commands, valid) if v]
+    trials = np.asarray(cvep_data.trial_idx)[valid]
+    return epochs, sequences, trials
+
+
+def _cca_filters(cxx, cyy, cxy, reg=1e-6):
+    """ First pair of canonical vectors given the covariance matrices. """
+    n = cxx.shape[0]
+    cxx = cxx + reg * np.trace(cxx) / n * np.eye(n)
+    cyy = cyy + reg * np.trace(cyy) / n * np.eye(n)
+    m = np.linalg.solve(cxx, cxy) @ np.linalg.solve(cyy, cxy.T)
+    eigval, eigvec = np.linalg.eig(m)
+    w = np.real(eigvec[:, np.argmax(np.real(eigval))])
+    v = np.linalg.solve(cyy, cxy.T @ w)
+    return w, v
+
+
+class _Fold:
+
+    def __init__(self, epochs, sequences, test, lags):
+        """ Templates and covariance matrices of the training epochs of a
+        fold, computed once for all the channels. The CCA of a subset of
+        channels only needs the corresponding submatrices. """
+        train = ~test
+        self.templates = dict()
+        for seq in set(sequences):
+            mask = train & np.array([s == seq for s in sequences])
+            if np.any(mask):
+                self.templates[seq] = np.mean(epochs[mask], axis=0)
+        keep = train & np.array([s in self.templates for s in sequences])
+        x = epochs[keep].reshape(-1, epochs.shape[2])
+        y = np.concatenate([self.templates[s] for s, k in
+                            zip(sequences, keep) if k])
+        x = x - np.mean(x, axis=0)
+        y = y - np.mean(y, axis=0)
+        self.cxx, self.cyy, self.cxy = x.T @ x, y.T @ y, x.T @ y
+        self.test_epochs = epochs[test]
+        self.test_sequences = [s for s, t in zip(sequences, test) if t]
+        self.lags = lags
+
+    def get_hits(self, channels):
+        """ Returns the number of test epochs whose best-correlated circular
+        shift of the template is the displayed one (lag 0), and the sum of
+        the margins between the correlation with the displayed shift and the
+        best of the others (used to break ties). """
+        idx = np.ix_(channels, channels)
+        w, v = _cca_filters(self.cxx[idx], self.cyy[idx], self.cxy[idx])
+        shifted = dict()
+        for seq, template in self.templates.items():
+            t = template[:, channels] @ v
+            s = np.stack([np.roll(t, lag) for lag in self.lags])
+            s = s - np.mean(s, axis=1, keepdims=True)
+            shifted[seq] = s / np.linalg.norm(s, axis=1, keepdims=True)
+        hits, margin = 0, 0.0
+        for epoch, seq in zip(self.test_epochs, self.test_sequences):
+            if seq not in shifted:
+                continue
+            x = epoch[:, channels] @ w
+            x = x - np.mean(x)
+            corr = shifted[seq] @ x / np.linalg.norm(x)
+            hits += int(np.argmax(corr) == 0)
+            margin += corr[0] - np.max(corr[1:])
+        return hits, margin
+
+
+def rank_channels(epochs, sequences, trials, lags, n_folds=5):
+    """ Ranks the channels by their contribution to the cross-validated
+    accuracy of a circular-shifting decoder (CCA spatial filter and
+    correlation with the shifted templates).
+
+    Greedy forward selection: at each step, the channel whose addition gives
+    the highest accuracy is added (ties are broken by the margin of the
+    correlations). The folds are groups of whole trials.
+
+    Parameters
+    ----------
+    epochs: numpy.ndarray
+        Epochs with shape [n_epochs x n_samples x n_channels].
+    sequences: list
+        Sequence of each epoch (see get_epochs).
+    trials: numpy.ndarray
+        Trial of each epoch (epochs of the same trial are in the same fold).
+    lags: list
+        Circular shifts (in samples) of the commands, the first one must be
+        0 (the displayed sequence).
+    n_folds: int
+        Number of folds.
+
+    Returns
+    -------
+    ranking: list
+        Channel indexes, from the most to the least relevant.
+    accuracy: list
+        Cross-validated accuracy after adding each channel of the ranking.
+    """
+    unique_trials = np.unique(trials)
+    n_folds = max(2, min(n_folds, unique_trials.shape[0]))
+    fold_of_trial = {t: i % n_folds for i, t in enumerate(unique_trials)}
+    folds = [_Fold(epochs, sequences,
+                   np.array([fold_of_trial[t] == f for t in trials]), lags)
+             for f in range(n_folds)]
+    n_test = sum(len(f.test_epochs) for f in folds)
+    ranking, accuracy = list(), list()
+    remaining = list(range(epochs.shape[2]))
+    while len(remaining) > 0:
+        scores = [np.sum([f.get_hits(ranking + [c]) for f in folds], axis=0)
+                  for c in remaining]
+        best = max(range(len(remaining)), key=lambda i: tuple(scores[i]))
+        ranking.append(remaining.pop(best))
+        accuracy.append(scores[best][0] / n_test)
+    return ranking, accuracy
+
+
+def select_channels(ranking, accuracy, tolerance=0.0, min_channels=1):
+    """ Returns the smallest subset of the ranking whose accuracy is within
+    `tolerance` of the best one (sorted by channel index). """
+    accuracy = np.asarray(accuracy)
+    n = int(np.argmax(accuracy >= np.max(accuracy) - tolerance)) + 1
+    return sorted(ranking[:max(n, min_channels)])
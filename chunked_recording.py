@@ -0,0 +1,250 @@
+import copy
+import importlib
+import io
+import json
+import zipfile
+
+import numpy as np
+
+
+class ChunkedRecording:
+
+    INDEX_FILE = 'index.json'
+    VERSION = 1
+
+    def __init__(self, file_path):
+        """ Class that reads recordings saved in the chunked format.
+
+        The chunked format is a zip container in which each stream is split
+        into time chunks that are stored as individually compressed .npy
+        members. An index (JSON) stores the recording info, the serialized
+        experiment data (e.g., onsets and CVEPSpellerData metadata) and the
+        time span of each chunk, so that only the chunks overlapping the
+        requested windows are decompressed.
+
+        Parameters
+        ----------
+        file_path: basestring
+            Path of the recording (see `save`).
+        """
+        self.file_path = file_path
+        self._zip = zipfile.ZipFile(file_path, 'r')
+        self.index = json.loads(self._zip.read(self.INDEX_FILE))
+        self.info = self.index['info']
+        self.streams = self.index['streams']
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_experiment_data(self, key):
+        """ Returns the experiment data object stored with the given key. """
+        exp = self.index['experiments'][key]
+        return _deserialize(exp)
+
+    def read(self, key, t0=None, t1=None):
+        """ Returns the times and signal of a stream within [t0, t1]. Only
+        the chunks that overlap the window are decompressed. """
+        return self.read_windows(key, [(t0, t1)])
+
+    def read_windows(self, key, windows):
+        """ Returns the concatenated samples of a stream that fall into the
+        given (sorted, non-overlapping) list of windows (t0, t1). None
+        values in a window are treated as unbounded. """
+        stream = self.streams[key]
+        times, signal = list(), list()
+        cache = dict()
+        for t0, t1 in windows:
+            t0 = -np.inf if t0 is None else t0
+            t1 = np.inf if t1 is None else t1
+            for k, chunk in enumerate(stream['chunks']):
+                if chunk['t1'] < t0 or chunk['t0'] > t1:
+                    continue
+                if k not in cache:
+                    cache = {k: (self._load(key, 'times', k),
+                                 self._load(key, 'signal', k))}
+                c_times, c_signal = cache[k]
+                mask = (c_times >= t0) & (c_times <= t1)
+                times.append(c_times[mask])
+                signal.append(c_signal[mask])
+        if len(times) == 0:
+            return np.zeros((0,)), np.zeros((0, len(stream['l_cha'])))
+        return np.concatenate(times), np.concatenate(signal)
+
+    def to_recording(self, windows=None):
+        """ Returns a medusa Recording with the stored data. If `windows` is
+        a list of (t0, t1) tuples, only those windows of each stream are
+        loaded (see `get_trial_windows`). """
+        from medusa import components
+        info = dict(self.info)
+        rec = components.Recording(subject_id=info.pop('subject_id'),
+                                   recording_id=info.pop('recording_id'),
+                                   **info)
+        for key, exp in self.index['experiments'].items():
+            rec.add_experiment_data(_deserialize(exp), key)
+        for key, stream in self.streams.items():
+            if windows is None:
+                times, signal = self.read(key)
+            else:
+                times, signal = self.read_windows(key, windows)
+            biosignal_class = _import_class(stream['module_name'],
+                                            stream['class_name'])
+            kwargs = dict()
+            if stream['lsl_stream_info'] is not None:
+                kwargs['lsl_stream_info'] = stream['lsl_stream_info']
+            biosignal = biosignal_class(
+                times=times,
+                signal=signal,
+                fs=stream['fs'],
+                channel_set=_deserialize(stream['channel_set']),
+                **kwargs)
+            rec.add_biosignal(biosignal, key)
+        return rec
+
+    def _load(self, key, name, k):
+        member = '%s/%s_%i.npy' % (key, name, k)
+        return np.load(io.BytesIO(self._zip.read(member)))
+
+
+def save(file_path, info, experiments, biosignals, chunk_duration=10.0,
+         blocks=None):
+    """ Saves a recording in the chunked format (see `ChunkedRecording`).
+
+    Parameters
+    ----------
+    file_path: basestring
+        Path of the output file.
+    info: dict
+        Recording info: subject_id, recording_id, date and other fields.
+    experiments: dict
+        Experiment data objects (e.g., CVEPSpellerData) by key.
+    biosignals: dict
+        Biosignal objects (e.g., meeg.EEG) by key.
+    chunk_duration: float
+        Duration of each chunk in seconds.
+    blocks: dict or None
+        Iterables of (times, signal) blocks by key (e.g., the chunks of a
+        spool, see RecordingWriter.iter_chunks). The samples of these streams
+        are written block by block instead of being taken from the biosignal,
+        so they are never assembled in memory.
+    """
+    index = {'version': ChunkedRecording.VERSION,
+             'info': info,
+             'experiments': dict(),
+             'streams': dict()}
+    with zipfile.ZipFile(file_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for key, exp in experiments.items():
+            index['experiments'][key] = _serialize(exp)
+        for key, biosignal in biosignals.items():
+            if blocks is not None and key in blocks:
+                stream_blocks = blocks[key]
+            else:
+                stream_blocks = [(biosignal.times, biosignal.signal)]
+            chunk_len = max(1, int(round(chunk_duration * biosignal.fs)))
+            chunks = list()
+            for times, signal in stream_blocks:
+                times, signal = np.asarray(times), np.asarray(signal)
+                n = min(times.shape[0], signal.shape[0])
+                for start in range(0, n, chunk_len):
+                    stop = min(start + chunk_len, n)
+                    k = len(chunks)
+                    _write_array(zf, '%s/times_%i.npy' % (key, k),
+                                 times[start:stop])
+                    _write_array(zf, '%s/signal_%i.npy' % (key, k),
+                                 signal[start:stop])
+                    chunks.append({'n_samples': stop - start,
+                                   't0': float(times[start]),
+                                   't1': float(times[stop - 1])})
+            index['streams'][key] = {
+                'class_name': type(biosignal).__name__,
+                'module_name': type(biosignal).__module__,
+                'fs': biosignal.fs,
+                'l_cha': list(biosignal.channel_set.l_cha) if
+                hasattr(biosignal.channel_set, 'l_cha') else
+                [str(i) for i in
+                 range(np.asarray(biosignal.signal).shape[1])],
+                'channel_set': _serialize(biosignal.channel_set),
+                'lsl_stream_info': getattr(biosignal, 'lsl_stream_info', None),
+                'chunks': chunks
+            }
+        zf.writestr(ChunkedRecording.INDEX_FILE,
+                    json.dumps(index, default=_json_default))
+
+
+def load(file_path, windows=None):
+    """ Loads a recording in the chunked format as a medusa Recording. """
+    with ChunkedRecording(file_path) as chunked_rec:
+        return chunked_rec.to_recording(windows)
+
+
+def get_trial_windows(cvep_data, pad=2.0):
+    """ Returns the time windows that contain the trials of a
+    CVEPSpellerData instance, extended by `pad` seconds at both sides to
+    leave room for the filter transients.
+
+    Returns
+    -------
+    windows: list of tuples (t0, t1)
+        Sorted and non-overlapping windows.
+    """
+    onsets = np.asarray(cvep_data.onsets)
+    if onsets.shape[0] == 0:
+        return list()
+    trial_idx = np.asarray(cvep_data.trial_idx)
+    seq_len = len(list(cvep_data.commands_info[0].values())[0]['sequence'])
+    cycle_dur = seq_len / float(cvep_data.fps_resolution)
+    windows = list()
+    for t in np.unique(trial_idx):
+        t_onsets = onsets[trial_idx == t]
+        windows.append((np.min(t_onsets) - pad,
+                        np.max(t_onsets) + cycle_dur + pad))
+    windows.sort()
+    merged = [windows[0]]
+    for t0, t1 in windows[1:]:
+        if t0 <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], t1))
+        else:
+            merged.append((t0, t1))
+    return merged
+
+
+def _write_array(zf, name, array):
+    buffer = io.BytesIO()
+    np.save(buffer, np.ascontiguousarray(array))
+    zf.writestr(name, buffer.getvalue())
+
+
+def _serialize(obj):
+    """ Serializes an object using its `to_serializable_obj` method (medusa
+    SerializableComponent) or as plain JSON otherwise. """
+    if hasattr(obj, 'to_serializable_obj'):
+        # Some components modify themselves when serialized
+        return {'class_name': type(obj).__name__,
+                'module_name': type(obj).__module__,
+                'data': copy.deepcopy(obj).to_serializable_obj()}
+    return {'class_name': None, 'module_name': None, 'data': obj}
+
+
+def _deserialize(serialized):
+    if serialized['class_name'] is None:
+        return serialized['data']
+    cls = _import_class(serialized['module_name'], serialized['class_name'])
+    return cls.from_serializable_obj(serialized['data'])
+
+
+def _import_class(module_name, class_name):
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def _json_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError('Object of type %s is not JSON serializable' %
+                    type(obj).__name__)
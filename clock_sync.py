@@ -0,0 +1,125 @@
+import collections
+import threading
+import time
+
+import numpy as np
+
+
+class ClockSynchronizer:
+
+    def __init__(self, max_samples=512, best_fraction=0.5, min_samples=3,
+                 min_drift_span=30.0, clock=time.time):
+        """ Class that estimates the offset and drift of the Unity clock with
+        respect to the MEDUSA clock using NTP-style ping/pong exchanges.
+
+        For each exchange, MEDUSA stores the send time (t0), Unity replies with
+        its receive (t1) and send (t2) times, and MEDUSA stores the receive
+        time (t3). Then, offset = ((t1 - t0) + (t2 - t3)) / 2 and
+        rtt = (t3 - t0) - (t2 - t1). Exchanges with a long RTT are the ones
+        with the largest asymmetric delays, so only the fraction with the
+        shortest RTT is used. When the samples span enough time, the offset is
+        modelled as a linear function of time (drift).
+
+        Parameters
+        ----------
+        max_samples: int
+            Number of exchanges kept (the oldest are discarded).
+        best_fraction: float
+            Fraction of the exchanges with the lowest RTT used in the fit.
+        min_samples: int
+            Minimum number of exchanges to consider the estimate valid.
+        min_drift_span: float
+            Minimum time span (s) of the exchanges to estimate the drift.
+        clock: callable
+            Clock of MEDUSA. It must share the epoch of the onsets and the EEG
+            timestamps (Unix time).
+        """
+        self.best_fraction = best_fraction
+        self.min_samples = min_samples
+        self.min_drift_span = min_drift_span
+        self.clock = clock
+        self.lock = threading.Lock()
+        # (server time, offset, rtt) of each exchange
+        self.samples = collections.deque(maxlen=max_samples)
+        self._pending = collections.OrderedDict()
+        self._seq = 0
+        self.offset = 0.0
+        self.drift = 0.0
+        self.t_ref = 0.0
+
+    def make_ping(self):
+        """ Returns a new ping message. """
+        with self.lock:
+            self._seq += 1
+            # Pongs that never arrived (e.g., Unity builds without support)
+            while len(self._pending) >= 64:
+                self._pending.popitem(last=False)
+            t0 = self.clock()
+            self._pending[self._seq] = t0
+            return {'event_type': 'ping', 'seq': self._seq, 't0': t0}
+
+    def on_pong(self, msg, t3=None):
+        """ Updates the estimate with a pong message. t3 is the time at which
+        it was received (now if None).
+
+        Returns
+        -------
+        sample: tuple (offset, rtt) or None
+            Values of this exchange in seconds, or None if the pong does not
+            match any ping.
+        """
+        t3 = self.clock() if t3 is None else t3
+        with self.lock:
+            t0 = self._pending.pop(msg['seq'], None)
+            if t0 is None:
+                return None
+            t1, t2 = msg['t1'], msg['t2']
+            rtt = (t3 - t0) - (t2 - t1)
+            offset = ((t1 - t0) + (t2 - t3)) / 2
+            self.samples.append((0.5 * (t0 + t3), offset, rtt))
+            self._fit()
+            return offset, rtt
+
+    def _fit(self):
+        samples = np.array(self.samples)
+        rtt = samples[:, 2]
+        best = samples[rtt <= np.quantile(rtt, self.best_fraction)]
+        self.t_ref = best[-1, 0]
+        if best.shape[0] >= self.min_samples and \
+                best[-1, 0] - best[0, 0] >= self.min_drift_span:
+            self.drift, self.offset = np.polyfit(best[:, 0] - self.t_ref,
+                                                 best[:, 1], 1)
+        else:
+            self.drift, self.offset = 0.0, float(np.median(best[:, 1]))
+
+    def is_calibrated(self):
+        return len(self.samples) >= self.min_samples
+
+    def offset_at(self, t):
+        """ Estimated offset (Unity - MEDUSA) at time t (s). """
+        return self.offset + self.drift * (np.asarray(t) - self.t_ref)
+
+    def to_server_time(self, t_unity):
+        """ Converts Unity timestamps (scalar or array) to the MEDUSA clock.
+        """
+        with self.lock:
+            t_unity = np.asarray(t_unity, dtype=float)
+            return t_unity - self.offset_at(t_unity)
+
+    def get_rtt_percentiles(self, percentiles=(50, 95, 99)):
+        """ Returns the RTT percentiles (s) of the stored exchanges. """
+        with self.lock:
+            if len(self.samples) == 0:
+                return None
+            rtt = np.array(self.samples)[:, 2]
+            return np.percentile(rtt, percentiles)
+
+    def summary(self):
+        """ Returns a printable summary of the estimates. """
+        rtt = self.get_rtt_percentiles()
+        if rtt is None:
+            return 'no pong received'
+        return 'offset %.2f ms, drift %.2f ppm, RTT p50/p95/p99 ' \
+               '%.2f/%.2f/%.2f ms (%i exchanges)' % (
+                   self.offset * 1e3, self.drift * 1e6, rtt[0] * 1e3,
+                   rtt[1] * 1e3, rtt[2] * 1e3, len(self.samples))
@@ -1,26 +1,29 @@
+import time
+_t_import = time.perf_counter()
 from PySide6.QtUiTools import loadUiType
 from PySide6 import QtGui, QtWidgets, QtCore
 from PySide6.QtCore import Signal, Qt
 from PySide6.QtWidgets import QSizePolicy, QApplication, QColorDialog
 from gui import gui_utils
 from . import settings
+from .app_constants import PROFILE_STARTUP, CHUNKED_FORMAT, TRIAL_WINDOW_PAD, \
+    MAX_MISSED_FRAMES, CHANNEL_SELECTION_FOLDS, CHANNEL_SELECTION_TOLERANCE, \
+    CHANNEL_SELECTION_MIN, CVEP_DATA_KEY
+from .utils_profiling import StartupProfiler
+from .utils_monitor_rates import monitor_rates_cache
+from . import chunked_recording
+from . import frame_stats
+from . import raster_latencies
 import os
 import glob
 import json
 from functools import partial
-from medusa.bci import cvep_spellers
-from medusa import components
 import pickle
 from gui.qt_widgets.notifications import NotificationStack
 from gui.qt_widgets.dialogs import error_dialog, warning_dialog
-from medusa.bci.cvep_spellers import LFSR, LFSR_PRIMITIVE_POLYNOMIALS
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FormatStrFormatter
 import numpy as np
-# from matplotlib.backends.backend_qt import FigureCanvasQT
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
-from .utils_win_monitor_rates import get_monitor_rates
+# Note: matplotlib and medusa.bci.cvep_spellers (training, LFSR) are imported
+# on first use to speed up the opening of the config dialog
 
 # Load the .ui files
 ui_main_file = loadUiType(os.path.dirname(__file__) + "/config.ui")[0]
@@ -28,12 +31,14 @@ ui_target_file = loadUiType(os.path.dirname(__file__) +
                                 "/config_target.ui")[0]
 ui_encoding_file = loadUiType(os.path.dirname(__file__) +
                                 "/config_encoding.ui")[0]
+_t_import = time.perf_counter() - _t_import
 
 
 class Config(QtWidgets.QDialog, ui_main_file):
     """ This class provides graphical configuration for the app """
 
     close_signal = Signal(object)
+    monitor_rates_signal = Signal(object)
 
     def __init__(self, sett, medusa_interface,
                  working_lsl_streams_info, theme_colors=None):
@@ -47,10 +52,14 @@ class Config(QtWidgets.QDialog, ui_main_file):
             directory
         """
         QtWidgets.QDialog.__init__(self)
+        self.TAG = '[apps/cvep_speller/config] '
+        self.profiler = StartupProfiler(self.TAG, enabled=PROFILE_STARTUP,
+                                        t0=time.perf_counter() - _t_import)
+        self.profiler.checkpoint('module imported')
         self.setWindowFlags(
             self.windowFlags() & ~Qt.WindowContextHelpButtonHint)
         self.setupUi(self)
-        self.TAG = '[apps/cvep_speller/config] '
+        self.profiler.checkpoint('ui set up')
 
         # Load default settings
         self.settings = sett.Settings() if sett is None else sett
@@ -62,6 +71,17 @@ class Config(QtWidgets.QDialog, ui_main_file):
         self.setWindowTitle('c-VEP Speller Configuration')
         self.changes_made = False
         self.notifications = NotificationStack(parent=self, timer_ms=500)
+        # Persistent widget models of the matrices (see update_matrix_tabs)
+        self.matrix_widgets = {'train': [], 'test': []}
+
+        # Monitor rates are queried off the GUI thread and cached
+        self.monitors = None
+        self.monitor_rates_signal.connect(self.on_monitor_rates_received)
+        QApplication.instance().screenAdded.connect(
+            self.on_screens_changed)
+        QApplication.instance().screenRemoved.connect(
+            self.on_screens_changed)
+        monitor_rates_cache.get_async(self.monitor_rates_signal.emit)
 
         # Adjust parameters depending on default option
         if self.comboBox_mode.currentText() == 'Online':
@@ -142,7 +162,10 @@ class Config(QtWidgets.QDialog, ui_main_file):
 
         # Set settings to GUI
         self.set_settings_to_gui()
-        self.on_seqlen_changed()
+        # The encoding parameters need medusa.bci.cvep_spellers, which is
+        # loaded once the window is shown
+        QtCore.QTimer.singleShot(0, self.on_seqlen_changed)
+        self.profiler.checkpoint('settings set to gui')
         self.notifications.new_notification('Default settings loaded')
 
         # Train model items
@@ -154,11 +177,29 @@ class Config(QtWidgets.QDialog, ui_main_file):
         # Application ready
         self.setModal(True)
         self.show()
+        self.profiler.checkpoint('first window shown')
+        self.profiler.report()
 
     # --------------------- Settings updating --------------------
     def on_fpsresolution_changed(self):
+        self.update_monitor_rates_text()
+        self.update_table_cutoffs()
+
+    def on_monitor_rates_received(self, monitors):
+        self.monitors = monitors
+        self.update_monitor_rates_text()
+
+    def on_screens_changed(self, screen):
+        monitor_rates_cache.invalidate()
+        monitor_rates_cache.get_async(self.monitor_rates_signal.emit)
+
+    def update_monitor_rates_text(self):
         self.textEdit_monitor_rates.clear()
-        monitors = get_monitor_rates()
+        if self.monitors is None:
+            self.textEdit_monitor_rates.append(
+                "Detecting connected monitors...")
+            return
+        monitors = self.monitors
         if len(monitors) == 0:
             text = "No connected monitor is detected. The app cannot " \
                    "guarantee a real updating using %s Hz" % \
@@ -173,7 +214,7 @@ class Config(QtWidgets.QDialog, ui_main_file):
                 rates.append(rate)
             self.textEdit_monitor_rates.append(text)
 
-            if len(rates) > 1 and not np.all(np.array(rates == rates[0])):
+            if len(rates) > 1 and not np.all(np.array(rates) == rates[0]):
                 self.textEdit_monitor_rates.append(
                     "<span style='color: yellow; font-weight: \"bold\"'>"
                     "\n[Warning]: the monitors have different refresh "
@@ -190,7 +231,6 @@ class Config(QtWidgets.QDialog, ui_main_file):
                         "able to reach the desired Target FPS! The "
                         "paradigm will not work.</span>\n"
                     )
-        self.update_table_cutoffs()
 
     def on_mode_changed(self):
         if self.comboBox_mode.currentText() == 'Online':
@@ -219,6 +259,7 @@ class Config(QtWidgets.QDialog, ui_main_file):
             self.spinBox_traintrials.setVisible(True)
 
     def on_seqlen_changed(self):
+        from medusa.bci.cvep_spellers import LFSR_PRIMITIVE_POLYNOMIALS
         mseqlen = int(self.comboBox_seqlength.currentText())
 
         # Compute parameters
@@ -289,6 +330,40 @@ class Config(QtWidgets.QDialog, ui_main_file):
         self.checkBox_photodiode.setChecked(
             self.settings.run_settings.enable_photodiode)
 
+        # Online performance
+        self.doubleSpinBox_retention.setValue(
+            self.settings.run_settings.online_retention)
+        self.checkBox_session_host.setChecked(
+            self.settings.connection_settings.session_host)
+        self.checkBox_binary_events.setChecked(
+            self.settings.connection_settings.binary_events)
+        self.spinBox_onset_batch.setValue(
+            self.settings.connection_settings.onset_batch_cycles)
+        self.doubleSpinBox_clock_sync.setValue(
+            self.settings.connection_settings.clock_sync_interval)
+        self.checkBox_clock_correction.setChecked(
+            self.settings.connection_settings.clock_sync_correction)
+        self.lineEdit_photodiode_channel.setText(
+            self.settings.run_settings.photodiode_channel)
+        self.lineEdit_photodiode_stream.setText(
+            self.settings.run_settings.photodiode_stream)
+        self.checkBox_exclude_bad_cycles.setChecked(
+            self.settings.run_settings.exclude_bad_cycles)
+        self.lineEdit_lm_corpus.setText(
+            self.settings.run_settings.lm_corpus_path)
+        self.doubleSpinBox_lm_weight.setValue(
+            self.settings.run_settings.lm_weight)
+        self.lineEdit_vocabulary.setText(
+            self.settings.run_settings.vocabulary_path)
+        self.lineEdit_suggestion_cells.setText(', '.join(
+            str(c) for c in self.settings.run_settings.suggestion_cells))
+        self.checkBox_pipelined_trials.setChecked(
+            self.settings.run_settings.pipelined_trials)
+        self.lineEdit_ensemble_models.setText('; '.join(
+            self.settings.run_settings.ensemble_model_paths))
+        self.comboBox_ensemble_rule.setCurrentText(
+            self.settings.run_settings.ensemble_rule)
+
         # Timings
         self.doubleSpinBox_t_prev_text.setValue(
             self.settings.timings.t_prev_text)
@@ -340,193 +415,173 @@ class Config(QtWidgets.QDialog, ui_main_file):
             self.settings.background.scenario_path)
 
 
-        # Useful PyQt policies
-        policy_max_pre = QSizePolicy(QSizePolicy.Maximum, QSizePolicy.Preferred)
-        policy_max_max = QSizePolicy(QSizePolicy.Expanding,
-                                     QSizePolicy.Expanding)
-        policy_fix_fix = QSizePolicy(QSizePolicy.Fixed, QSizePolicy.Fixed)
-
-        # Test matrices
-        # Create the required number of tabs
-        n_extra = len(self.settings.matrices['test']) - \
-                  self.widget_nested_test.count()
-        for t in range(1, n_extra + 1):
-            mtx_widget_ = QtWidgets.QWidget(self.widget_nested_test)
-            mtx_idx_ = self.nested_box.count() - 1
-            self.widget_nested_test.insertTab(mtx_idx_, mtx_widget_,
-                                              'Matrix #' + str(mtx_idx_))
-            self.widget_nested_test.setCurrentIndex(0)
-        # Create each test matrix
-        for m in range(len(self.settings.matrices['test'])):
-            # Set the current index and create the general layout
-            curr_mtx = self.settings.matrices['test'][m]
-            self.widget_nested_test.setCurrentIndex(m)
-            global_layout = QtWidgets.QVBoxLayout()
-            # Create the result text frame
-            result_frame = QtWidgets.QFrame()
-            result_text = QtWidgets.QLabel('B C I')
-            result_text.setObjectName('label_result_text')
-            result_text.setAlignment(QtCore.Qt.AlignLeft)
-            result_title = QtWidgets.QLabel('RESULT ')
-            result_title.setObjectName('label_result_title')
-            result_title.setAlignment(QtCore.Qt.AlignLeft)
-            result_title.setSizePolicy(policy_max_pre)
-            fps_monitor = QtWidgets.QLabel(
-                'FPS @%iHz' % self.settings.run_settings.fps_resolution)
-            fps_monitor.setObjectName('label_fps')
-            fps_monitor.setAlignment(QtCore.Qt.AlignRight)
-            result_layout = QtWidgets.QHBoxLayout()
-            result_layout.addWidget(result_title)
-            result_layout.addWidget(result_text)
-            result_layout.addWidget(fps_monitor)
-            result_frame.setLayout(result_layout)
-            global_layout.addWidget(result_frame)
-            # Customize the result text
-            gui_utils.modify_properties(
-                result_title, {
-                    "font-style": "italic",
-                    "color": self.settings.colors.color_result_info_text[:7]
-                })
-            gui_utils.modify_property(
-                result_frame, "background-color",
-                self.settings.colors.color_result_info_box[:7])
-            gui_utils.modify_property(
-                fps_monitor, "color",
-                self.settings.colors.color_fps_good[:7])
-            # Create a new layout for the commands
-            new_layout = QtWidgets.QGridLayout()
-            new_layout.setContentsMargins(0, 0, 0, 0)
-            new_layout.setSpacing(10)
-            new_layout.setContentsMargins(10, 10, 10, 10)
-            # Add buttons as commands
-            for r in range(curr_mtx.n_row):
-                for c in range(curr_mtx.n_col):
-                    key_ = curr_mtx.matrix_list[r][c].sequence[0]
-                    temp_button = QtWidgets.QToolButton()
-                    temp_button.setObjectName('btn_command')
-                    temp_button.setText(curr_mtx.matrix_list[r][c].text)
-                    temp_button.clicked.connect(self.btn_command_on_click(r, c))
-                    temp_button.setMinimumSize(60, 60)
-                    temp_button.setSizePolicy(policy_max_max)
-                    box_color_ = self.settings.colors.color_box_0 if \
-                        key_ == 0 else self.settings.colors.color_box_1
-                    text_color_ = self.settings.colors.color_text_0 if \
-                        key_ == 0 else self.settings.colors.color_text_1
-                    gui_utils.modify_properties(
-                        temp_button, {
-                            "background-color": box_color_,
-                            "font-family": 'sans-serif, Helvetica, Arial',
-                            'font-size': '30px',
-                            'color': text_color_,
-                            'border': 'transparent'
-                        })
-                    new_layout.addWidget(temp_button, r, c)
-            global_layout.addLayout(new_layout)
-            global_layout.setSpacing(0)
-            global_layout.setContentsMargins(0, 0, 0, 0)
-            # Update the tab
-            new_tab = QtWidgets.QFrame()
-            new_tab.setLayout(global_layout)
-            gui_utils.modify_property(new_tab, 'background-color',
-                                      self.settings.background.color_background[:7])
-            self.update_tab(self.widget_nested_test, m, new_tab)
+        # Matrices (only the differences with the current widgets are applied)
+        self.update_matrix_tabs(self.widget_nested_test, 'test')
         self.spinBox_nrow.setValue(self.settings.matrices['test'][0].n_row)
         self.spinBox_ncol.setValue(self.settings.matrices['test'][0].n_col)
+        self.update_matrix_tabs(self.widget_nested_train, 'train')
+
+        # Filter cutoffs according to fps_resolution
+        self.update_table_cutoffs()
+
+        # Sequence length in test
+        seqlen = len(self.settings.matrices['test'][0].item_list[0].sequence)
+        index = self.comboBox_seqlength.findText(str(seqlen), Qt.MatchFixedString)
+        self.comboBox_seqlength.setCurrentIndex(index)
+
+    def update_matrix_tabs(self, tabwidget, matrix_type):
+        """ Updates the tabs that display the train or test matrices.
+
+        The widgets of each matrix are kept in ``self.matrix_widgets``, so that
+        only the differences are applied: a tab is rebuilt only if the shape of
+        its matrix changes, texts are updated in place, and buttons are
+        restyled only when their colors change.
 
-        # Train matrices
+        Parameters
+        ----------
+        tabwidget: QtWidgets.QTabWidget
+            Tab widget that contains the matrices.
+        matrix_type: str
+            Type of the matrices: 'train' or 'test'.
+        """
+        matrices = self.settings.matrices[matrix_type]
+        models = self.matrix_widgets[matrix_type]
         # Create the required number of tabs
-        n_extra = len(self.settings.matrices['train']) - \
-                  self.widget_nested_train.count()
+        n_extra = len(matrices) - tabwidget.count()
         for t in range(1, n_extra + 1):
-            mtx_widget_ = QtWidgets.QWidget(self.widget_nested_train)
+            mtx_widget_ = QtWidgets.QWidget(tabwidget)
             mtx_idx_ = self.nested_box.count() - 1
-            self.widget_nested_train.insertTab(mtx_idx_, mtx_widget_,
-                                               'Matrix #' + str(mtx_idx_))
-            self.widget_nested_train.setCurrentIndex(0)
-        # Create each training matrix
-        for m in range(len(self.settings.matrices['train'])):
-            # Set the current index and create the general layout
-            curr_mtx = self.settings.matrices['train'][m]
-            self.widget_nested_train.setCurrentIndex(m)
-            global_layout = QtWidgets.QVBoxLayout()
-            # Create the result text frame
-            result_frame = QtWidgets.QFrame()
-            result_text = QtWidgets.QLabel('B C I')
-            result_text.setObjectName('label_result_text')
-            result_text.setAlignment(QtCore.Qt.AlignLeft)
-            result_title = QtWidgets.QLabel('RESULT ')
-            result_title.setObjectName('label_result_title')
-            result_title.setAlignment(QtCore.Qt.AlignLeft)
-            result_title.setSizePolicy(policy_max_pre)
-            fps_monitor = QtWidgets.QLabel(
-                'FPS @%iHz' % self.settings.run_settings.fps_resolution)
-            fps_monitor.setObjectName('label_fps')
-            fps_monitor.setAlignment(QtCore.Qt.AlignRight)
-            result_layout = QtWidgets.QHBoxLayout()
-            result_layout.addWidget(result_title)
-            result_layout.addWidget(result_text)
-            result_layout.addWidget(fps_monitor)
-            result_frame.setLayout(result_layout)
-            global_layout.addWidget(result_frame)
-            # Customize the result text
+            tabwidget.insertTab(mtx_idx_, mtx_widget_,
+                                'Matrix #' + str(mtx_idx_))
+            tabwidget.setCurrentIndex(0)
+        # Rebuild or update each matrix
+        del models[len(matrices):]
+        for m in range(len(matrices)):
+            curr_mtx = matrices[m]
+            if m >= len(models) or \
+                    models[m]['shape'] != (curr_mtx.n_row, curr_mtx.n_col):
+                tabwidget.setCurrentIndex(m)
+                model = self.build_matrix_tab(curr_mtx)
+                self.update_tab(tabwidget, m, model['tab'])
+                if m < len(models):
+                    models[m] = model
+                else:
+                    models.append(model)
+            self.apply_matrix_changes(models[m], curr_mtx)
+
+    def build_matrix_tab(self, curr_mtx):
+        """ Creates the widgets of a matrix tab without styling them.
+
+        Returns
+        -------
+        model: dict
+            Persistent widget model of the matrix. Styles are cached as None,
+            so they are applied by the next call to `apply_matrix_changes`.
+        """
+        # Useful PyQt policies
+        policy_max_pre = QSizePolicy(QSizePolicy.Maximum, QSizePolicy.Preferred)
+        policy_max_max = QSizePolicy(QSizePolicy.Expanding,
+                                     QSizePolicy.Expanding)
+
+        global_layout = QtWidgets.QVBoxLayout()
+        # Create the result text frame
+        result_frame = QtWidgets.QFrame()
+        result_text = QtWidgets.QLabel('B C I')
+        result_text.setObjectName('label_result_text')
+        result_text.setAlignment(QtCore.Qt.AlignLeft)
+        result_title = QtWidgets.QLabel('RESULT ')
+        result_title.setObjectName('label_result_title')
+        result_title.setAlignment(QtCore.Qt.AlignLeft)
+        result_title.setSizePolicy(policy_max_pre)
+        fps_monitor = QtWidgets.QLabel()
+        fps_monitor.setObjectName('label_fps')
+        fps_monitor.setAlignment(QtCore.Qt.AlignRight)
+        result_layout = QtWidgets.QHBoxLayout()
+        result_layout.addWidget(result_title)
+        result_layout.addWidget(result_text)
+        result_layout.addWidget(fps_monitor)
+        result_frame.setLayout(result_layout)
+        global_layout.addWidget(result_frame)
+        # Create a new layout for the commands
+        new_layout = QtWidgets.QGridLayout()
+        new_layout.setSpacing(10)
+        new_layout.setContentsMargins(10, 10, 10, 10)
+        # Add buttons as commands
+        buttons = []
+        for r in range(curr_mtx.n_row):
+            buttons.append([])
+            for c in range(curr_mtx.n_col):
+                temp_button = QtWidgets.QToolButton()
+                temp_button.setObjectName('btn_command')
+                temp_button.clicked.connect(self.btn_command_on_click(r, c))
+                temp_button.setMinimumSize(60, 60)
+                temp_button.setSizePolicy(policy_max_max)
+                new_layout.addWidget(temp_button, r, c)
+                buttons[r].append(temp_button)
+        global_layout.addLayout(new_layout)
+        global_layout.setSpacing(0)
+        global_layout.setContentsMargins(0, 0, 0, 0)
+        new_tab = QtWidgets.QFrame()
+        new_tab.setLayout(global_layout)
+        return {
+            'shape': (curr_mtx.n_row, curr_mtx.n_col),
+            'tab': new_tab,
+            'result_frame': result_frame,
+            'result_title': result_title,
+            'fps_monitor': fps_monitor,
+            'buttons': buttons,
+            'texts': [[None] * curr_mtx.n_col for _ in range(curr_mtx.n_row)],
+            'styles': [[None] * curr_mtx.n_col for _ in range(curr_mtx.n_row)],
+            'frame_style': None
+        }
+
+    def apply_matrix_changes(self, model, curr_mtx):
+        """ Updates the texts and styles of a matrix tab that differ from
+        the ones cached in its widget model. """
+        colors = self.settings.colors
+        # Result frame, fps monitor and background
+        frame_style = (colors.color_result_info_text[:7],
+                       colors.color_result_info_box[:7],
+                       colors.color_fps_good[:7],
+                       self.settings.background.color_background[:7],
+                       self.settings.run_settings.fps_resolution)
+        if frame_style != model['frame_style']:
             gui_utils.modify_properties(
-                result_title, {
+                model['result_title'], {
                     "font-style": "italic",
-                    "color": self.settings.colors.color_result_info_text[:7]
+                    "color": frame_style[0]
                 })
             gui_utils.modify_property(
-                result_frame, "background-color",
-                self.settings.colors.color_result_info_box[:7])
+                model['result_frame'], "background-color", frame_style[1])
+            gui_utils.modify_property(
+                model['fps_monitor'], "color", frame_style[2])
             gui_utils.modify_property(
-                fps_monitor, "color",
-                self.settings.colors.color_fps_good[:7])
-            # Create a new layout for the commands
-            new_layout = QtWidgets.QGridLayout()
-            new_layout.setContentsMargins(0, 0, 0, 0)
-            new_layout.setSpacing(10)
-            new_layout.setContentsMargins(10, 10, 10, 10)
-            # Add buttons as commands
-            for r in range(curr_mtx.n_row):
-                for c in range(curr_mtx.n_col):
-                    key_ = curr_mtx.matrix_list[r][c].sequence[0]
-                    temp_button = QtWidgets.QToolButton()
-                    temp_button.setObjectName('btn_command')
-                    temp_button.setSizePolicy(policy_max_max)
-                    temp_button.setText(curr_mtx.matrix_list[r][c].text)
-                    temp_button.setMinimumSize(60, 60)
-                    temp_button.clicked.connect(
-                        self.btn_command_on_click(r, c))
-                    box_color_ = self.settings.colors.color_box_0 if \
-                        key_ == 0 else self.settings.colors.color_box_1
-                    text_color_ = self.settings.colors.color_text_0 if \
-                        key_ == 0 else self.settings.colors.color_text_1
+                model['tab'], 'background-color', frame_style[3])
+            model['fps_monitor'].setText('FPS @%iHz' % frame_style[4])
+            model['frame_style'] = frame_style
+        # Commands
+        for r in range(curr_mtx.n_row):
+            for c in range(curr_mtx.n_col):
+                target = curr_mtx.matrix_list[r][c]
+                button = model['buttons'][r][c]
+                if target.text != model['texts'][r][c]:
+                    button.setText(target.text)
+                    model['texts'][r][c] = target.text
+                key_ = target.sequence[0]
+                style_ = (colors.color_box_0 if key_ == 0 else
+                          colors.color_box_1,
+                          colors.color_text_0 if key_ == 0 else
+                          colors.color_text_1)
+                if style_ != model['styles'][r][c]:
                     gui_utils.modify_properties(
-                        temp_button, {
-                            "background-color": box_color_,
+                        button, {
+                            "background-color": style_[0],
                             "font-family": 'sans-serif, Helvetica, Arial',
                             'font-size': '30px',
-                            'color': text_color_,
+                            'color': style_[1],
                             'border': 'transparent'
                         })
-                    new_layout.addWidget(temp_button, r, c)
-            global_layout.addLayout(new_layout)
-            global_layout.setSpacing(0)
-            global_layout.setContentsMargins(0, 0, 0, 0)
-
-            # Update the tab
-            new_tab = QtWidgets.QFrame()
-            new_tab.setLayout(global_layout)
-            gui_utils.modify_property(new_tab, 'background-color',
-                                      self.settings.background.color_background[:7])
-            self.update_tab(self.widget_nested_train, m, new_tab)
-
-        # Filter cutoffs according to fps_resolution
-        self.update_table_cutoffs()
-
-        # Sequence length in test
-        seqlen = len(self.settings.matrices['test'][0].item_list[0].sequence)
-        index = self.comboBox_seqlength.findText(str(seqlen), Qt.MatchFixedString)
-        self.comboBox_seqlength.setCurrentIndex(index)
+                    model['styles'][r][c] = style_
 
     def btn_command_on_click(self, row, col):
         def set_config():
@@ -588,6 +643,42 @@ class Config(QtWidgets.QDialog, ui_main_file):
         self.settings.run_settings.fps_resolution = self.spinBox_fpsresolution.value()
         self.settings.run_settings.enable_photodiode = self.checkBox_photodiode.isChecked()
 
+        # Online performance
+        self.settings.run_settings.online_retention = \
+            self.doubleSpinBox_retention.value()
+        self.settings.connection_settings.session_host = \
+            self.checkBox_session_host.isChecked()
+        self.settings.connection_settings.binary_events = \
+            self.checkBox_binary_events.isChecked()
+        self.settings.connection_settings.onset_batch_cycles = \
+            self.spinBox_onset_batch.value()
+        self.settings.connection_settings.clock_sync_interval = \
+            self.doubleSpinBox_clock_sync.value()
+        self.settings.connection_settings.clock_sync_correction = \
+            self.checkBox_clock_correction.isChecked()
+        self.settings.run_settings.photodiode_channel = \
+            self.lineEdit_photodiode_channel.text().strip()
+        self.settings.run_settings.photodiode_stream = \
+            self.lineEdit_photodiode_stream.text().strip()
+        self.settings.run_settings.exclude_bad_cycles = \
+            self.checkBox_exclude_bad_cycles.isChecked()
+        self.settings.run_settings.lm_corpus_path = \
+            self.lineEdit_lm_corpus.text().strip()
+        self.settings.run_settings.lm_weight = \
+            self.doubleSpinBox_lm_weight.value()
+        self.settings.run_settings.vocabulary_path = \
+            self.lineEdit_vocabulary.text().strip()
+        self.settings.run_settings.suggestion_cells = [
+            int(c) for c in self.lineEdit_suggestion_cells.text().split(',')
+            if c.strip().isdigit()]
+        self.settings.run_settings.pipelined_trials = \
+            self.checkBox_pipelined_trials.isChecked()
+        self.settings.run_settings.ensemble_model_paths = [
+            p.strip() for p in self.lineEdit_ensemble_models.text().split(';')
+            if p.strip()]
+        self.settings.run_settings.ensemble_rule = \
+            self.comboBox_ensemble_rule.currentText()
+
         # Timings
         self.settings.timings.t_prev_text = self.doubleSpinBox_t_prev_text.value()
         self.settings.timings.t_prev_iddle = self.doubleSpinBox_t_prev_iddle.value()
@@ -727,23 +818,29 @@ class Config(QtWidgets.QDialog, ui_main_file):
             return
 
         # Get data to be trained
-        filt = "c-VEP Files (*.cvep.bson)"
+        filt = "c-VEP Files (*.cvep.bson *.cvep.%s)" % CHUNKED_FORMAT
         files = QtWidgets.QFileDialog.getOpenFileNames(
             caption="Select training files",
             dir=os.getcwd() + "/../data/",
             filter=filt)
         if files[0]:
+            from medusa.bci import cvep_spellers
             self.notifications.new_notification('Training model...')
             # Get files
-            dataset = None
-            for idx, file in enumerate(files[0]):
-                rec = components.Recording.load(file)
-                if idx == 0:
-                    dataset = cvep_spellers.CVEPSpellerDataset(
-                        channel_set=rec.eeg.channel_set,
-                        fs=rec.eeg.fs
-                    )
-                dataset.add_recordings(rec)
+            recordings = list()
+            for file in files[0]:
+                rec = self.load_recording(file)
+                if self.checkBox_calibration_bad_frames.isChecked():
+                    cvep_data = getattr(rec, CVEP_DATA_KEY)
+                    bad = frame_stats.get_bad_onsets_mask(cvep_data,
+                                                          MAX_MISSED_FRAMES)
+                    frame_stats.exclude_onsets(cvep_data, bad)
+                    if bad.any():
+                        print(self.TAG, 'Excluded %i cycles with dropped '
+                                        'frames' % bad.sum())
+                recordings.append(rec)
+            # The photodiode channel is not EEG
+            non_eeg_channels = self.exclude_non_eeg_channels(recordings)
             # Get configuration
             bpf = []
             max_cut2 = 0.0
@@ -762,15 +859,62 @@ class Config(QtWidgets.QDialog, ui_main_file):
             if max_cut2 < notch[1][0]:
                 notch = None
 
+            # Data type (cast before decimating, as in the online path)
+            signal_dtype = 'float32' if \
+                self.checkBox_calibration_float32.isChecked() else 'float64'
+            for rec in recordings:
+                rec.eeg.signal = np.asarray(rec.eeg.signal).astype(
+                    signal_dtype, copy=False)
+
+            # Decimation (the model is fitted at the decimated rate)
+            decimation_factor = self.spinBox_calibration_decimation.value()
+            if decimation_factor > 1:
+                from . import decimation
+                try:
+                    for rec in recordings:
+                        decimation.check_decimation(
+                            rec.eeg.fs, decimation_factor, max_cut2)
+                        rec.eeg.times, rec.eeg.signal = decimation.decimate(
+                            rec.eeg.times, rec.eeg.signal, decimation_factor,
+                            rec.eeg.fs)
+                        rec.eeg.fs = rec.eeg.fs / decimation_factor
+                except ValueError as e:
+                    error_dialog(str(e), "Cannot decimate the EEG!")
+                    return
+
+            # Channel selection (before building the dataset, so the model is
+            # fitted with the selected channels only)
+            channel_subset = None
+            if non_eeg_channels:
+                channel_subset = list(recordings[0].eeg.channel_set.l_cha)
+            if self.checkBox_calibration_channel_selection.isChecked():
+                try:
+                    channel_subset = self.select_channels(recordings, bpf[0])
+                except Exception as e:
+                    error_dialog(str(e), "Cannot select the channels!")
+                    return
+            dataset = cvep_spellers.CVEPSpellerDataset(
+                channel_set=recordings[0].eeg.channel_set,
+                fs=recordings[0].eeg.fs
+            )
+            dataset.add_recordings(recordings)
+
             # Train the model
             art_rej = None
             if self.checkBox_calibration_art_rej.isChecked():
                 art_rej = 3.0
+            # Raster latencies are only corrected if all the recordings
+            # store them (recordings made with older versions do not)
+            correct_raster = all(
+                raster_latencies.has_raster_events(getattr(
+                    getattr(rec, dataset.experiment_att_key),
+                    'raster_events', None))
+                for rec in dataset.recordings)
             model = cvep_spellers.CVEPModelCircularShifting(
                 bpf=bpf,
                 notch=notch,
                 art_rej=art_rej,
-                correct_raster_latencies=False
+                correct_raster_latencies=correct_raster
             )
             try:
                 fitted_info = model.fit_dataset(dataset)
@@ -787,8 +931,15 @@ class Config(QtWidgets.QDialog, ui_main_file):
             # Disable art_rej for online mode
             model.get_inst("clf_method").art_rej = None
 
-            # Save model
+            # Save model (online, only the channels of the subset are used,
+            # and the EEG is cast and decimated in the same way)
             model_pkl = model.to_pickleable_obj()
+            model_pkl.channel_subset = channel_subset
+            model_pkl.decimation_factor = decimation_factor
+            model_pkl.signal_dtype = signal_dtype
+            if signal_dtype != 'float64' and \
+                    not self.verify_signal_dtype(model_pkl):
+                model_pkl.signal_dtype = 'float64'
             fdialog = QtWidgets.QFileDialog()
             fname = fdialog.getSaveFileName(
                 fdialog, 'Save c-VEP Model',
@@ -802,6 +953,136 @@ class Config(QtWidgets.QDialog, ui_main_file):
                                                     fname[0].split('/')[-1])
                 self.lineEdit_cvepmodel.setText(fname[0])
 
+    @staticmethod
+    def load_recording(file):
+        """ Loads a recording. For chunked recordings, only the windows
+        around the trials are decompressed. """
+        from medusa import components
+        if file.endswith('.' + CHUNKED_FORMAT):
+            with chunked_recording.ChunkedRecording(file) as ch_rec:
+                windows = chunked_recording.get_trial_windows(
+                    ch_rec.get_experiment_data(CVEP_DATA_KEY),
+                    TRIAL_WINDOW_PAD)
+                rec = ch_rec.to_recording(windows)
+        else:
+            rec = components.Recording.load(file)
+        # The raster events are saved without tuple keys
+        cvep_data = getattr(rec, CVEP_DATA_KEY)
+        cvep_data.raster_events = raster_latencies.from_serializable(
+            getattr(cvep_data, 'raster_events', None))
+        return rec
+
+    def exclude_non_eeg_channels(self, recordings):
+        """ Removes the photodiode channel (see the run settings) from the EEG
+        of the recordings, so the model is trained with EEG only. Returns the
+        labels of the removed channels. """
+        from medusa import meeg
+        from . import model_input
+        channel = self.settings.run_settings.photodiode_channel
+        removed = list()
+        for rec in recordings:
+            l_cha = rec.eeg.channel_set.l_cha
+            if not channel or channel not in l_cha:
+                continue
+            rec.eeg.signal, l_cha = model_input.exclude_channels(
+                rec.eeg.signal, l_cha, [channel])
+            rec.eeg.channel_set = meeg.EEGChannelSet()
+            rec.eeg.channel_set.set_standard_montage(l_cha)
+            removed = [channel]
+        return removed
+
+    def verify_signal_dtype(self, model):
+        """ Decodes previous online sessions selected by the user with the
+        data type of the model and with float64 (see
+        model_input.check_dtype_equivalence). Returns False if any selection
+        changes, or if the verification is skipped (no session selected), so
+        the model falls back to float64. """
+        from . import model_input
+        filt = "c-VEP Files (*.cvep.bson *.cvep.%s)" % CHUNKED_FORMAT
+        files = QtWidgets.QFileDialog.getOpenFileNames(
+            caption="Select online sessions to verify the %s path "
+                    "(cancel to use float64)" % model.signal_dtype,
+            dir=os.getcwd() + "/../data/",
+            filter=filt)
+        if not files[0]:
+            print(self.TAG, 'The %s path has not been verified, the model '
+                            'will use float64' % model.signal_dtype)
+            return False
+        try:
+            n_trials, n_agree = model_input.check_dtype_equivalence(
+                model, [self.load_recording(f) for f in files[0]],
+                model.signal_dtype,
+                [self.settings.run_settings.photodiode_channel])
+        except Exception as e:
+            error_dialog(str(e), "Cannot verify the %s path!" %
+                         model.signal_dtype)
+            return False
+        print(self.TAG, '%s vs float64: %i/%i equal selections' %
+              (model.signal_dtype, n_agree, n_trials))
+        if n_trials == 0:
+            warning_dialog('The selected sessions have no trials, the model '
+                           'will use float64.', 'Precision check failed')
+            return False
+        if n_agree < n_trials:
+            warning_dialog('%i of %i selections change with %s, the model '
+                           'will use float64.' % (n_trials - n_agree, n_trials,
+                                                  model.signal_dtype),
+                           'Precision check failed')
+            return False
+        return True
+
+    def select_channels(self, recordings, bpf):
+        """ Ranks the channels of the calibration recordings by their
+        contribution to the cross-validated accuracy (see
+        channel_selection.py), keeps the smallest subset without accuracy
+        loss and removes the other channels from the recordings.
+
+        Returns
+        -------
+        channel_subset: list
+            Labels of the selected channels.
+        """
+        from medusa import meeg
+        from . import channel_selection
+        l_cha = recordings[0].eeg.channel_set.l_cha
+        epochs, sequences, trials = list(), list(), list()
+        for rec in recordings:
+            if rec.eeg.channel_set.l_cha != l_cha:
+                raise ValueError('All the recordings must have the same '
+                                 'channels')
+            e, s, t = channel_selection.get_epochs(
+                rec.eeg.times, rec.eeg.signal, getattr(rec, CVEP_DATA_KEY),
+                rec.eeg.fs, bpf[1], bpf[0])
+            # Trials of different recordings are in different folds
+            offset = max(trials[-1]) + 1 if len(trials) > 0 else 0
+            epochs.append(e)
+            sequences += s
+            trials.append(np.asarray(t) + offset)
+        epochs, trials = np.concatenate(epochs), np.concatenate(trials)
+        # Lags (in samples) of the commands of the test matrix
+        fs = recordings[0].eeg.fs
+        fps = float(getattr(recordings[0], CVEP_DATA_KEY).fps_resolution)
+        n_commands = len(self.settings.matrices['test'][0].item_list)
+        tau = len(sequences[0]) / float(n_commands)
+        lags = [int(round(k * tau * fs / fps)) for k in range(n_commands)]
+        ranking, accuracy = channel_selection.rank_channels(
+            epochs, sequences, trials, lags, CHANNEL_SELECTION_FOLDS)
+        subset = channel_selection.select_channels(
+            ranking, accuracy, CHANNEL_SELECTION_TOLERANCE,
+            min(CHANNEL_SELECTION_MIN, len(l_cha)))
+        print(self.TAG, 'Channel ranking (cross-validated accuracy):\n' +
+              '\n'.join('  > %s: %.1f%%' % (l_cha[c], 100 * acc)
+                        for c, acc in zip(ranking, accuracy)))
+        channel_subset = [l_cha[c] for c in subset]
+        print(self.TAG, 'Selected channels: %s' % ', '.join(channel_subset))
+        # Remove the other channels from the recordings
+        channel_set = meeg.EEGChannelSet()
+        channel_set.set_standard_montage(channel_subset)
+        for rec in recordings:
+            rec.eeg.signal = rec.eeg.signal[:, subset]
+            rec.eeg.channel_set = channel_set
+        return channel_subset
+
     def browse_model(self):
         filt = "c-VEP Model (*.cvep.mdl)"
         directory = os.getcwd() + "/../models/"
@@ -923,14 +1204,24 @@ class Config(QtWidgets.QDialog, ui_main_file):
             retval = self.close_dialog()
             if retval == QtWidgets.QMessageBox.Yes:
                 self.close_signal.emit(None)
+                self.disconnect_monitor_rates()
                 event.accept()
             else:
                 event.ignore()
         else:
             self.get_settings_from_gui()
             self.close_signal.emit(self.settings)
+            self.disconnect_monitor_rates()
             event.accept()
 
+    def disconnect_monitor_rates(self):
+        """ Disconnects the screen signals of the application, which outlives
+        this dialog, and the rates received from a pending query. """
+        QApplication.instance().screenAdded.disconnect(self.on_screens_changed)
+        QApplication.instance().screenRemoved.disconnect(
+            self.on_screens_changed)
+        self.monitor_rates_signal.disconnect(self.on_monitor_rates_received)
+
 
 class TargetConfigDialog(QtWidgets.QDialog, ui_target_file):
 
@@ -974,6 +1265,12 @@ class TargetConfigDialog(QtWidgets.QDialog, ui_target_file):
 class VisualizeEncodingDialog(QtWidgets.QDialog, ui_encoding_file):
     def __init__(self, n_row, n_col, base, order, monitor_rate, item_list,
                  lags_info):
+        # Plotting modules are only loaded when the encoding is visualized
+        import matplotlib.pyplot as plt
+        from matplotlib.ticker import FormatStrFormatter
+        from matplotlib.backends.backend_qt5agg import \
+            FigureCanvasQTAgg as FigureCanvas
+        from matplotlib.figure import Figure
         QtWidgets.QDialog.__init__(self)
         self.setupUi(self)  # Attach the .ui
         self.setWindowFlags(
@@ -1001,6 +1298,7 @@ class VisualizeEncodingDialog(QtWidgets.QDialog, ui_encoding_file):
         SMALL_SIZE = 4
         MEDIUM_SIZE = 6
         plt.rcParams.update({'font.size': 4})
+        from medusa.bci.cvep_spellers import LFSR, LFSR_PRIMITIVE_POLYNOMIALS
         poly_ = LFSR_PRIMITIVE_POLYNOMIALS['base'][base]['order'][order]
         seq = LFSR(poly_, base=base, center=True).sequence
         rxx_, tr_ = self.autocorr_circular(seq)
@@ -9,6 +9,14 @@
 // Versions:
 //      - v1.0 (19/05/2022):    Circular-shifting c-VEP speller working
 //      - v1.1 (04/07/2022):    Fixed small bug in which the app displayed and additional trial in training
+//      - v1.2:                 Resume of interrupted runs and session-host mode (the app is kept open between runs)
+//                              Binary onsets and batches of onsets
+//                              Ping/pong messages to estimate the clock offset
+//                              The photodiode shows a pulse at the start of each cycle during the stimulation
+//                              Raster latencies of the cells are sent to MEDUSA (resize event)
+//                              Frame-timing statistics of each cycle are sent to MEDUSA at the end of each trial
+//                              Relabel messages change the text of some cells (e.g., word suggestions)
+//                              Pipelined mode: the next trial starts while MEDUSA decodes the previous one
 
 using System;
 using System.Collections;
@@ -43,6 +51,14 @@ public class Manager : MonoBehaviour
     private float tFinishText = 1.0f;
 
     private MessageInterpreter.ParameterDecoder parameters = null;
+    private MessageInterpreter.ParameterDecoder lastParameters = null;     // Session host: parameters of the previous run
+    private bool sessionHost = false;
+    private bool binaryEvents = false;      // Onsets are sent in binary format (negotiated with MEDUSA)
+    private int onsetBatchCycles = 0;       // Onsets of this number of cycles are sent in the same message (0: one per cycle)
+    private List<OnsetInfo> pendingOnsets = new List<OnsetInfo>();
+    private bool pipelinedTrials = false;   // The next trial starts while MEDUSA decodes the previous one
+    private List<int> awaitingSelections = new List<int>();     // Trials sent to MEDUSA whose selection has not arrived
+    private List<string> pipelinedResults = new List<string>(); // Selections received while the run continues
 
     // Others
     private float minSeparatorSize = 40;
@@ -158,6 +174,14 @@ public class Manager : MonoBehaviour
     private string mode;
     private bool targetsAvailable;
     private bool photodiodeEnabled;
+    private bool photodiodePulse = false;       // A cycle starts in this frame (see sendOnset)
+    private MessageInterpreter.RelabelDecoder pendingRelabel = null;    // Cells to relabel in the main thread
+
+    // Frame-timing statistics of the current cycle (see beginCycleStats) and of the finished cycles of the trial
+    private int statsCycle = -1, statsTrial = -1, statsMissedFrames = 0, lastFixedUpdateFrame = -1;
+    private float statsMinInterval, statsMaxInterval;
+    private List<int> trialStatsCycles = new List<int>(), trialStatsMissedFrames = new List<int>();
+    private List<float> trialStatsMinIntervals = new List<float>(), trialStatsMaxIntervals = new List<float>();
     private int cycleTestCounter = 0;
     private int cycleTrainCounter = 0;
     private int[,] targetsRowCol;
@@ -183,6 +207,8 @@ public class Manager : MonoBehaviour
             string[] arguments = Environment.GetCommandLineArgs();
             IP = arguments[1];
             port = Int32.Parse(arguments[2]);
+            // Usage: c-VEP Speller.exe 127.0.0.1 50000 --session-host
+            sessionHost = arguments.Length > 3 && arguments[3] == "--session-host";
         }
             
     }
@@ -192,6 +218,7 @@ public class Manager : MonoBehaviour
     {
         // Start the TCP/IP server
         tcpClient = new MedusaTCPClient(this, IPAddress.Parse(IP), port);
+        tcpClient.retryConnection = sessionHost;
         tcpClient.Start();
 
         // FPS monitoring
@@ -244,9 +271,56 @@ public class Manager : MonoBehaviour
                 Debug.Log("> MedusaTCPClient closed successfully!");
             }
         }
+        if (sessionHost)
+        {
+            resetSession();
+            return;
+        }
         Application.Quit();
     }
 
+    // Session-host mode: instead of quitting, this function resets the run-specific state and waits for the next run
+    void resetSession()
+    {
+        // Remove the cells of the matrices (they are created again with the next parameters)
+        foreach (GameObject[,] matrix in new GameObject[][,] { matrixTest, matrixTrain })
+        {
+            if (matrix == null) continue;
+            foreach (GameObject cell in matrix)
+            {
+                Destroy(cell);
+            }
+        }
+        matrixTest = null;
+        matrixTrain = null;
+        pendingOnsets.Clear();
+        clearFrameStats();
+        lock (awaitingSelections) awaitingSelections.Clear();
+        lock (pipelinedResults) pipelinedResults.Clear();
+
+        // Run-specific state
+        parameters = null;
+        cycleTestCounter = 0;
+        cycleTrainCounter = 0;
+        currentTestTarget = 0;
+        currentTrainTarget = 0;
+        currentTrainSequence = 0;
+        mustHighlightTarget = true;
+        innerstate = STATE_RUNNING_PREVTEXT;
+        finishingstate = STATE_FINISHING_IDDLE;
+        resultstate = STATE_RESULT_SHOW;
+        lastResult = "";
+        lastResultCoords = new int[3];
+        resultText.GetComponent<Text>().text = "";
+        setInformationText("Waiting for MEDUSA...");
+
+        // Wait for the server of the next run
+        state = STATE_WAITING_CONNECTION;
+        tcpClient = new MedusaTCPClient(this, IPAddress.Parse(IP), port);
+        tcpClient.retryConnection = true;
+        tcpClient.Start();
+    }
+
     public void quitApplicationFromException()
     {
         mustClose = true;
@@ -260,6 +334,13 @@ public class Manager : MonoBehaviour
     {
         updateCount += 1;
 
+        // Interval between rendered frames during the current cycle
+        if (statsCycle >= 0)
+        {
+            statsMinInterval = Mathf.Min(statsMinInterval, Time.unscaledDeltaTime);
+            statsMaxInterval = Mathf.Max(statsMaxInterval, Time.unscaledDeltaTime);
+        }
+
         /* MINIMUM RESOLUTION */
         if (Screen.width < 450 || Screen.height < 450)
         {
@@ -273,6 +354,9 @@ public class Manager : MonoBehaviour
             state = STATE_WAITING_PARAMS;
             // If the connection have been just established, send the waiting flag
             ServerMessage sm = new ServerMessage("waiting");
+            sm.addValue("hasParameters", lastParameters != null);
+            sm.addValue("binaryEvents", true);
+            sm.addValue("relabel", true);
             tcpClient.SendMessage(sm.ToJson());
         }
 
@@ -336,6 +420,24 @@ public class Manager : MonoBehaviour
 
         }
 
+        // Pipelined mode: show the selections received while the next trial was running
+        lock (pipelinedResults)
+        {
+            foreach (string result in pipelinedResults)
+            {
+                concatenateNewResult(result);
+            }
+            pipelinedResults.Clear();
+        }
+
+        // If new cell texts have been received, apply them in the main thread (once the last result is shown)
+        MessageInterpreter.RelabelDecoder relabel = pendingRelabel;
+        if (relabel != null && state != STATE_SELECTION_RECEIVED)
+        {
+            pendingRelabel = null;
+            relabelCells(relabel);
+        }
+
         // If the run is finished
         if (state == RUN_STATE_FINISHED)
         {
@@ -352,6 +454,8 @@ public class Manager : MonoBehaviour
         // If the Unity app is stopping (closing)
         if (state == RUN_STATE_STOP)
         {
+            // Onsets of the interrupted trial
+            flushOnsets();
             if (closingstate == STATE_CLOSING_TEXT)
             {
                 setInformationText("Closing...");
@@ -408,8 +512,16 @@ public class Manager : MonoBehaviour
     {
         fixedUpdateCount += 1;
 
-        // Flicker the photodiode
-        if (photodiodeEnabled)
+        // Flicker the photodiode (during the stimulation, the pulses are shown after the loops)
+        bool stimulating = state == RUN_STATE_RUNNING && innerstate == STATE_RUNNING_FLICKERING;
+
+        // Two fixed updates in the same rendered frame: the stimulus of the first one was never displayed
+        if (statsCycle >= 0 && Time.frameCount == lastFixedUpdateFrame)
+        {
+            statsMissedFrames++;
+        }
+        lastFixedUpdateFrame = Time.frameCount;
+        if (photodiodeEnabled && !stimulating)
         {
             if (photodiodeCell.GetComponent<Image>().color == highlightBoxColor)
             {
@@ -430,6 +542,13 @@ public class Manager : MonoBehaviour
         {
             loopTest();
         }
+
+        // Photodiode pulse at the start of each cycle, used by MEDUSA to align the onsets
+        if (photodiodeEnabled && stimulating)
+        {
+            photodiodeCell.GetComponent<Image>().color = photodiodePulse ? highlightBoxColor : defaultBoxColor;
+            photodiodePulse = false;
+        }
     }
 
     // This function resets the train matrix by unflashing everything
@@ -564,6 +683,38 @@ public class Manager : MonoBehaviour
         }        
     }
     
+    // This function sends the raster latency of each cell of the current matrix: the monitor scans the frame from top
+    // to bottom, so the cells at the bottom are displayed later than the ones at the top (up to one refresh period)
+    void sendRasterLatencies()
+    {
+        bool isTrain = String.Equals(mode, "Train", StringComparison.OrdinalIgnoreCase);
+        GameObject[,] matrix = isTrain ? matrixTrain : matrixTest;
+        float refreshRate = Screen.currentResolution.refreshRate;
+        if (matrix == null || refreshRate <= 0)
+        {
+            return;
+        }
+        // Cells in the order of the item list (row-major)
+        List<double> latencies = new List<double>();
+        Vector3[] corners = new Vector3[4];
+        for (int r = 0; r < matrix.GetLength(0); r++)
+        {
+            for (int c = 0; c < matrix.GetLength(1); c++)
+            {
+                matrix[r, c].GetComponent<RectTransform>().GetWorldCorners(corners);
+                float yCenter = (corners[0].y + corners[1].y) / 2;
+                float fromTop = Mathf.Clamp01((Screen.height - yCenter) / Screen.height);
+                latencies.Add(fromTop / refreshRate);
+            }
+        }
+        ServerMessage sm = new ServerMessage("resize");
+        sm.addValue("matrix_idx", isTrain ? 0 : currentMatrixIdx);
+        sm.addValue("refresh_rate", refreshRate);
+        sm.addValue("screen_height", Screen.height);
+        sm.addValue("raster_latencies", latencies.ToArray());
+        tcpClient.SendMessage(sm.ToJson());
+    }
+
     // This function sets the information text. IMPORTANT: only the main thread is allowed to run this function.
     void setInformationText(string infoMsg)
     {
@@ -615,8 +766,21 @@ public class Manager : MonoBehaviour
     // This function is called by the MedusaTCPClient whenever a packet is received in order to interpret it
     public void interpretMessage(string message)
     {
-        Debug.Log("Received from server: " + message);
+        double receivedTime = getCurrentTimeStamp();
         string eventType = messageInterpreter.decodeEventType(message);
+        if (eventType == "ping")
+        {
+            // Reply immediately, with the same clock as the onsets
+            MessageInterpreter.PingDecoder ping = messageInterpreter.decodePing(message);
+            ServerMessage pong = new ServerMessage("pong");
+            pong.addValue("seq", ping.seq);
+            pong.addValue("t0", ping.t0);
+            pong.addValue("t1", receivedTime);
+            pong.addValue("t2", getCurrentTimeStamp());
+            tcpClient.SendMessage(pong.ToJson());
+            return;
+        }
+        Debug.Log("Received from server: " + message);
         switch (eventType)
         {
             case "play":
@@ -651,13 +815,18 @@ public class Manager : MonoBehaviour
                 break;
             case "setParameters":
                 // The main thread will detect that parameters are here using Update() and will call onParametersReady() itself
-                parameters = messageInterpreter.decodeParameters(message);
+                parameters = messageInterpreter.decodeParameters(message, lastParameters);
+                lastParameters = parameters;
                 Debug.Log("Parameters received.");
                 break;
             case "selection":
                 // MEDUSA has selected a new command!
                 int[] selection_coords = messageInterpreter.decodeSelection(message);
-                onSelectedCommand(selection_coords);
+                onSelectedCommand(selection_coords, messageInterpreter.decodeSelectionTrial(message));
+                break;
+            case "relabel":
+                // MEDUSA has changed the text of some cells (e.g., word suggestions)
+                pendingRelabel = messageInterpreter.decodeRelabel(message);
                 break;
             case "exception":
                 string exception = messageInterpreter.decodeException(message);
@@ -685,6 +854,9 @@ public class Manager : MonoBehaviour
         tPrevIddle = parameters.tPrevIddle;
         tFinishText = parameters.tFinishText;
         photodiodeEnabled = parameters.photodiodeEnabled; // Using photodiode?
+        binaryEvents = parameters.binaryEvents;
+        onsetBatchCycles = parameters.onsetBatchCycles;
+        pipelinedTrials = parameters.pipelinedTrials;
         trainCycles = parameters.trainCycles;
         trainTrials = parameters.trainTrials;
         testCycles = parameters.testCycles;
@@ -697,10 +869,7 @@ public class Manager : MonoBehaviour
         Time.fixedDeltaTime = 1 / ((float)fpsResolution);
 
         // Hide or show the photodiode cell
-        if (!photodiodeEnabled)
-        {
-            photodiodeCell.SetActive(false);
-        }
+        photodiodeCell.SetActive(photodiodeEnabled);
 
         // Set up the default background
         mainCamera = GameObject.FindGameObjectWithTag("MainCamera").GetComponent<Camera>();
@@ -833,6 +1002,19 @@ public class Manager : MonoBehaviour
             }
         }
 
+        // Resume an interrupted run: skip the completed trials and show the previous selections
+        currentTrainTarget = parameters.resumeTrial;
+        currentTestTarget = parameters.resumeTrial;
+        resultText.GetComponent<Text>().text = "";
+        if (parameters.resumeSelections != null)
+        {
+            foreach (int[] coords in parameters.resumeSelections)
+            {
+                int itemIdx = rowColToMatrixIndexTest(coords[0], coords[1], coords[2]);
+                concatenateNewResult(matrices.test[coords[0]].item_list[itemIdx].text);
+            }
+        }
+
         // Detect what should be the initial matrix (training or test)
         if (String.Equals(mode, "Train", StringComparison.OrdinalIgnoreCase))
         {
@@ -847,6 +1029,7 @@ public class Manager : MonoBehaviour
 
         // Resize event to set up all positions
         onScreenSizeChange((float)Screen.width, (float)Screen.height);
+        sendRasterLatencies();
 
         // Change state
         state = RUN_STATE_READY;
@@ -855,17 +1038,60 @@ public class Manager : MonoBehaviour
         setInformationText("Waiting for start...");
     }
 
-    // This function is called when a command is selected from MEDUSA
-    void onSelectedCommand(int[] selectionCoords)
+    // This function is called when a command is selected from MEDUSA. The selection is only accepted if its trial is
+    // being awaited (-1: MEDUSA versions that do not send it, the oldest awaited trial), so late results cannot be
+    // attributed to another trial
+    void onSelectedCommand(int[] selectionCoords, int trial)
     {
-        // Store the new result
+        int nAwaiting;
+        lock (awaitingSelections)
+        {
+            if (trial < 0 && awaitingSelections.Count > 0) trial = awaitingSelections[0];
+            if (!awaitingSelections.Remove(trial))
+            {
+                Debug.LogWarning("Discarding the selection of trial " + trial + ": it was not awaited");
+                return;
+            }
+            nAwaiting = awaitingSelections.Count;
+        }
         int idx = rowColToMatrixIndexTest(selectionCoords[0], selectionCoords[1], selectionCoords[2]);
-        lastResult = matrices.test[selectionCoords[0]].item_list[idx].text;
+        string result = matrices.test[selectionCoords[0]].item_list[idx].text;
+
+        // The run continues (pipelined mode): only the result text is updated
+        if (state != STATE_WAITING_SELECTION || nAwaiting > 0)
+        {
+            lock (pipelinedResults) pipelinedResults.Add(result);
+            return;
+        }
+
+        // Store the new result
+        lastResult = result;
         lastResultCoords = selectionCoords;
         state = STATE_SELECTION_RECEIVED;
         mustShowResult = true;
     }
 
+    // This function changes the text of some cells of a test matrix. The items are updated too, so the new texts
+    // are kept if the matrix is rebuilt and used to show the selections
+    void relabelCells(MessageInterpreter.RelabelDecoder relabel)
+    {
+        if (matrices == null || relabel.matrix_idx >= matrices.test.Count) return;
+        MessageInterpreter.ParameterDecoder.Matrix matrix = matrices.test[relabel.matrix_idx];
+        for (int i = 0; i < relabel.cells.Length; i++)
+        {
+            int idx = relabel.cells[i];
+            if (idx < 0 || idx >= matrix.item_list.Count) continue;
+            matrix.item_list[idx].text = relabel.texts[i];
+            if (relabel.matrix_idx == currentMatrixIdx && matrixTest != null)
+            {
+                int r = idx / matrix.n_col;
+                int c = idx % matrix.n_col;
+                matrixTest[r, c].transform.GetChild(0).GetComponent<Text>().text = relabel.texts[i];
+                matrixTestLabels[r, c] = relabel.texts[i];
+            }
+        }
+    }
+
     // This function returns the current timestamp in seconds from the Unix epoch (1/1/1970)
     double getCurrentTimeStamp()
     {
@@ -875,6 +1101,115 @@ public class Manager : MonoBehaviour
         return unixTimeSeconds;
     }
 
+    // This function sends the onset of a cycle. If onsets are sent in batches, it is buffered until the batch is
+    // full or the trial ends (lastOfTrial)
+    void sendOnset(OnsetInfo onsetInfo, bool lastOfTrial)
+    {
+        photodiodePulse = true;
+        beginCycleStats(onsetInfo.cycle, onsetInfo.trial);
+        pendingOnsets.Add(onsetInfo);
+        if (onsetBatchCycles <= 0 || pendingOnsets.Count >= onsetBatchCycles || lastOfTrial)
+        {
+            flushOnsets();
+        }
+    }
+
+    // This function sends the buffered onsets to MEDUSA
+    void flushOnsets()
+    {
+        if (pendingOnsets.Count == 0)
+        {
+            return;
+        }
+        bool isTrain = pendingOnsets[0].eventType == OnsetEncoder.EVENT_TRAIN;
+        if (binaryEvents)
+        {
+            tcpClient.SendBinaryMessage(OnsetEncoder.encodeBatch(pendingOnsets));
+        }
+        else if (onsetBatchCycles <= 0)
+        {
+            // One message per cycle
+            OnsetInfo o = pendingOnsets[0];
+            ServerMessage sm = new ServerMessage(isTrain ? "train" : "test");
+            sm.addValue("cycle", o.cycle);
+            sm.addValue("onset", o.onset);
+            sm.addValue("trial", o.trial); // TODO: SEVERAL TARGETS IN TRAINING
+            sm.addValue("matrix_idx", o.matrixIdx);
+            sm.addValue("unit_idx", 0);
+            sm.addValue("level_idx", 0);
+            if (o.commandIdx >= 0)
+                sm.addValue("command_idx", o.commandIdx);
+            sm.addValue("mode", isTrain ? "Train" : "Online");
+            tcpClient.SendMessage(sm.ToJson());
+        }
+        else
+        {
+            ServerMessage sm = new ServerMessage(isTrain ? "train_batch" : "test_batch");
+            sm.addValue("cycle", pendingOnsets.Select(o => o.cycle).ToArray());
+            sm.addValue("onset", pendingOnsets.Select(o => o.onset).ToArray());
+            sm.addValue("trial", pendingOnsets.Select(o => o.trial).ToArray());
+            sm.addValue("matrix_idx", pendingOnsets.Select(o => o.matrixIdx).ToArray());
+            sm.addValue("unit_idx", new int[pendingOnsets.Count]);
+            sm.addValue("level_idx", new int[pendingOnsets.Count]);
+            if (isTrain)
+                sm.addValue("command_idx", pendingOnsets.Select(o => o.commandIdx).ToArray());
+            sm.addValue("mode", isTrain ? "Train" : "Online");
+            tcpClient.SendMessage(sm.ToJson());
+        }
+        pendingOnsets.Clear();
+    }
+
+    // This function stores the frame-timing statistics of the previous cycle and starts the ones of a new cycle
+    void beginCycleStats(int cycle, int trial)
+    {
+        endCycleStats();
+        statsCycle = cycle;
+        statsTrial = trial;
+        statsMissedFrames = 0;
+        statsMinInterval = float.MaxValue;
+        statsMaxInterval = 0;
+    }
+
+    void endCycleStats()
+    {
+        if (statsCycle < 0)
+        {
+            return;
+        }
+        trialStatsCycles.Add(statsCycle);
+        trialStatsMissedFrames.Add(statsMissedFrames);
+        trialStatsMinIntervals.Add(statsMinInterval == float.MaxValue ? 0 : statsMinInterval);
+        trialStatsMaxIntervals.Add(statsMaxInterval);
+        statsCycle = -1;
+    }
+
+    // This function sends the frame-timing statistics of the cycles of the trial that has just finished
+    void sendFrameStats()
+    {
+        endCycleStats();
+        if (trialStatsCycles.Count == 0)
+        {
+            return;
+        }
+        ServerMessage sm = new ServerMessage("frames");
+        sm.addValue("trial", statsTrial);
+        sm.addValue("cycle", trialStatsCycles.ToArray());
+        sm.addValue("min_interval", trialStatsMinIntervals.ToArray());
+        sm.addValue("max_interval", trialStatsMaxIntervals.ToArray());
+        sm.addValue("missed_frames", trialStatsMissedFrames.ToArray());
+        tcpClient.SendMessage(sm.ToJson());
+        clearFrameStats();
+    }
+
+    void clearFrameStats()
+    {
+        statsCycle = -1;
+        trialStatsCycles.Clear();
+        trialStatsMissedFrames.Clear();
+        trialStatsMinIntervals.Clear();
+        trialStatsMaxIntervals.Clear();
+    }
+
     // This function converts the coordinates of a row and column to the matrix index
     int rowColToMatrixIndexTest(int matrixIdx, int row, int col)
     {
@@ -920,16 +1255,8 @@ public class Manager : MonoBehaviour
                 if (cycleTrainCounter < trainCycles)
                 {
                     double currentTime = getCurrentTimeStamp();
-                    ServerMessage sm = new ServerMessage("train");
-                    sm.addValue("cycle", cycleTrainCounter);
-                    sm.addValue("onset", currentTime);
-                    sm.addValue("trial", currentTrainTarget); // TODO: SEVERAL TARGETS IN TRAINING
-                    sm.addValue("matrix_idx", 0);
-                    sm.addValue("unit_idx", 0);
-                    sm.addValue("level_idx", 0);
-                    sm.addValue("command_idx", 0);
-                    sm.addValue("mode", "Train");
-                    tcpClient.SendMessage(sm.ToJson());
+                    sendOnset(new OnsetInfo(OnsetEncoder.EVENT_TRAIN, cycleTrainCounter, currentTrainTarget, 0, 0, currentTime),
+                        cycleTrainCounter == trainCycles - 1);
                 }
                 // Important note: the previous IF statement prevents the system to send the onset when cycleTestCounter==testCycles, 
                 // In such a way, the next stage lets the last cycle to be displayed completely. Otherwise, the last cycle onset 
@@ -941,6 +1268,7 @@ public class Manager : MonoBehaviour
             {
                 cycleTrainCounter = 0;
                 resetTrainMatrix();
+                sendFrameStats();
 
                 // If all the targets have been done, notify the server
                 if (currentTrainTarget >= trainTrials - 1)
@@ -1012,15 +1340,8 @@ public class Manager : MonoBehaviour
                 if (cycleTestCounter < testCycles)
                 {
                     double currentTime = getCurrentTimeStamp();
-                    ServerMessage sm = new ServerMessage("test");
-                    sm.addValue("cycle", cycleTestCounter);
-                    sm.addValue("onset", currentTime);
-                    sm.addValue("trial", currentTestTarget);
-                    sm.addValue("mode", "Online");
-                    sm.addValue("matrix_idx", currentMatrixIdx);
-                    sm.addValue("unit_idx", 0);
-                    sm.addValue("level_idx", 0);
-                    tcpClient.SendMessage(sm.ToJson());
+                    sendOnset(new OnsetInfo(OnsetEncoder.EVENT_TEST, cycleTestCounter, currentTestTarget, currentMatrixIdx, -1, currentTime),
+                        cycleTestCounter == testCycles - 1);
                 }
                 // Important note: the previous IF statement prevents the system to send the onset when cycleTestCounter==testCycles, 
                 // In such a way, the next stage lets the last cycle to be displayed completely. Otherwise, the last cycle onset 
@@ -1030,13 +1351,29 @@ public class Manager : MonoBehaviour
             // Check how many cycles have been displayed
             if (cycleTestCounter > testCycles)
             {
+                int finishedTrial = currentTestTarget;
                 cycleTestCounter = 0;
                 currentTestTarget++;
                 resetTestMatrix();
 
-                // Request MEDUSA to process the trial
-                state = STATE_WAITING_SELECTION;
+                // Request MEDUSA to process the trial (the frame statistics are sent first, so the bad cycles can be
+                // excluded)
+                sendFrameStats();
+                lock (awaitingSelections) awaitingSelections.Add(finishedTrial);
+                bool lastTarget = targetsAvailable && currentTestTarget >= testTarget.Length;
+                if (pipelinedTrials && !lastTarget)
+                {
+                    // Pipelined mode: the next trial starts (from the pre-idle period) while MEDUSA decodes this one.
+                    // After the last target, the selection is awaited so the run does not finish before it
+                    innerstate = STATE_RUNNING_IDDLE;
+                    mustStartTrial = true;
+                }
+                else
+                {
+                    state = STATE_WAITING_SELECTION;
+                }
                 ServerMessage sm = new ServerMessage("processPlease");
+                sm.addValue("trial", finishedTrial);
                 tcpClient.SendMessage(sm.ToJson());
             }
             else
@@ -32,6 +32,10 @@ public class MedusaTCPClient
 	private IPAddress IP;
 	private int port;
 
+	// If true, the client waits until the server is up instead of failing (session-host mode)
+	public bool retryConnection = false;
+	private int RETRY_INTERVAL_MS = 500;
+
 	// Message reading
 	public string recvBuffer = "";
 	private int PROTOHEADER_LEN = 2;
@@ -109,7 +113,19 @@ public class MedusaTCPClient
 	{
 		try
 		{
-			socketConnection = new TcpClient(this.IP.ToString(), this.port);
+			while (true)
+			{
+				try
+				{
+					socketConnection = new TcpClient(this.IP.ToString(), this.port);
+					break;
+				}
+				catch (SocketException)
+				{
+					if (!retryConnection) throw;
+					Thread.Sleep(RETRY_INTERVAL_MS);
+				}
+			}
 			Byte[] bytes = new Byte[4096];
 			Debug.Log("Client listening at " + this.IP.ToString() + ":" + this.port);
 			while (true)
@@ -273,6 +289,45 @@ public class MedusaTCPClient
 		}
 	}
 
+	/// <summary>
+	/// This method sends a binary message (e.g., an onset encoded with MessageInterpreter.OnsetEncoder). The content is
+	/// declared as latin-1, which maps each byte to one character, so MEDUSA recovers the exact bytes.
+	/// </summary>
+	/// <param name="content"> Byte array to send. </param>
+	public void SendBinaryMessage(byte[] content)
+	{
+		if (!this.isConnected())
+		{
+			return;
+		}
+		try
+		{
+			NetworkStream stream = socketConnection.GetStream();
+			if (stream.CanWrite)
+			{
+				// Compute the headers
+				Dictionary<string, object> msgJSONHeader = new Dictionary<string, object>();
+				msgJSONHeader["byteorder"] = "little";
+				msgJSONHeader["content-type"] = "binary/cvep-event";
+				msgJSONHeader["content-encoding"] = "latin-1";
+				msgJSONHeader["content-length"] = content.Length;
+				byte[] bClientMessageJSONHeader = Encoding.UTF8.GetBytes(JsonConvert.SerializeObject(msgJSONHeader));
+
+				// Compute the protoheader (big-endian)
+				Int16 hl = Convert.ToInt16(bClientMessageJSONHeader.Length);
+				byte[] bClientMessageProtoHeader = BitConverter.GetBytes(hl);
+				Array.Reverse(bClientMessageProtoHeader, 0, bClientMessageProtoHeader.Length);
+
+				byte[] message = addBytes(addBytes(bClientMessageProtoHeader, bClientMessageJSONHeader), content);
+				stream.Write(message, 0, message.Length);
+			}
+		}
+		catch (SocketException socketException)
+		{
+			Debug.Log("Socket exception: " + socketException);
+		}
+	}
+
 	/// <summary>
 	/// This method stops the MedusaTCPClient, killing the listening thread and closing the connection.
 	/// </summary>
@@ -13,6 +13,7 @@
 using System.Collections;
 using System.Collections.Generic;
 using System;
+using System.IO;
 using UnityEngine;
 using Newtonsoft.Json;
 
@@ -34,6 +35,11 @@ public class MessageInterpreter
         return ParameterDecoder.getParametersFromJSON(message);
     }
 
+    public ParameterDecoder decodeParameters(string message, ParameterDecoder previous)
+    {
+        return ParameterDecoder.getParametersFromJSON(message, previous);
+    }
+
     public string decodeException(string message)
     {
         return ExceptionDecoder.getExceptionFromJSON(message);
@@ -44,6 +50,21 @@ public class MessageInterpreter
         return SelectionDecoder.getSelectionFromJSON(message);
     }
 
+    public int decodeSelectionTrial(string message)
+    {
+        return JsonUtility.FromJson<SelectionDecoder>(message).trial;
+    }
+
+    public PingDecoder decodePing(string message)
+    {
+        return PingDecoder.getPingFromJSON(message);
+    }
+
+    public RelabelDecoder decodeRelabel(string message)
+    {
+        return RelabelDecoder.getRelabelFromJSON(message);
+    }
+
     /* ----------------------------------- DECODING CLASSES ------------------------------------ */
     /** Class to decode the event_type first. */
     public class EventTypeDecoder
@@ -102,12 +123,41 @@ public class MessageInterpreter
         public string scenario_name;
         public string scenario_path;
 
+        // Resume (optional): first trial to run and previous selections [matrix, row, col]
+        public int resumeTrial = 0;
+        public List<int[]> resumeSelections;
+
+        // Session host: if true, only the parameters modified since the previous run are sent
+        public bool incremental = false;
+
+        // If true, onsets must be sent in binary format (see OnsetEncoder)
+        public bool binaryEvents = false;
+
+        // Number of cycles whose onsets are sent in the same message (0: one message per cycle)
+        public int onsetBatchCycles = 0;
+
+        // If true, the next trial starts while MEDUSA decodes the previous one
+        public bool pipelinedTrials = false;
+
         public static ParameterDecoder getParametersFromJSON(string jsonString)
         {
             ParameterDecoder p = JsonConvert.DeserializeObject<ParameterDecoder>(jsonString);
             return p;
         }
 
+        public static ParameterDecoder getParametersFromJSON(string jsonString, ParameterDecoder previous)
+        {
+            ParameterDecoder p = JsonConvert.DeserializeObject<ParameterDecoder>(jsonString);
+            if (p.incremental && previous != null)
+            {
+                // Apply the modified parameters over a copy of the previous ones (lists are replaced, not merged)
+                p = JsonConvert.DeserializeObject<ParameterDecoder>(JsonConvert.SerializeObject(previous));
+                JsonSerializerSettings settings = new JsonSerializerSettings { ObjectCreationHandling = ObjectCreationHandling.Replace };
+                JsonConvert.PopulateObject(jsonString, p, settings);
+            }
+            return p;
+        }
+
         public class BothMatrices
         {
             public List<Matrix> train { get; set; }
@@ -145,6 +195,7 @@ public class MessageInterpreter
     public class SelectionDecoder
     {
         public int[] selection_coords;
+        public int trial = -1;      // Decoded trial (not sent by older MEDUSA versions)
 
         public static int[] getSelectionFromJSON(string jsonString)
         {
@@ -153,6 +204,31 @@ public class MessageInterpreter
         }
     }
 
+    /** Class to decode the pings used to estimate the clock offset. */
+    public class PingDecoder
+    {
+        public int seq;
+        public double t0;
+
+        public static PingDecoder getPingFromJSON(string jsonString)
+        {
+            return JsonConvert.DeserializeObject<PingDecoder>(jsonString);
+        }
+    }
+
+    /** Class to decode the new texts of some cells of a test matrix. */
+    public class RelabelDecoder
+    {
+        public int matrix_idx;
+        public int[] cells;
+        public string[] texts;
+
+        public static RelabelDecoder getRelabelFromJSON(string jsonString)
+        {
+            return JsonConvert.DeserializeObject<RelabelDecoder>(jsonString);
+        }
+    }
+
     // Utility
     public static Color hexToColor(string hex)
     {
@@ -171,6 +247,70 @@ public class MessageInterpreter
     }
 }
 
+/** Binary encoding of the onsets (see protocol.py in MEDUSA): 22 bytes, little-endian
+ *  magic (byte), event (byte: 1 train, 2 test), cycle, trial, matrix_idx, unit_idx, level_idx (uint16),
+ *  command_idx (int16, -1 if not present) and onset (double).
+ **/
+public static class OnsetEncoder
+{
+    public const byte MAGIC = 0xC5;
+    public const byte EVENT_TRAIN = 1;
+    public const byte EVENT_TEST = 2;
+
+    public static byte[] encode(byte eventType, int cycle, int trial, int matrixIdx, int unitIdx, int levelIdx, int commandIdx, double onset)
+    {
+        using (MemoryStream ms = new MemoryStream(22))
+        using (BinaryWriter writer = new BinaryWriter(ms))     // BinaryWriter is always little-endian
+        {
+            writer.Write(MAGIC);
+            writer.Write(eventType);
+            writer.Write((ushort)cycle);
+            writer.Write((ushort)trial);
+            writer.Write((ushort)matrixIdx);
+            writer.Write((ushort)unitIdx);
+            writer.Write((ushort)levelIdx);
+            writer.Write((short)commandIdx);
+            writer.Write(onset);
+            return ms.ToArray();
+        }
+    }
+
+    // A batch is the concatenation of the encoded onsets
+    public static byte[] encodeBatch(List<OnsetInfo> onsets)
+    {
+        using (MemoryStream ms = new MemoryStream(22 * onsets.Count))
+        {
+            foreach (OnsetInfo o in onsets)
+            {
+                byte[] encoded = encode(o.eventType, o.cycle, o.trial, o.matrixIdx, 0, 0, o.commandIdx, o.onset);
+                ms.Write(encoded, 0, encoded.Length);
+            }
+            return ms.ToArray();
+        }
+    }
+}
+
+// Onset of a cycle that has not been sent yet (see Manager.sendOnset)
+public class OnsetInfo
+{
+    public byte eventType;
+    public int cycle;
+    public int trial;
+    public int matrixIdx;
+    public int commandIdx;      // -1 if not present (online mode)
+    public double onset;
+
+    public OnsetInfo(byte eventType, int cycle, int trial, int matrixIdx, int commandIdx, double onset)
+    {
+        this.eventType = eventType;
+        this.cycle = cycle;
+        this.trial = trial;
+        this.matrixIdx = matrixIdx;
+        this.commandIdx = commandIdx;
+        this.onset = onset;
+    }
+}
+
 public class ServerMessage
 {
     public Dictionary<string, object> message = new Dictionary<string, object>();
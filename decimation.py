@@ -0,0 +1,60 @@
+import numpy as np
+from scipy import signal as sp_signal
+
+# Intervals between timestamps longer than this number of sample periods are
+# gaps (e.g., between the windows of a chunked recording). The jitter of LSL
+# timestamps and the timestamps stamped per chunk are well below it
+MAX_GAP_PERIODS = 10
+
+
+def check_decimation(fs, factor, max_freq):
+    """ Raises ValueError if the band of interest (up to max_freq) does not
+    fit below the Nyquist frequency of the decimated signal. """
+    if factor > 1 and max_freq >= 0.5 * fs / factor:
+        raise ValueError('Cannot decimate by %i: the new Nyquist frequency '
+                         '(%.1f Hz) is below the cutoff of the filters '
+                         '(%.1f Hz)' % (factor, 0.5 * fs / factor, max_freq))
+
+
+def decimate(times, signal, factor, fs):
+    """ Decimates a signal by an integer factor with a polyphase FIR filter
+    (anti-aliasing and downsampling in a single pass, only the output
+    samples are computed).
+
+    Windowed recordings (e.g., chunked recordings loaded around the trials)
+    have gaps between windows, so each contiguous segment is decimated
+    separately to avoid filtering across them. Gaps are detected with the
+    nominal sample rate (see MAX_GAP_PERIODS), so jittered timestamps do not
+    split the signal.
+
+    Parameters
+    ----------
+    times: numpy.ndarray
+        Timestamps of the samples.
+    signal: numpy.ndarray
+        Signal with shape [n_samples x n_channels].
+    factor: int
+        Decimation factor (1 returns the input).
+    fs: float
+        Nominal sample rate of the signal.
+
+    Returns
+    -------
+    times: numpy.ndarray
+        Timestamp of each output sample (the one of the input sample it
+        corresponds to).
+    signal: numpy.ndarray
+        Decimated signal.
+    """
+    factor = int(factor)
+    if factor <= 1:
+        return times, signal
+    times = np.asarray(times)
+    gaps = np.flatnonzero(np.diff(times) > MAX_GAP_PERIODS / fs) + 1
+    bounds = np.concatenate(([0], gaps, [times.shape[0]]))
+    out_times, out_signal = list(), list()
+    for k0, k1 in zip(bounds[:-1], bounds[1:]):
+        out_times.append(times[k0:k1:factor])
+        out_signal.append(sp_signal.resample_poly(signal[k0:k1], 1, factor,
+                                                  axis=0))
+    return np.concatenate(out_times), np.concatenate(out_signal)
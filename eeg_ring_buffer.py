@@ -0,0 +1,176 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedRingBuffer:
+
+    HEADER_BYTES = 64
+
+    def __init__(self, n_cha, capacity, dtype='float64', name=None,
+                 create=True):
+        """ Fixed-capacity ring buffer of timestamped samples stored in
+        shared memory.
+
+        Each sample is written twice (at position k % capacity and at
+        k % capacity + capacity), so the last `capacity` samples can always be
+        returned as a contiguous NumPy view without copying. The total number
+        of written samples (write index) is stored in the header and increases
+        monotonically, so readers can address samples by their absolute index.
+
+        Parameters
+        ----------
+        n_cha: int
+            Number of channels.
+        capacity: int
+            Maximum number of samples that can be read back.
+        dtype: basestring
+            Data type of the signal. Timestamps are always float64.
+        name: basestring or None
+            Name of the shared memory block. If None, a random name is used.
+        create: bool
+            If True, the block is created. Otherwise, an existing block with
+            the given name is attached (e.g., from another process).
+        """
+        self.n_cha = int(n_cha)
+        self.capacity = int(capacity)
+        self.dtype = np.dtype(dtype)
+        times_bytes = 2 * self.capacity * 8
+        signal_bytes = 2 * self.capacity * self.n_cha * self.dtype.itemsize
+        self.owner = create
+        if create:
+            self.shm = shared_memory.SharedMemory(
+                name=name, create=True,
+                size=self.HEADER_BYTES + times_bytes + signal_bytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self._header = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf)
+        self._times = np.ndarray((2 * self.capacity,), dtype=np.float64,
+                                 buffer=self.shm.buf,
+                                 offset=self.HEADER_BYTES)
+        self._signal = np.ndarray((2 * self.capacity, self.n_cha),
+                                  dtype=self.dtype, buffer=self.shm.buf,
+                                  offset=self.HEADER_BYTES + times_bytes)
+        if create:
+            self._header[0] = 0
+
+    @classmethod
+    def attach(cls, name, n_cha, capacity, dtype='float64'):
+        """ Attaches to a ring buffer created by another process. """
+        return cls(n_cha, capacity, dtype=dtype, name=name, create=False)
+
+    def get_description(self):
+        """ Returns the arguments required by `attach`. """
+        return {'name': self.name, 'n_cha': self.n_cha,
+                'capacity': self.capacity, 'dtype': self.dtype.str}
+
+    @property
+    def write_index(self):
+        """ Total number of samples written since the creation. """
+        return int(self._header[0])
+
+    @property
+    def first_index(self):
+        """ Absolute index of the oldest sample that can be read. """
+        return max(0, self.write_index - self.capacity)
+
+    def write(self, times, signal):
+        """ Appends samples. Only one writer is supported. The write index
+        is updated after the data, so readers never see partial samples. """
+        n = min(times.shape[0], signal.shape[0])
+        if n == 0:
+            return
+        times, signal = times[-self.capacity:], signal[-self.capacity:]
+        w = self.write_index + n - times.shape[0]
+        n = times.shape[0]
+        start = w % self.capacity
+        # Positions [start, start + n) never exceed 2 * capacity
+        self._times[start:start + n] = times
+        self._signal[start:start + n] = signal
+        # Mirror
+        lo = start + self.capacity
+        hi = min(lo + n, 2 * self.capacity)
+        self._times[lo:hi] = times[:hi - lo]
+        self._signal[lo:hi] = signal[:hi - lo]
+        if start + n > self.capacity:
+            wrapped = start + n - self.capacity
+            self._times[:wrapped] = times[n - wrapped:]
+            self._signal[:wrapped] = signal[n - wrapped:]
+        self._header[0] = w + n
+
+    def view(self, k0, k1=None):
+        """ Returns read-only views of the samples with absolute indexes in
+        [k0, k1). The data of a view is valid while `is_valid(k0)`.  """
+        k1 = self.write_index if k1 is None else k1
+        k0 = max(k0, self.first_index)
+        if k1 <= k0:
+            return self._empty()
+        start = k0 % self.capacity
+        times = self._times[start:start + k1 - k0]
+        signal = self._signal[start:start + k1 - k0]
+        times.flags.writeable = False
+        signal.flags.writeable = False
+        return times, signal
+
+    def latest(self, n=None):
+        """ Returns views of the last n samples (all available if None). """
+        k1 = self.write_index
+        k0 = self.first_index if n is None else k1 - n
+        return self.view(k0, k1)
+
+    def index_of(self, t):
+        """ Returns the absolute index of the first sample whose timestamp is
+        greater than or equal to t (timestamps must increase). """
+        times, _ = self.latest()
+        return self.first_index + int(np.searchsorted(times, t, side='left'))
+
+    def since(self, t0):
+        """ Returns views of the samples whose timestamp is >= t0. """
+        return self.view(self.index_of(t0))
+
+    def after(self, t):
+        """ Returns views of the samples whose timestamp is > t. If t is None,
+        all the available samples are returned. """
+        if t is None:
+            return self.latest()
+        times, _ = self.latest()
+        k0 = self.first_index + int(np.searchsorted(times, t, side='right'))
+        return self.view(k0)
+
+    def last_timestamp(self):
+        """ Returns the timestamp of the last sample or None if empty. """
+        if self.write_index == 0:
+            return None
+        times, _ = self.latest(1)
+        return float(times[-1])
+
+    def covers(self, t):
+        """ Checks that no sample whose timestamp is >= t has been
+        overwritten, so `since(t)` returns all of them. """
+        if self.first_index == 0:
+            return True
+        times, _ = self.view(self.first_index, self.first_index + 1)
+        return times.shape[0] > 0 and times[0] <= t
+
+    def is_valid(self, k0):
+        """ Checks that the sample k0 has not been overwritten yet. """
+        return k0 >= self.first_index
+
+    def close(self):
+        """ Releases the views and detaches from the shared memory. """
+        self._header = self._times = self._signal = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # Views returned to the readers are still alive. The memory is
+            # released when they are garbage-collected
+            pass
+
+    def unlink(self):
+        """ Destroys the shared memory block (only the creator). """
+        if self.owner:
+            self.shm.unlink()
+
+    def _empty(self):
+        return np.zeros((0,)), np.zeros((0, self.n_cha), dtype=self.dtype)
@@ -0,0 +1,171 @@
+import multiprocessing as mp
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .eeg_ring_buffer import SharedRingBuffer
+from .model_input import prepare_model_input
+
+# Fusion rules of the scores of the models (see fuse_command_scores)
+FUSION_RULES = ('mean', 'rank', 'vote')
+
+# Model and attached ring buffer of the worker process (see _init_worker)
+_worker = dict()
+
+
+def _init_worker(model_path):
+    with open(model_path, 'rb') as handle:
+        _worker['model'] = pickle.load(handle)
+    _worker['ring'] = None
+
+
+def _get_window(window):
+    """ Returns (times, signal) of a window. The EEG is read from the shared
+    ring buffer of the App (no copies through the pipe) if its description
+    is given, or passed explicitly otherwise (e.g., the warm-up). """
+    if 'ring' not in window:
+        return window['times'], window['signal']
+    ring = _worker['ring']
+    if ring is None or ring.name != window['ring']['name']:
+        ring = _worker['ring'] = SharedRingBuffer.attach(**window['ring'])
+    times, signal = ring.since(window['t0'])
+    # Samples written after the window was defined are not used, so all the
+    # models decode exactly the same data. The window is copied, as the views
+    # are read-only and the ring keeps being written
+    n = int(np.searchsorted(times, window['t1'], side='right'))
+    return np.array(times[:n]), np.array(signal[:n])
+
+
+def _predict(window, fs, l_cha, exp_data, trial_idx, exclude):
+    from medusa import meeg
+    times, signal = _get_window(window)
+    # Preprocessing stored in the model
+    times, signal, fs, l_cha = prepare_model_input(_worker['model'], times,
+                                                   signal, fs, l_cha, exclude)
+    channels = meeg.EEGChannelSet()
+    channels.set_standard_montage(l_cha)
+    eeg = meeg.EEG(times, signal, fs, channels)
+    decoding = _worker['model'].predict(times=times, signal=signal,
+                                        trial_idx=trial_idx,
+                                        exp_data=exp_data, sig_data=eeg)
+    return get_command_scores(decoding)
+
+
+def get_command_key(cmd):
+    return int(cmd['coords'][0]), int(cmd['item']['row']), \
+        int(cmd['item']['col'])
+
+
+def get_command_scores(decoding):
+    """ Returns the commands of a decoding as a list of (key, score) sorted
+    by probability, where key is (matrix, row, col). The score is the
+    correlation with the template, or nan if the decoder does not provide
+    it. """
+    sorted_cmds = decoding['items_by_no_cycle'][-1][-1]['sorted_cmds']
+    scores = [cmd.get('correlation', cmd.get('score')) for cmd in sorted_cmds]
+    return [(get_command_key(cmd), np.nan if score is None else float(score))
+            for cmd, score in zip(sorted_cmds, scores)]
+
+
+def fuse_command_scores(score_lists, rule='mean'):
+    """ Fuses the command scores of several models.
+
+    Parameters
+    ----------
+    score_lists: list
+        Output of get_command_scores for each model.
+    rule: basestring
+        'mean': average score (if a model does not provide scores, 'rank' is
+        used). 'rank': average rank (Borda count). 'vote': number of models
+        whose best command is each one, ties are broken by the average rank.
+
+    Returns
+    -------
+    keys: list
+        Keys of the commands sorted by the fused score.
+    fused: numpy.ndarray
+        Fused score of each key (higher is better).
+    """
+    keys = sorted({key for scores in score_lists for key, _ in scores})
+    pos = {key: i for i, key in enumerate(keys)}
+    n_models, n_cmds = len(score_lists), len(keys)
+    values = np.full((n_models, n_cmds), np.nan)
+    # Commands that a model did not return get its worst rank
+    ranks = np.full((n_models, n_cmds), float(n_cmds))
+    for m, scores in enumerate(score_lists):
+        for r, (key, score) in enumerate(scores):
+            values[m, pos[key]] = score
+            ranks[m, pos[key]] = r
+    mean_rank = -np.mean(ranks, axis=0)
+    if rule == 'mean' and not np.any(np.all(np.isnan(values), axis=1)):
+        fused = np.nanmean(values, axis=0)
+    elif rule == 'vote':
+        votes = np.bincount(np.argmin(ranks, axis=1), minlength=n_cmds)
+        fused = votes + (mean_rank - np.min(mean_rank)) / (n_cmds + 1)
+    else:
+        fused = mean_rank
+    order = np.argsort(-fused, kind='stable')
+    return [keys[i] for i in order], fused[order]
+
+
+class ModelEnsemble:
+
+    def __init__(self, model_paths, rule='mean'):
+        """ Additional models that score each trial in parallel.
+
+        Each model is loaded in its own worker process, so all of them decode
+        the trial at the same time (also while the main model of the App
+        decodes it in its own process). The EEG is shared through the ring
+        buffer of the App (see SharedRingBuffer), only the trial info is sent
+        to the workers.
+
+        Parameters
+        ----------
+        model_paths: list
+            Paths of the pickled models.
+        rule: basestring
+            Fusion rule (see fuse_command_scores).
+        """
+        self.rule = rule
+        ctx = mp.get_context('spawn')
+        self.executors = [
+            ProcessPoolExecutor(max_workers=1, mp_context=ctx,
+                                initializer=_init_worker, initargs=(path,))
+            for path in model_paths]
+
+    def submit(self, window, fs, l_cha, exp_data, trial_idx, exclude=()):
+        """ Starts the decoding of a trial in all the workers. The channels in
+        `exclude` are not EEG (see prepare_model_input). Returns the futures
+        of the command scores. """
+        return [executor.submit(_predict, window, fs, l_cha, exp_data,
+                                trial_idx, exclude)
+                for executor in self.executors]
+
+    def fuse(self, decoding, futures):
+        """ Waits for the workers and returns the decoding of the main model
+        with its commands sorted by the fused score. The fused score is
+        stored as 'score' when the rule keeps the units of the correlation
+        ('mean'), and as nan otherwise. """
+        score_lists = [get_command_scores(decoding)] + \
+                      [future.result() for future in futures]
+        keys, fused = fuse_command_scores(score_lists, self.rule)
+        last = decoding['items_by_no_cycle'][-1][-1]
+        cmds = {get_command_key(cmd): cmd for cmd in last['sorted_cmds']}
+        sorted_cmds = list()
+        for key, score in zip(keys, fused):
+            if key not in cmds:
+                continue
+            cmd = {k: v for k, v in cmds[key].items()
+                   if k not in ('correlation', 'score')}
+            cmd['score'] = float(score) if self.rule == 'mean' and \
+                np.isfinite(score) else np.nan
+            sorted_cmds.append(cmd)
+        last['sorted_cmds'] = sorted_cmds
+        item = sorted_cmds[0]['item']
+        decoding['spell_result'] = [item['label'] or item['text']]
+        return decoding
+
+    def shutdown(self):
+        for executor in self.executors:
+            executor.shutdown(wait=False, cancel_futures=True)
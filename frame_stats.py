@@ -0,0 +1,64 @@
+import numpy as np
+
+# Per-cycle fields of the 'frames' messages sent by Unity (see Manager.cs)
+FIELDS = ('min_interval', 'max_interval', 'missed_frames')
+
+
+def new_frame_stats():
+    """ Returns an empty frame-timing record. It is stored as the
+    `frame_stats` attribute of CVEPSpellerData (JSON-serializable). """
+    stats = {'trial_idx': list(), 'cycle_idx': list()}
+    stats.update({field: list() for field in FIELDS})
+    return stats
+
+
+def append_frame_stats(stats, msg):
+    """ Appends the statistics of a 'frames' message: one value per cycle of
+    the trial msg['trial']. """
+    n = len(msg['cycle'])
+    stats['trial_idx'].extend([int(msg['trial'])] * n)
+    stats['cycle_idx'].extend(int(c) for c in msg['cycle'])
+    for field in FIELDS:
+        stats[field].extend(msg[field])
+
+
+def get_bad_cycles(stats, max_missed_frames=0):
+    """ Returns the (trial, cycle) pairs with more than `max_missed_frames`
+    dropped frames. """
+    missed = np.asarray(stats['missed_frames'])
+    bad = np.flatnonzero(missed > max_missed_frames)
+    return {(stats['trial_idx'][i], stats['cycle_idx'][i]) for i in bad}
+
+
+def get_bad_onsets_mask(cvep_data, max_missed_frames=0):
+    """ Returns a boolean mask of the onsets of cvep_data whose cycle has
+    been flagged. Recordings without frame statistics have no flags. """
+    mask = np.zeros(np.asarray(cvep_data.onsets).shape, dtype=bool)
+    stats = getattr(cvep_data, 'frame_stats', None)
+    if stats is None:
+        return mask
+    bad = get_bad_cycles(stats, max_missed_frames)
+    for i, (t, c) in enumerate(zip(cvep_data.trial_idx, cvep_data.cycle_idx)):
+        mask[i] = (int(t), int(c)) in bad
+    return mask
+
+
+def exclude_onsets(cvep_data, mask):
+    """ Removes the onsets where mask is True from the trial info of a
+    CVEPSpellerData instance (e.g., before training). """
+    from .live_dataset import LiveCVEPDataset
+    mask = np.asarray(mask, dtype=bool)
+    for att in LiveCVEPDataset.FIELDS:
+        values = np.asarray(getattr(cvep_data, att))
+        if values.shape[0] == mask.shape[0]:
+            setattr(cvep_data, att, values[~mask])
+
+
+def get_dropped_frame_rate(stats, frames_per_cycle):
+    """ Returns the fraction of stimulation frames that were not displayed.
+    """
+    n_missed = float(np.sum(stats['missed_frames']))
+    n_frames = len(stats['missed_frames']) * frames_per_cycle
+    if n_frames == 0:
+        return 0.0
+    return n_missed / n_frames
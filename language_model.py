@@ -0,0 +1,116 @@
+import collections
+import functools
+import math
+
+import numpy as np
+
+
+class CharNGramModel:
+
+    def __init__(self, order=4, cache_size=4096):
+        """ Character n-gram language model with Witten-Bell interpolation.
+
+        The counts of each context (up to order - 1 characters) are stored in
+        a table indexed by the context string, and the distribution of each
+        context is cached, so consecutive selections of the same run only
+        compute the distribution of the new context.
+
+        Parameters
+        ----------
+        order: int
+            Order of the model (e.g., 4 uses the last 3 characters).
+        cache_size: int
+            Number of context distributions kept in the cache.
+        """
+        self.order = order
+        # context -> Counter of next characters
+        self.counts = collections.defaultdict(collections.Counter)
+        self.alphabet = set()
+        self._distribution = functools.lru_cache(maxsize=cache_size)(
+            self._compute_distribution)
+
+    @staticmethod
+    def normalize(text):
+        """ Lower case, and '_' is treated as a space (matrices usually show
+        the space with an underscore). """
+        return text.lower().replace('_', ' ')
+
+    def fit(self, text):
+        """ Counts the n-grams of a text. """
+        text = self.normalize(text)
+        self.alphabet.update(text)
+        for i, char in enumerate(text):
+            for n in range(self.order):
+                if i - n < 0:
+                    break
+                self.counts[text[i - n:i]][char] += 1
+        self._distribution.cache_clear()
+        return self
+
+    @classmethod
+    def load(cls, file_path, order=4):
+        """ Builds the model from a corpus (UTF-8 text file). """
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return cls(order=order).fit(' '.join(f.read().split()))
+
+    def probability(self, char, context):
+        """ Returns P(char | context). Characters that are not in the
+        alphabet of the corpus get the probability of an unseen character. """
+        context = self.normalize(context)[-(self.order - 1):] \
+            if self.order > 1 else ''
+        distribution = self._distribution(context)
+        return distribution.get(self.normalize(char), distribution[None])
+
+    def _compute_distribution(self, context):
+        """ Witten-Bell: P(c|h) = (C(h, c) + T(h) P(c|h')) / (C(h) + T(h)),
+        where T(h) is the number of different characters seen after h and h'
+        is h without its first character. The recursion ends in a uniform
+        distribution over the alphabet plus one unseen character (None). """
+        if context == '' and '' not in self.counts:
+            n = len(self.alphabet) + 1
+            return {c: 1.0 / n for c in list(self.alphabet) + [None]}
+        lower = self._distribution(context[1:]) if context != '' else \
+            {c: 1.0 / (len(self.alphabet) + 1) for c in
+             list(self.alphabet) + [None]}
+        counts = self.counts.get(context)
+        if counts is None:
+            return lower
+        total, types = sum(counts.values()), len(counts)
+        return {c: (counts.get(c, 0) + types * p) / (total + types)
+                for c, p in lower.items()}
+
+
+def fuse_scores(scores, lm_probs, weight=1.0, temperature=0.05):
+    """ Combines the scores of the classifier with the prior of the language
+    model: posterior(i) ~ exp(scores[i] / temperature) * lm_probs[i]**weight.
+
+    Parameters
+    ----------
+    scores: numpy.ndarray
+        Score of each command (e.g., correlation with its template).
+    lm_probs: numpy.ndarray
+        Prior probability of each command. Commands that are not characters
+        should get a neutral value (e.g., the mean of the others).
+    weight: float
+        Weight of the language model (0 ignores it).
+    temperature: float
+        Scale of the scores of the classifier.
+
+    Returns
+    -------
+    posterior: numpy.ndarray
+        Normalized posterior probabilities.
+    """
+    log_post = np.asarray(scores, dtype=float) / temperature + \
+        weight * np.log(np.maximum(np.asarray(lm_probs, dtype=float), 1e-12))
+    log_post -= np.max(log_post)
+    posterior = np.exp(log_post)
+    return posterior / np.sum(posterior)
+
+
+def get_log_perplexity(model, text):
+    """ Returns the average negative log2-probability per character of a
+    text (useful to compare corpora and orders). """
+    text = model.normalize(text)
+    return -np.mean([math.log2(model.probability(c, text[:i]))
+                     for i, c in enumerate(text)])
@@ -0,0 +1,189 @@
+import copy
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from .app_constants import CVEP_DATA_KEY
+
+
+class LiveCVEPDataset:
+
+    # Attributes of CVEPSpellerData and their key in the onset messages
+    FIELDS = {'cycle_idx': 'cycle',
+              'onsets': 'onset',
+              'trial_idx': 'trial',
+              'matrix_idx': 'matrix_idx',
+              'level_idx': 'level_idx',
+              'unit_idx': 'unit_idx',
+              'command_idx': 'command_idx'}
+
+    def __init__(self, cvep_data, get_eeg_data, initial_capacity=1024):
+        """ CVEPSpellerDataset that is kept updated during the run.
+
+        The dataset, the recording and the EEG are built only once. The
+        trial info of `cvep_data` is stored in preallocated arrays that grow
+        geometrically (amortized O(1) appends), and the attributes of
+        `cvep_data` are views of these arrays. The EEG of the recording is
+        re-pointed to the latest data at each snapshot, so a snapshot costs
+        O(new data) instead of O(session).
+
+        Parameters
+        ----------
+        cvep_data: cvep_spellers.CVEPSpellerData
+            Experiment data of the run. Its trial info arrays are replaced by
+            views of the internal buffers.
+        get_eeg_data: callable
+            Function that returns (times, signal, fs, channel_set, equipment)
+            with the latest EEG (e.g., App.get_eeg_data).
+        initial_capacity: int
+            Initial number of onsets of the buffers.
+        """
+        self.cvep_data = cvep_data
+        self.get_eeg_data = get_eeg_data
+        self.lock = threading.RLock()
+        self.initial_capacity = initial_capacity
+        self.dataset = None
+        self._recording = None
+        self._buffers = dict()
+        self._lengths = dict()
+        # Number of onsets discarded by the retention policy and excluded
+        # from decoding (see exclude)
+        self.n_discarded = 0
+        self.n_excluded = 0
+        for att in self.FIELDS:
+            self._set_values(att, np.asarray(getattr(cvep_data, att)))
+
+    def _set_values(self, att, values):
+        buffer = np.zeros((max(self.initial_capacity, values.shape[0]),))
+        buffer[:values.shape[0]] = values
+        self._buffers[att] = buffer
+        self._lengths[att] = values.shape[0]
+        setattr(self.cvep_data, att, buffer[:values.shape[0]])
+
+    def append_trial_info(self, msg):
+        """ Appends the trial info of an onset message. Fields that are not
+        present in the message (e.g., command_idx in online mode) are
+        skipped. """
+        with self.lock:
+            for att, key in self.FIELDS.items():
+                if key in msg:
+                    self._append(att, np.atleast_1d(msg[key]))
+
+    def append_trial_batch(self, fields):
+        """ Appends several onsets at once. `fields` maps the attributes of
+        CVEPSpellerData (see FIELDS) to arrays of the same length. """
+        with self.lock:
+            for att, values in fields.items():
+                self._append(att, np.asarray(values, dtype=float))
+
+    def _append(self, att, values):
+        n = self._lengths[att]
+        buffer = self._buffers[att]
+        if n + values.shape[0] > buffer.shape[0]:
+            new_buffer = np.zeros((max(2 * buffer.shape[0],
+                                       n + values.shape[0]),))
+            new_buffer[:n] = buffer[:n]
+            buffer = self._buffers[att] = new_buffer
+        buffer[n:n + values.shape[0]] = values
+        self._lengths[att] = n + values.shape[0]
+        setattr(self.cvep_data, att, buffer[:self._lengths[att]])
+
+    def discard_before(self, t):
+        """ Discards the trials whose onsets are all older than t. The last
+        trial is always kept. New buffers are allocated, so the arrays that
+        consumers already hold are never modified.
+
+        Returns
+        -------
+        n: int
+            Number of discarded onsets.
+        """
+        with self.lock:
+            onsets = self.cvep_data.onsets
+            trial_idx = self.cvep_data.trial_idx
+            if onsets.shape[0] == 0:
+                return 0
+            idx = int(np.searchsorted(onsets, t, side='left'))
+            # Keep the whole trial of the first kept onset (and the last one)
+            idx = min(idx, onsets.shape[0] - 1)
+            idx = int(np.argmax(trial_idx == trial_idx[idx]))
+            if idx == 0:
+                return 0
+            for att in self.FIELDS:
+                values = getattr(self.cvep_data, att)
+                self._set_values(att, values[min(idx, values.shape[0]):])
+            self.n_discarded += idx
+            return idx
+
+    def exclude(self, mask):
+        """ Removes the onsets where mask is True (e.g., cycles with dropped
+        frames) so they are not used for decoding. Use `restore` to recover
+        them. """
+        with self.lock:
+            mask = np.asarray(mask, dtype=bool)
+            if not np.any(mask):
+                return
+            for att in self.FIELDS:
+                values = getattr(self.cvep_data, att)
+                if values.shape[0] == mask.shape[0]:
+                    self._set_values(att, values[~mask])
+            self.n_excluded += int(np.sum(mask))
+
+    def restore(self, events):
+        """ Replaces the trial info with the one of the given onset
+        messages (e.g., the events of the spool, to undo the retention
+        policy before saving). """
+        with self.lock:
+            for att, key in self.FIELDS.items():
+                self._set_values(att, np.array(
+                    [e[key] for e in events if key in e], dtype=float))
+            self.n_discarded = 0
+            self.n_excluded = 0
+
+    def copy_trial(self, trial_idx):
+        """ Returns a deep copy of the experiment data with the onsets of a
+        single trial, which is not modified by new onsets, `exclude` or the
+        retention policy (e.g., to decode the trial in another process). """
+        with self.lock:
+            exp_data = copy.copy(self.cvep_data)
+            mask = self.cvep_data.trial_idx == trial_idx
+            for att in self.FIELDS:
+                values = getattr(self.cvep_data, att)
+                if values.shape[0] == mask.shape[0]:
+                    setattr(exp_data, att, values[mask])
+            return copy.deepcopy(exp_data)
+
+    @contextmanager
+    def snapshot(self):
+        """ Context manager that yields the updated CVEPSpellerDataset. New
+        onsets are not appended while the snapshot is in use, so the trial
+        info and the EEG are consistent. """
+        with self.lock:
+            times, signal, fs, channel_set, equipment = self.get_eeg_data()
+            if self.dataset is None:
+                self._build(times, signal, fs, channel_set, equipment)
+            else:
+                self._recording.eeg.times = times
+                self._recording.eeg.signal = signal
+                setattr(self._recording, CVEP_DATA_KEY, self.cvep_data)
+            yield self.dataset
+
+    def _build(self, times, signal, fs, channel_set, equipment):
+        from medusa import components
+        from medusa import meeg
+        from medusa.bci import cvep_spellers as cvep
+        eeg = meeg.EEG(times, signal, fs, channel_set, equipement=equipment)
+        rec = components.Recording(
+            subject_id='',
+            recording_id='',
+            description='',
+            date=time.strftime("%d-%m-%Y %H:%M", time.localtime()))
+        rec.add_biosignal(eeg, 'eeg')
+        rec.add_experiment_data(self.cvep_data, CVEP_DATA_KEY)
+        self.dataset = cvep.CVEPSpellerDataset(channel_set=channel_set,
+                                               fs=fs)
+        self.dataset.add_recordings(rec)
+        # The dataset may store a processed copy of the recording
+        self._recording = self.dataset.recordings[-1]
@@ -1,13 +1,21 @@
 # BUILT-IN MODULES
 import multiprocessing as mp
+import threading
 import time
+import collections
+import copy
+from concurrent.futures import ThreadPoolExecutor, as_completed
+_t_import = time.perf_counter()
 import os.path
+import glob
+import json
 # EXTERNAL MODULES
-from PySide6.QtWidgets import QApplication
+from PySide6.QtWidgets import QApplication, QMessageBox
 import numpy as np
 import pickle
 # MEDUSA-KERNEL MODULES
-from medusa import components, emg, nirs, ecg
+# Note: emg, nirs and ecg are only imported when saving those streams
+from medusa import components
 from medusa import meeg
 from medusa.bci import cvep_spellers as cvep
 # MEDUSA MODULES
@@ -18,6 +26,20 @@ from gui import gui_utils
 from . import app_controller
 from .app_constants import *
 from .app_controller import AppController
+from .utils_profiling import StartupProfiler
+from .recording_writer import RecordingWriter, get_new_samples
+from . import chunked_recording
+from .eeg_ring_buffer import SharedRingBuffer
+from .live_dataset import LiveCVEPDataset
+from . import protocol
+from . import photodiode
+from . import frame_stats
+from . import raster_latencies
+from .language_model import CharNGramModel, fuse_scores
+from . import word_completion
+from .ensemble import ModelEnsemble
+from . import model_input
+_t_import = time.perf_counter() - _t_import
 
 
 class App(resources.AppSkeleton):
@@ -57,6 +79,12 @@ class App(resources.AppSkeleton):
     def __init__(self, app_info, app_settings, medusa_interface,
                  app_state, run_state, working_lsl_streams_info,
                  rec_info):
+        # Startup profiling (time-to-server-up)
+        self.profiler = StartupProfiler('[apps/cvep_speller/main] ',
+                                        enabled=PROFILE_STARTUP,
+                                        t0=time.perf_counter() - _t_import)
+        self.profiler.checkpoint('module imported')
+
         # Call superclass constructor
         super().__init__(app_info, app_settings, medusa_interface,
                          app_state, run_state, working_lsl_streams_info,
@@ -77,8 +105,9 @@ class App(resources.AppSkeleton):
             working_lsl_streams_info)
 
         # Booleans
-        self.process_required = False
         self.trainmodel_required = False
+        # Trials waiting to be decoded, in order (see enqueue_trial)
+        self.pending_trials = collections.deque()
 
         # Load model if available
         self.cvep_model = None
@@ -113,9 +142,42 @@ class App(resources.AppSkeleton):
             fps_resolution=self.app_settings.run_settings.fps_resolution,
             spell_target=target_
         )
+        # Raster latency of each command (see set_raster_latencies)
+        self.cvep_data.raster_events = raster_latencies.new_raster_events()
+        # Frame-timing statistics of each cycle (see record_frame_stats)
+        self.cvep_data.frame_stats = frame_stats.new_frame_stats()
+        # Live dataset, updated as onsets and EEG samples arrive
+        self.live_dataset = LiveCVEPDataset(self.cvep_data, self.get_eeg_data)
+
+        # Incremental recording writer (see recording_thread_worker)
+        self.rec_writer = None
+        # Info sent to Unity to resume an interrupted run (see
+        # check_resumable_run)
+        self.resume_info = None
+        self.resume_trial_offset = None
+        self.recording_thread = None
+        self.recording_stop_event = threading.Event()
+
+        # Shared-memory ring buffer with the EEG (see ingest_eeg_samples)
+        self.eeg_ring = None
+        self.eeg_ring_lock = threading.Lock()
+
+        # Model warm-up (see prepare_decoding)
+        self.model_ready = threading.Event()
+        # Additional models that score each trial (see start_ensemble)
+        self.ensemble = None
+        # Language model (see load_language_model)
+        self.language_model = None
+        # Word suggestions (see update_suggestions)
+        self.vocabulary = None
+        self.suggestions = []
+        # Suggestions shown during each pending trial (see enqueue_trial)
+        self.trial_suggestions = dict()
+        self.spelled_text = ''
 
         # Debugging?
         self.is_debugging = False
+        self.profiler.checkpoint('app initialized')
 
     def handle_exception(self, ex):
         if not isinstance(ex, exceptions.MedusaException):
@@ -134,9 +196,12 @@ class App(resources.AppSkeleton):
             if lsl_info['lsl_type'] == 'EEG':
                 count += 1
                 # Check if labels are correct
+                # The photodiode channel is not EEG (it has no coordinates)
                 ch_set = meeg.EEGChannelSet()
+                l_cha = [l for l in lsl_info['l_cha']
+                         if l not in self.get_non_eeg_channels()]
                 try:
-                    ch_set.set_standard_montage(l_cha=lsl_info['l_cha'])
+                    ch_set.set_standard_montage(l_cha=l_cha)
                 except meeg.ChannelNotFound as e:
                     raise exceptions.IncorrectLSLConfig(
                     "It seems that channel labels are not present in the LSL "
@@ -183,6 +248,15 @@ class App(resources.AppSkeleton):
         """Returns the LSL worker"""
         return self.lsl_workers[self.eeg_worker_name]
 
+    def get_worker_samples(self, uid, last_timestamp=None):
+        """ Returns views of the samples of a stream received after
+        last_timestamp (all of them if None). The buffers of the LSL worker
+        are read directly, as get_data() copies the whole run, so the caller
+        only copies the new samples. """
+        lsl_worker = self.lsl_workers[uid]
+        return get_new_samples(lsl_worker.timestamps, lsl_worker.data,
+                               last_timestamp)
+
     # ---------------------------- LOG ----------------------------
     def send_to_log(self, msg):
         """ Styles a message to be sent to the main MEDUSA log. """
@@ -237,12 +311,22 @@ class App(resources.AppSkeleton):
         # Wait until UNITY is UP and send the parameters
         while self.app_controller.unity_state.value == UNITY_DOWN:
             time.sleep(0.1)
-        self.app_controller.send_parameters()
+        self.app_controller.start_clock_sync()
+        self.app_controller.send_parameters(self.resume_info)
 
         # Wait until UNITY is ready
         while self.app_controller.unity_state.value == UNITY_UP:
             time.sleep(0.1)
         self.send_to_log('Unity is ready to start')
+        # First word suggestions (the vocabulary is loaded during the warm-up)
+        if self.app_settings.run_settings.vocabulary_path:
+            self.model_ready.wait()
+            if not self.app_controller.unity_relabel:
+                # The cells would enter words that the user has not seen
+                self.send_to_log('This Unity build cannot show word '
+                                 'suggestions, they are disabled')
+                self.vocabulary = None
+            self.update_suggestions()
 
         # If play is pressed
         while self.run_state.value == mds_constants.RUN_STATE_READY:
@@ -269,44 +353,32 @@ class App(resources.AppSkeleton):
             if self.run_state.value == mds_constants.RUN_STATE_STOP:
                 close_everything()
 
-            # Processing event
-            if self.process_required:
+            # Processing event (the oldest trial first)
+            if len(self.pending_trials) > 0:
                 if self.cvep_model is None:
                     raise Exception('[cvep_speller] Cannot process the trial '
                                     'if the model has not been trained before!')
+                # The model cannot be used while it is warming up
+                self.model_ready.wait()
+                trial_idx = self.pending_trials[0]
                 # We need to wait until the signal from the last onset is
                 # enough to extract the full epoch
-                if not self.cvep_model.check_predict_feasibility(
-                        self.get_current_dataset()):
+                if not self.is_trial_feasible(trial_idx):
                     print('[cvep_speller] Epoch length is not enough, '
                               'waiting for more samples...')
                 else:
-                    self.process_required = False
-                    decoding = self.process_trial()
+                    self.pending_trials.popleft()
+                    decoding = self.process_trial(trial_idx)
 
                     # Notify UNITY about the selected character
-                    # todo: matrix, level, unit etc
-                    # Aclaration:
-                    # 1) [-1] to access the last cycle (max no. cycles)
-                    # 2) [-1] to access the last and unique training seq
-                    # 3) ['sorted_cmds'] to access the commands sorted by
-                    # their probability of being selected
-                    # 4) [0] to get the most probable command
-                    # 5) ['coords'][0] to get the matrix index
-                    #    ['item']['row'] to get the row inside the matrix
-                    #    ['item']['col'] to get the col inside the matrix
-                    coords_ = [
-                        decoding['items_by_no_cycle'][-1][-1][
-                            'sorted_cmds'][0]['coords'][0],
-                        decoding['items_by_no_cycle'][-1][-1][
-                                'sorted_cmds'][0]['item']['row'],
-                        decoding['items_by_no_cycle'][-1][-1][
-                                'sorted_cmds'][0]['item']['col']
-                    ]
+                    coords_, label_ = self.get_selection(decoding, trial_idx)
                     self.app_controller.notify_selection(
                             selection_coords=coords_,
-                            selection_label=decoding['spell_result'][0]
+                            selection_label=label_,
+                            trial=trial_idx - (self.resume_trial_offset or 0)
                     )
+                    self.journal_selection(coords_, label_, trial_idx)
+                    self.update_suggestions()
         print(TAG, 'Terminated')
 
     def process_event(self, dict_event):
@@ -329,9 +401,18 @@ class App(resources.AppSkeleton):
             # Onset information. E.g.: msg = {"event_type":"train",
             # "target":"C", "cycle":0,"onset":5393}
             self.append_trial_info(dict_event)
+        elif dict_event["event_type"] in protocol.BATCH_EVENT_TYPES:
+            # Onsets of several cycles
+            self.append_trial_batch(dict_event)
+        elif dict_event["event_type"] == "resize":
+            # Raster latencies of the commands
+            self.set_raster_latencies(dict_event)
+        elif dict_event["event_type"] == "frames":
+            # Frame-timing statistics of the last trial
+            self.record_frame_stats(dict_event)
         elif dict_event["event_type"] == "processPlease":
             # Unity is requesting MEDUSA to process the previous trial
-            self.process_required = True
+            self.enqueue_trial(dict_event.get('trial'))
         else:
             print(self.TAG, 'Unknown event_type %s' % dict_event["event_type"])
 
@@ -351,6 +432,7 @@ class App(resources.AppSkeleton):
         # 1 - Change app state to powering on
         self.medusa_interface.app_state_changed(
             mds_constants.APP_STATE_POWERING_ON)
+        self.check_resumable_run()
         # 2 - Set up the controller that starts the TCP server
         self.app_controller = app_controller.AppController(
             callback=self,
@@ -363,6 +445,12 @@ class App(resources.AppSkeleton):
         # execution until it is closed
         while self.app_controller.server_state.value == SERVER_DOWN:
             time.sleep(0.1)
+        self.profiler.checkpoint('server up')
+        self.profiler.report()
+        self.start_eeg_ring_buffer()
+        self.start_recording_writer()
+        # Load the models and warm them up while Unity is launching
+        threading.Thread(target=self.prepare_decoding, daemon=True).start()
         if self.is_debugging:
             # When debugging
             while self.app_controller:
@@ -382,20 +470,23 @@ class App(resources.AppSkeleton):
         # 6 - Change app state to powering off
         self.medusa_interface.app_state_changed(
             mds_constants.APP_STATE_POWERING_OFF)
-        # 7 - Stop working threads
+        # 7 - Stop working threads and finalize the spool of the run
         self.stop_working_threads()
+        self.stop_recording_writer()
+        self.stop_ensemble()
+        self.stop_eeg_ring_buffer()
         # 8 - Save recording
         if self.get_lsl_worker().data.shape[0] > 0:
             file_path = self.get_file_path_from_rec_info()
             rec_streams_info = self.get_rec_streams_info()
             if file_path is None:
                 # Display save dialog to retrieve file_info
-                qt_app = QApplication([])
+                qt_app = QApplication.instance() or QApplication([])
                 self.save_file_dialog = resources.SaveFileDialog(
                     self.rec_info,
                     rec_streams_info,
                     self.app_info['extension'],
-                    allowed_formats=['bson'])
+                    allowed_formats=['bson', CHUNKED_FORMAT])
                 self.save_file_dialog.accepted.connect(
                     self.on_save_rec_accepted)
                 self.save_file_dialog.rejected.connect(
@@ -428,106 +519,183 @@ class App(resources.AppSkeleton):
 
     @exceptions.error_handler(scope='app')
     def on_save_rec_rejected(self):
-        pass
+        if self.rec_writer is not None:
+            self.rec_writer.discard()
 
     @exceptions.error_handler(scope='app')
     def save_recording(self, file_path, rec_streams_info):
-        # Recording
-        rec = components.Recording(
-            subject_id=self.rec_info.pop('subject_id'),
-            recording_id=self.rec_info.pop('rec_id'),
-            date=time.strftime("%d-%m-%Y %H:%M", time.localtime()),
-            **self.rec_info)
-        # Experiment data
-        rec.add_experiment_data(self.cvep_data)
-        # Streams data
-        for lsl_stream in self.lsl_streams_info:
-            if not rec_streams_info[lsl_stream.medusa_uid]['enabled']:
-                continue
-            if lsl_stream.medusa_type == 'EEG':
-                lsl_worker = self.lsl_workers[lsl_stream.medusa_uid]
-                times, signal = lsl_worker.get_data()
-                channel_set = meeg.EEGChannelSet()
-                channel_set.set_standard_montage(
-                    l_cha=lsl_worker.receiver.l_cha,
-                    allow_unlocated_channels=True)
-                biosignal = meeg.EEG(
-                    times=times,
-                    signal=signal,
-                    fs=lsl_worker.receiver.fs,
-                    channel_set=channel_set,
-                    lsl_stream_info=lsl_stream.to_serializable_obj())
-            elif lsl_stream.medusa_type == 'ECG':
-                lsl_worker = self.lsl_workers[lsl_stream.medusa_uid]
-                times, signal = lsl_worker.get_data()
-                channel_set = ecg.ECGChannelSet()
-                [channel_set.add_channel(label=l) for l in
-                 lsl_worker.receiver.l_cha]
-                biosignal = ecg.ECG(
-                    times=times,
-                    signal=signal,
-                    fs=lsl_worker.receiver.fs,
-                    channel_set=channel_set,
-                    lsl_stream_info=lsl_stream.to_serializable_obj())
-            elif lsl_stream.medusa_type == 'EMG':
-                lsl_worker = self.lsl_workers[lsl_stream.medusa_uid]
-                times, signal = lsl_worker.get_data()
-                channel_set = lsl_stream.cha_info
-                biosignal = emg.EMG(
-                    times=times,
-                    signal=signal,
-                    fs=lsl_worker.receiver.fs,
-                    channel_set=channel_set,
-                    lsl_stream_info=lsl_stream.to_serializable_obj())
-            elif lsl_stream.medusa_type == 'NIRS':
-                lsl_worker = self.lsl_workers[lsl_stream.medusa_uid]
-                times, signal = lsl_worker.get_data()
-                channel_set = lsl_stream.cha_info
-                biosignal = nirs.NIRS(
-                    times=times,
-                    signal=signal,
-                    fs=lsl_worker.receiver.fs,
-                    channel_set=channel_set,
-                    lsl_stream_info=lsl_stream.to_serializable_obj())
-            elif lsl_stream.medusa_type == 'CustomBiosignalData':
-                lsl_worker = self.lsl_workers[lsl_stream.medusa_uid]
-                times, signal = lsl_worker.get_data()
-                channel_set = lsl_stream.cha_info
-                fs = lsl_worker.receiver.fs
-                biosignal = components.CustomBiosignalData(
-                    times=times,
-                    signal=signal,
-                    fs=fs,
-                    channel_set=channel_set,
-                    lsl_stream_info=lsl_stream.to_serializable_obj())
-            else:
-                raise ValueError('Unknown biosignal type %s!' %
-                                 lsl_stream.medusa_type)
-            # Save stream
-            att_key = rec_streams_info[lsl_stream.medusa_uid]['att-name']
-            rec.add_biosignal(biosignal, att_key)
-        # Save recording
-        rec.save(file_path)
+        # Restore the onsets discarded by the retention policy
+        if (self.live_dataset.n_discarded > 0 or
+                self.live_dataset.n_excluded > 0) and \
+                self.rec_writer is not None:
+            self.live_dataset.restore(
+                [e for e in self.rec_writer.read_events()
+                 if e['event_type'] in ('train', 'test')])
+        self.align_onsets()
+        # Recording info
+        rec_info = dict(self.rec_info)
+        subject_id = rec_info.pop('subject_id')
+        recording_id = rec_info.pop('rec_id')
+        date = time.strftime("%d-%m-%Y %H:%M", time.localtime())
+        # Streams data (assembled concurrently, one task per stream)
+        enabled_streams = [
+            lsl_stream for lsl_stream in self.lsl_streams_info
+            if rec_streams_info[lsl_stream.medusa_uid]['enabled']]
+        # Chunked recordings copy the spooled streams chunk by chunk, so they
+        # are not assembled in memory (bson needs the whole arrays)
+        spooled = list()
+        if file_path.endswith('.' + CHUNKED_FORMAT) and \
+                self.rec_writer is not None:
+            spooled = [s.medusa_uid for s in enabled_streams
+                       if s.medusa_uid in self.rec_writer.streams]
+        biosignals = dict()
+        n_workers = max(1, min(len(enabled_streams), os.cpu_count() or 1))
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(self.build_biosignal, lsl_stream,
+                                       lsl_stream.medusa_uid not in spooled):
+                       lsl_stream for lsl_stream in enabled_streams}
+            for n, future in enumerate(as_completed(futures)):
+                lsl_stream = futures[future]
+                biosignals[lsl_stream.medusa_uid] = future.result()
+                self.medusa_interface.log(
+                    'Assembled stream %s (%i/%i)' %
+                    (lsl_stream.medusa_uid, n + 1, len(enabled_streams)))
+        # The raster events are keyed by tuples, which cannot be saved
+        cvep_data = copy.copy(self.cvep_data)
+        cvep_data.raster_events = raster_latencies.to_serializable(
+            self.cvep_data.raster_events)
+        if file_path.endswith('.' + CHUNKED_FORMAT):
+            # Chunked format: compressed chunks plus an index
+            chunked_recording.save(
+                file_path,
+                info=dict(subject_id=subject_id, recording_id=recording_id,
+                          date=date, **rec_info),
+                experiments={CVEP_DATA_KEY: cvep_data},
+                biosignals={
+                    rec_streams_info[lsl_stream.medusa_uid]['att-name']:
+                        biosignals[lsl_stream.medusa_uid]
+                    for lsl_stream in enabled_streams},
+                chunk_duration=CHUNK_DURATION,
+                blocks={rec_streams_info[uid]['att-name']:
+                        self.rec_writer.iter_chunks(uid) for uid in spooled})
+        else:
+            rec = components.Recording(
+                subject_id=subject_id,
+                recording_id=recording_id,
+                date=date,
+                **rec_info)
+            # Experiment data
+            rec.add_experiment_data(cvep_data)
+            for lsl_stream in enabled_streams:
+                # Save stream (in the original order)
+                att_key = rec_streams_info[lsl_stream.medusa_uid]['att-name']
+                rec.add_biosignal(biosignals[lsl_stream.medusa_uid], att_key)
+            # Save recording
+            rec.save(file_path)
+        if self.rec_writer is not None:
+            self.rec_writer.discard()
         # Print a message
         self.medusa_interface.log('Recording saved successfully')
 
+    def build_biosignal(self, lsl_stream, with_data=True):
+        """ Builds the biosignal of a recorded LSL stream. This method is
+        called concurrently for all the streams by `save_recording`. If
+        with_data is False, the biosignal has no samples (e.g., they are
+        copied from the spool afterward). """
+        lsl_worker = self.lsl_workers[lsl_stream.medusa_uid]
+        if with_data:
+            times, signal = self.get_stream_data(lsl_stream)
+        else:
+            times = np.zeros((0,))
+            signal = np.zeros((0, len(lsl_worker.receiver.l_cha)))
+        if lsl_stream.medusa_type == 'EEG':
+            channel_set = meeg.EEGChannelSet()
+            channel_set.set_standard_montage(
+                l_cha=lsl_worker.receiver.l_cha,
+                allow_unlocated_channels=True)
+            biosignal = meeg.EEG(
+                times=times,
+                signal=signal,
+                fs=lsl_worker.receiver.fs,
+                channel_set=channel_set,
+                lsl_stream_info=lsl_stream.to_serializable_obj())
+        elif lsl_stream.medusa_type == 'ECG':
+            from medusa import ecg
+            channel_set = ecg.ECGChannelSet()
+            [channel_set.add_channel(label=l) for l in
+             lsl_worker.receiver.l_cha]
+            biosignal = ecg.ECG(
+                times=times,
+                signal=signal,
+                fs=lsl_worker.receiver.fs,
+                channel_set=channel_set,
+                lsl_stream_info=lsl_stream.to_serializable_obj())
+        elif lsl_stream.medusa_type == 'EMG':
+            from medusa import emg
+            channel_set = lsl_stream.cha_info
+            biosignal = emg.EMG(
+                times=times,
+                signal=signal,
+                fs=lsl_worker.receiver.fs,
+                channel_set=channel_set,
+                lsl_stream_info=lsl_stream.to_serializable_obj())
+        elif lsl_stream.medusa_type == 'NIRS':
+            from medusa import nirs
+            channel_set = lsl_stream.cha_info
+            biosignal = nirs.NIRS(
+                times=times,
+                signal=signal,
+                fs=lsl_worker.receiver.fs,
+                channel_set=channel_set,
+                lsl_stream_info=lsl_stream.to_serializable_obj())
+        elif lsl_stream.medusa_type == 'CustomBiosignalData':
+            channel_set = lsl_stream.cha_info
+            fs = lsl_worker.receiver.fs
+            biosignal = components.CustomBiosignalData(
+                times=times,
+                signal=signal,
+                fs=fs,
+                channel_set=channel_set,
+                lsl_stream_info=lsl_stream.to_serializable_obj())
+        else:
+            raise ValueError('Unknown biosignal type %s!' %
+                             lsl_stream.medusa_type)
+        return biosignal
+
     @exceptions.error_handler(scope='app')
-    def get_eeg_data(self):
+    def get_eeg_data(self, t0=None):
+        """ Returns the EEG data recorded since timestamp t0. times and signal
+        are read-only views (no copies): of the shared-memory ring buffer if
+        it still holds t0, or of the buffers of the LSL worker otherwise.
+
+        If t0 is None, the whole run is returned, or only the retained data
+        if the retention policy is active (a copy of the ring buffer, as the
+        ring keeps being written while it is used).
+        """
         # EEG data
         lsl_worker = self.get_lsl_worker()
-        channels = meeg.EEGChannelSet()
-        channels.set_standard_montage(lsl_worker.receiver.l_cha)
-        times_, signal_ = lsl_worker.get_data()
-        if times_.shape[0] != signal_.shape[0]:
-            min_len = min(times_.shape[0], signal_.shape[0])
-            print('[get_current_recording] Warning! timestamps (%i) and '
-                  'signal (%i) did not have the same dimensions, trimmed '
-                  'both to have %i samples.' % (times_.shape[0],
-                                                signal_.shape[0],
-                                                min_len)
-                  )
-            times_ = times_[:min_len]
-            signal_ = signal_[:min_len, :]
+        channels = self.get_eeg_channel_set()
+        if self.eeg_ring is not None:
+            if t0 is None and self.get_retention_horizon() is not None:
+                self.ingest_eeg_samples()
+                with self.eeg_ring_lock:
+                    times_, signal_ = self.eeg_ring.latest()
+                    times_, signal_ = np.array(times_), np.array(signal_)
+                return times_, signal_, lsl_worker.receiver.fs, channels, \
+                    lsl_worker.receiver.name
+            if t0 is not None:
+                self.ingest_eeg_samples()
+                if self.eeg_ring.covers(t0):
+                    times_, signal_ = self.eeg_ring.since(t0)
+                    return times_, signal_, lsl_worker.receiver.fs, \
+                        channels, lsl_worker.receiver.name
+        times_, signal_ = self.get_worker_samples(self.eeg_worker_name)
+        if t0 is not None:
+            k0 = int(np.searchsorted(times_, t0))
+            times_, signal_ = times_[k0:], signal_[k0:]
+        times_, signal_ = times_.view(), signal_.view()
+        times_.flags.writeable = False
+        signal_.flags.writeable = False
         return times_, signal_, lsl_worker.receiver.fs, channels, \
                lsl_worker.receiver.name
 
@@ -552,6 +720,8 @@ class App(resources.AppSkeleton):
 
     @exceptions.error_handler(scope='app')
     def get_current_dataset(self):
+        """ Returns a new dataset with a copy of the current data. Use
+        `live_dataset.snapshot()` to avoid rebuilding it in each call. """
         try:
             rec = self.get_current_recording()
             dataset = cvep.CVEPSpellerDataset(
@@ -564,48 +734,722 @@ class App(resources.AppSkeleton):
             return None
         return dataset
 
+    # ---------------------------- EEG RING BUFFER ----------------------------
+    def start_eeg_ring_buffer(self):
+        """ Creates the shared-memory ring buffer of the EEG stream. Its
+        description (see SharedRingBuffer.get_description) allows other
+        processes to attach to it. The samples are kept in float64, as they
+        are also spooled and saved, and are cast to the data type of the
+        model in prepare_model_input. """
+        lsl_worker = self.get_lsl_worker()
+        retention = self.get_retention_horizon()
+        length = EEG_RING_BUFFER_LENGTH if retention is None else retention
+        capacity = int(length * lsl_worker.receiver.fs)
+        self.eeg_ring = SharedRingBuffer(len(lsl_worker.receiver.l_cha),
+                                         capacity)
+
+    def ingest_eeg_samples(self):
+        """ Writes the EEG samples received since the last call into the
+        ring buffer (only the new samples are read from the LSL worker). It
+        is called on demand by the readers. """
+        with self.eeg_ring_lock:
+            times, signal = self.get_worker_samples(
+                self.eeg_worker_name, self.eeg_ring.last_timestamp())
+            self.eeg_ring.write(times, signal)
+
+    def stop_eeg_ring_buffer(self):
+        """ Releases the shared memory of the ring buffer. """
+        if self.eeg_ring is None:
+            return
+        with self.eeg_ring_lock:
+            self.eeg_ring.close()
+            self.eeg_ring.unlink()
+            self.eeg_ring = None
+
+    # ---------------------------- RECORDING WRITER ----------------------------
+    def start_recording_writer(self):
+        """ Creates the spool of this run and starts the thread that writes
+        the recorded data to disk periodically. """
+        if self.rec_writer is None:
+            spool_dir = os.path.join(self.get_spool_root(),
+                                     time.strftime('%Y%m%d-%H%M%S'))
+            self.rec_writer = RecordingWriter(
+                spool_dir, info={'settings':
+                                 self.app_settings.to_serializable_obj()})
+        for lsl_stream in self.lsl_streams_info:
+            lsl_worker = self.lsl_workers[lsl_stream.medusa_uid]
+            self.rec_writer.add_stream(lsl_stream.medusa_uid,
+                                       lsl_stream.medusa_type,
+                                       lsl_worker.receiver.fs,
+                                       lsl_worker.receiver.l_cha)
+        self.recording_thread = threading.Thread(
+            target=self.recording_thread_worker, daemon=True)
+        self.recording_thread.start()
+
+    def recording_thread_worker(self):
+        """ Flushes the new samples and events to the spool every
+        REC_FLUSH_INTERVAL seconds until the writer is stopped. """
+        while not self.recording_stop_event.wait(REC_FLUSH_INTERVAL):
+            try:
+                self.spool_new_data()
+                self.apply_retention_policy()
+            except Exception as ex:
+                print(self.TAG, 'Cannot write to the spool: %s' % str(ex))
+
+    def get_retention_horizon(self):
+        """ Returns the seconds of data kept in memory during the run, or
+        None if everything must be kept (train mode or retention disabled).
+        """
+        retention = self.app_settings.run_settings.online_retention
+        if self.app_settings.run_settings.mode != ONLINE_MODE or \
+                retention <= 0:
+            return None
+        return max(retention, MIN_ONLINE_RETENTION)
+
+    def apply_retention_policy(self):
+        """ Discards the onsets older than the retention horizon. They have
+        already been written to the spool, which also keeps the EEG that
+        falls out of the ring buffer (see get_eeg_data and save_recording).
+        """
+        retention = self.get_retention_horizon()
+        if retention is None or self.eeg_ring is None:
+            return
+        last_timestamp = self.eeg_ring.last_timestamp()
+        if last_timestamp is None:
+            return
+        self.live_dataset.discard_before(last_timestamp - retention)
+
+    def spool_new_data(self):
+        """ Appends the samples recorded since the last flush to the spool
+        (with the precision of the LSL stream). """
+        for lsl_stream in self.lsl_streams_info:
+            uid = lsl_stream.medusa_uid
+            times, signal = self.get_worker_samples(
+                uid, self.rec_writer.last_timestamp(uid))
+            self.rec_writer.append_samples(uid, np.array(times),
+                                           np.array(signal))
+        self.rec_writer.flush()
+
+    def stop_recording_writer(self):
+        """ Stops the writing thread and finalizes the spool. """
+        if self.rec_writer is None:
+            return
+        self.recording_stop_event.set()
+        if self.recording_thread is not None:
+            self.recording_thread.join()
+        self.spool_new_data()
+        self.rec_writer.finalize()
+
+    @staticmethod
+    def get_spool_root():
+        return os.path.join(os.getcwd(), '..', 'data', SPOOL_FOLDER)
+
+    def get_stream_data(self, lsl_stream):
+        """ Returns the times and signal of a stream, read from the spool of
+        the recording writer if available. """
+        if self.rec_writer is not None and \
+                lsl_stream.medusa_uid in self.rec_writer.streams:
+            return self.rec_writer.read_stream(lsl_stream.medusa_uid)
+        return self.lsl_workers[lsl_stream.medusa_uid].get_data()
+
+    # ---------------------------- PHOTODIODE ----------------------------
+    def get_non_eeg_channels(self):
+        """ Returns the labels of the channels that are not EEG (the
+        photodiode, if it is recorded in the EEG stream). They are saved
+        without coordinates and never used as input of the models. """
+        channel = self.app_settings.run_settings.photodiode_channel
+        return [channel] if channel else []
+
+    def get_eeg_channel_set(self):
+        """ Returns the channel set of the EEG stream. The channels that are
+        not EEG are kept (unlocated), so it matches the columns of the
+        signal. """
+        channels = meeg.EEGChannelSet()
+        channels.set_standard_montage(self.get_lsl_worker().receiver.l_cha,
+                                      allow_unlocated_channels=True)
+        return channels
+
+    def get_photodiode_signal(self, t0=None):
+        """ Returns the times and samples of the photodiode channel since t0
+        (the whole run if None), or None if the onset alignment is disabled
+        or the channel is not found. """
+        channel = self.app_settings.run_settings.photodiode_channel
+        if not channel:
+            return None
+        uid = self.app_settings.run_settings.photodiode_stream or \
+            self.eeg_worker_name
+        lsl_stream = next((s for s in self.lsl_streams_info
+                           if s.medusa_uid == uid), None)
+        if lsl_stream is None:
+            return None
+        l_cha = list(self.lsl_workers[uid].receiver.l_cha)
+        if channel not in l_cha:
+            return None
+        if t0 is None:
+            times, signal = self.get_stream_data(lsl_stream)
+        elif uid == self.eeg_worker_name and self.eeg_ring is not None:
+            times, signal = self.get_eeg_data(t0)[:2]
+        else:
+            times, signal = self.get_worker_samples(uid)
+            k0 = int(np.searchsorted(times, t0))
+            times, signal = times[k0:], signal[k0:]
+        n = min(times.shape[0], signal.shape[0])
+        return times[:n], signal[:n, l_cha.index(channel)]
+
+    def align_onsets(self, trial_idx=None, t0=None):
+        """ Aligns the onsets of a trial (all the trials if None) to the
+        pulses of the photodiode (see photodiode.py). The onsets are
+        modified in place. """
+        photodiode_data = self.get_photodiode_signal(t0)
+        if photodiode_data is None:
+            return
+        pulses = photodiode.detect_pulses(*photodiode_data)
+        fps = self.app_settings.run_settings.fps_resolution
+        with self.live_dataset.lock:
+            onsets = self.cvep_data.onsets
+            trials = self.cvep_data.trial_idx
+            mask = np.ones(onsets.shape, dtype=bool) if trial_idx is None \
+                else trials == trial_idx
+            aligned, n_aligned = photodiode.align_onsets(
+                onsets[mask], pulses, max_lag=PHOTODIODE_MAX_LAG,
+                tolerance=PHOTODIODE_TOLERANCE / fps, groups=trials[mask])
+            onsets[mask] = aligned
+        if n_aligned < np.sum(mask):
+            print(self.TAG, 'Photodiode: %i of %i onsets aligned' %
+                  (n_aligned, np.sum(mask)))
+
+    # ---------------------------- CHECKPOINTS ----------------------------
+    def check_resumable_run(self):
+        """ Looks for the spool of an interrupted run with the same settings
+        and, if the user accepts, restores its state so the run continues
+        from the last completed trial. """
+        spool_dir = self.find_resumable_spool()
+        if spool_dir is None:
+            return
+        writer = RecordingWriter.open(spool_dir)
+        events = writer.read_events()
+        completed, kept_events = self.get_completed_trials(events)
+        if len(completed) == 0:
+            writer.discard()
+            return
+        qt_app = QApplication.instance() or QApplication([])
+        answer = QMessageBox.question(
+            None, 'Resume run',
+            'An interrupted run with the same settings has been found (%i '
+            'completed trials). Do you want to resume it? Otherwise, it will '
+            'be discarded.' % len(completed))
+        if answer != QMessageBox.Yes:
+            writer.discard()
+            return
+        # Restore the state and keep writing to the same spool
+        writer.rewrite_events(kept_events)
+        self.rec_writer = writer
+        self.live_dataset.restore(
+            [e for e in kept_events if e['event_type'] in ('train', 'test')])
+        selections = [e for e in kept_events
+                      if e['event_type'] == 'selection']
+        self.cvep_data.spell_result = [e['label'] for e in selections]
+        for e in selections:
+            self.spelled_text = word_completion.apply_selection(
+                self.spelled_text, e['label'], e.get('word', False))
+        for e in kept_events:
+            if e['event_type'] == 'frames':
+                frame_stats.append_frame_stats(self.cvep_data.frame_stats, e)
+        self.resume_info = {
+            'trial': max(completed) + 1,
+            'selections': [e['coords'] for e in selections]
+        }
+        self.send_to_log('Resuming the run from trial %i' %
+                         self.resume_info['trial'])
+
+    def find_resumable_spool(self):
+        """ Returns the newest spool that has not been finalized and was
+        recorded with the current settings, or None. """
+        settings = json.dumps(self.app_settings.to_serializable_obj(),
+                              sort_keys=True)
+        for spool_dir in sorted(glob.glob(
+                os.path.join(self.get_spool_root(), '*')), reverse=True):
+            try:
+                index = RecordingWriter.read_index(spool_dir)
+            except (OSError, ValueError):
+                continue
+            if not index['finalized'] and json.dumps(
+                    index['info'].get('settings'), sort_keys=True) == settings:
+                return spool_dir
+        return None
+
+    def get_completed_trials(self, events):
+        """ Returns the indexes of the completed trials (all the cycles in
+        train mode, a selection in online mode) and the events without the
+        onsets of incomplete trials. """
+        onsets = [e for e in events if e['event_type'] in ('train', 'test')]
+        if self.app_settings.run_settings.mode == ONLINE_MODE:
+            completed = {e['trial'] for e in events
+                         if e['event_type'] == 'selection'}
+        else:
+            n_cycles = dict()
+            for e in onsets:
+                n_cycles[e['trial']] = n_cycles.get(e['trial'], 0) + 1
+            completed = {t for t, n in n_cycles.items()
+                         if n >= self.app_settings.run_settings.train_cycles}
+        kept_events = [e for e in events
+                       if e['event_type'] not in ('train', 'test', 'frames')
+                       or e['trial'] in completed]
+        return completed, kept_events
+
+    def journal_selection(self, coords, label, trial_idx):
+        """ Stores a selection in the experiment data and in the spool, so
+        the spelled text can be restored if the run is resumed. """
+        is_word = self.get_suggestion_position(coords) is not None
+        self.cvep_data.spell_result.append(label)
+        self.spelled_text = word_completion.apply_selection(
+            self.spelled_text, label, is_word)
+        if self.rec_writer is not None:
+            self.rec_writer.append_event({
+                'event_type': 'selection',
+                'trial': int(trial_idx),
+                'coords': [int(c) for c in coords],
+                'label': label,
+                'word': is_word})
+
     # ---------------------------- PROCESSING ----------------------------
     def append_trial_info(self, msg):
-        # Common trial info
-        self.cvep_data.cycle_idx = np.append(
-            self.cvep_data.cycle_idx, msg["cycle"])
-        self.cvep_data.onsets = np.append(
-            self.cvep_data.onsets, msg["onset"])
-        self.cvep_data.trial_idx = np.append(
-            self.cvep_data.trial_idx, msg["trial"])
-        self.cvep_data.matrix_idx = np.append(
-            self.cvep_data.matrix_idx, msg["matrix_idx"])
-        self.cvep_data.level_idx = np.append(
-            self.cvep_data.level_idx, msg["level_idx"])
-        self.cvep_data.unit_idx = np.append(
-            self.cvep_data.unit_idx, msg["unit_idx"])
-
-        # Information only present in Train mode
-        if "command_idx" in msg:
-            self.cvep_data.command_idx = np.append(
-                self.cvep_data.command_idx, msg["command_idx"])
-
-    def process_trial(self):
-        """ This function processes only the last trial to get the selected
-        command. Note that this method is not called in TRAIN_MODE.
+        if self.resume_info is not None:
+            # Unity builds without resume support start again at trial 0
+            if self.resume_trial_offset is None:
+                self.resume_trial_offset = max(
+                    0, self.resume_info['trial'] - msg['trial'])
+            msg['trial'] += self.resume_trial_offset
+        # Trial info (command_idx is only present in Train mode)
+        self.live_dataset.append_trial_info(msg)
+
+        # Spool the onset
+        if self.rec_writer is not None:
+            self.rec_writer.append_event(msg)
+
+    def append_trial_batch(self, msg):
+        """ Appends the onsets of a batch message (see protocol.py) with a
+        single vectorized append per field. """
+        if self.resume_info is not None:
+            trial = np.asarray(msg['trial'], dtype=int)
+            if self.resume_trial_offset is None:
+                self.resume_trial_offset = max(
+                    0, self.resume_info['trial'] - int(trial[0]))
+            msg['trial'] = trial + self.resume_trial_offset
+        self.live_dataset.append_trial_batch(
+            {att: msg[key] for att, key in LiveCVEPDataset.FIELDS.items()
+             if key in msg})
+
+        # Spool the onsets with the same format as the single ones
+        if self.rec_writer is not None:
+            self.rec_writer.append_events(protocol.split_onset_batch(msg))
+
+    def set_raster_latencies(self, msg):
+        """ Stores the raster latencies sent by Unity in the experiment
+        data, so the model can shift the template of each command (see
+        correct_raster_latencies in CVEPModelCircularShifting). They apply
+        to the trials after the last received onset (see
+        raster_latencies.py). """
+        m_idx = int(msg['matrix_idx'])
+        commands_info = self.cvep_data.commands_info[m_idx]
+        if len(commands_info) != len(msg['raster_latencies']):
+            print(self.TAG, 'Raster latencies do not match the commands of '
+                            'matrix %i' % m_idx)
+            return
+        with self.live_dataset.lock:
+            onsets = self.cvep_data.onsets
+            onset = float(onsets[-1]) if len(onsets) > 0 else 0.0
+            raster_latencies.add_raster_event(
+                self.cvep_data.raster_events, onset, commands_info,
+                msg['raster_latencies'])
+        print(self.TAG, 'Raster latencies of matrix %i: %.2f-%.2f ms' % (
+            m_idx, 1e3 * min(msg['raster_latencies']),
+            1e3 * max(msg['raster_latencies'])))
+
+    def record_frame_stats(self, msg):
+        """ Stores the frame-timing statistics of the cycles of a trial and,
+        if enabled in online mode, excludes the cycles with dropped frames
+        from decoding. """
+        if self.resume_trial_offset is not None:
+            msg['trial'] += self.resume_trial_offset
+        stats = self.cvep_data.frame_stats
+        frame_stats.append_frame_stats(stats, msg)
+        if self.rec_writer is not None:
+            self.rec_writer.append_event(msg)
+        n_missed = int(np.sum(msg['missed_frames']))
+        if n_missed > 0:
+            seq_len = len(list(
+                self.cvep_data.commands_info[0].values())[0]['sequence'])
+            self.send_to_log(
+                'Trial %i: %i dropped frames (%.2f%% of the run)' % (
+                    msg['trial'], n_missed, 100 *
+                    frame_stats.get_dropped_frame_rate(stats, seq_len)))
+        if self.app_settings.run_settings.exclude_bad_cycles and \
+                self.app_settings.run_settings.mode == ONLINE_MODE:
+            with self.live_dataset.lock:
+                mask = frame_stats.get_bad_onsets_mask(self.cvep_data,
+                                                       MAX_MISSED_FRAMES)
+                trial = self.cvep_data.trial_idx == msg['trial']
+                mask &= trial
+                # At least one cycle is needed to decode the trial
+                if np.any(mask) and np.any(trial & ~mask):
+                    self.live_dataset.exclude(mask)
+                    print(self.TAG, 'Excluded %i cycles with dropped frames'
+                          % np.sum(mask))
+
+    def get_dropped_frame_rate(self):
+        """ Returns the fraction of stimulation frames that were not
+        displayed during the run. """
+        seq_len = len(list(
+            self.cvep_data.commands_info[0].values())[0]['sequence'])
+        return frame_stats.get_dropped_frame_rate(self.cvep_data.frame_stats,
+                                                  seq_len)
+
+    def get_selection(self, decoding, trial_idx=None):
+        """ Returns the coordinates [matrix, row, col] and the label of the
+        selected command. If the language model is enabled, the scores of all
+        the commands are combined with its prior (see apply_language_model).
+        A suggestion cell enters the word it showed during the trial.
+        """
+        # todo: matrix, level, unit etc
+        # Aclaration:
+        # 1) [-1] to access the last cycle (max no. cycles)
+        # 2) [-1] to access the last and unique training seq
+        # 3) ['sorted_cmds'] to access the commands sorted by
+        # their probability of being selected
+        # 4) [0] to get the most probable command
+        # 5) ['coords'][0] to get the matrix index
+        #    ['item']['row'] to get the row inside the matrix
+        #    ['item']['col'] to get the col inside the matrix
+        sorted_cmds = decoding['items_by_no_cycle'][-1][-1]['sorted_cmds']
+        selected = sorted_cmds[0]
+        label = decoding['spell_result'][0]
+        if self.language_model is not None and len(sorted_cmds) > 1:
+            idx = self.apply_language_model(sorted_cmds)
+            if idx != 0:
+                selected = sorted_cmds[idx]
+                label = selected['item']['label'] or selected['item']['text']
+        coords = [selected['coords'][0], selected['item']['row'],
+                  selected['item']['col']]
+        # Suggestion cells enter the word they were showing (in pipelined mode,
+        # the suggestions may have changed since the trial was queued)
+        suggestions = self.trial_suggestions.pop(trial_idx, self.suggestions)
+        pos = self.get_suggestion_position(coords)
+        if pos is not None:
+            label = suggestions[pos] if pos < len(suggestions) else ''
+        return coords, label
+
+    def apply_language_model(self, sorted_cmds):
+        """ Returns the index (in sorted_cmds) of the command with the
+        highest posterior probability given the text spelled so far.
+
+        The score of each command is its correlation with its template (or
+        the fused score of the ensemble). If the decoder does not provide it,
+        the language model is disabled. Commands that are not single
+        characters and the suggestion cells (their static text is not the
+        word they enter) get the mean prior of the characters, so the
+        language model does not favour or penalize them. """
+        context = self.spelled_text
+        scores = np.array([np.nan if cmd.get('correlation') is None else
+                           cmd['correlation'] for cmd in sorted_cmds],
+                          dtype=float)
+        if np.any(np.isnan(scores)):
+            scores = np.array([cmd.get('score', np.nan) for cmd in sorted_cmds],
+                              dtype=float)
+        if np.any(np.isnan(scores)):
+            self.language_model = None
+            self.send_to_log('The decoder does not provide the correlation of '
+                             'the commands, the language model is disabled')
+            return 0
+        priors = np.full(len(sorted_cmds), np.nan)
+        for i, cmd in enumerate(sorted_cmds):
+            text = cmd['item']['text']
+            coords = [cmd['coords'][0], cmd['item']['row'],
+                      cmd['item']['col']]
+            if len(text) == 1 and self.get_suggestion_position(coords) is None:
+                priors[i] = self.language_model.probability(text, context)
+        if np.all(np.isnan(priors)):
+            return 0
+        priors[np.isnan(priors)] = np.nanmean(priors)
+        posterior = fuse_scores(scores, priors,
+                                weight=self.app_settings.run_settings.lm_weight,
+                                temperature=LM_TEMPERATURE)
+        return int(np.argmax(posterior))
+
+    def load_language_model(self):
+        """ Builds the language model from the corpus set in the settings
+        (only once, before the first selection). """
+        path = self.app_settings.run_settings.lm_corpus_path
+        if self.app_settings.run_settings.mode != ONLINE_MODE or not path:
+            return
+        try:
+            t0 = time.perf_counter()
+            self.language_model = CharNGramModel.load(path, order=LM_ORDER)
+            self.send_to_log('Language model ready (%.0f ms)' %
+                             ((time.perf_counter() - t0) * 1000))
+        except Exception as ex:
+            print(self.TAG, 'Cannot load the language model: %s' % str(ex))
+
+    def load_vocabulary(self):
+        """ Builds the vocabulary of the word suggestions from the file set
+        in the settings. """
+        run_settings = self.app_settings.run_settings
+        if run_settings.mode != ONLINE_MODE or not run_settings.vocabulary_path:
+            return
+        try:
+            t0 = time.perf_counter()
+            self.vocabulary = word_completion.VocabularyTrie.load(
+                run_settings.vocabulary_path,
+                max_suggestions=max(len(run_settings.suggestion_cells), 1))
+            self.send_to_log('Vocabulary ready: %i words (%.0f ms)' % (
+                self.vocabulary.n_words, (time.perf_counter() - t0) * 1000))
+        except Exception as ex:
+            print(self.TAG, 'Cannot load the vocabulary: %s' % str(ex))
+
+    def get_suggestion_position(self, coords):
+        """ Returns the position (in suggestion_cells) of the cell with
+        coordinates [matrix, row, col], or None if it is not a suggestion
+        cell. """
+        if self.vocabulary is None or coords[0] != 0:
+            return None
+        n_col = self.app_settings.matrices['test'][0].n_col
+        idx = int(coords[1]) * n_col + int(coords[2])
+        cells = self.app_settings.run_settings.suggestion_cells
+        return cells.index(idx) if idx in cells else None
+
+    def update_suggestions(self):
+        """ Completes the word that is being spelled and shows the most
+        frequent completions in the suggestion cells (a relabel message, so
+        the parameters are not sent again). Cells without a suggestion are
+        left empty. """
+        if self.vocabulary is None:
+            return
+        cells = self.app_settings.run_settings.suggestion_cells
+        prefix = word_completion.get_prefix(self.spelled_text)
+        self.suggestions = self.vocabulary.complete(prefix, len(cells))
+        texts = self.suggestions + [''] * (len(cells) - len(self.suggestions))
+        self.app_controller.relabel(matrix_idx=0, cells=cells, texts=texts)
+
+    def enqueue_trial(self, trial):
+        """ Queues a trial to be decoded. Unity sends the index of the
+        trial with processPlease (older builds do not, and the last trial is
+        queued). In pipelined mode, the onsets of the next trial may arrive
+        before the selection, so the trial cannot be inferred later. The
+        word suggestions shown during the trial are kept for the same reason
+        (see get_selection). """
+        if trial is None:
+            trial_idx = int(self.cvep_data.trial_idx[-1])
+        else:
+            trial_idx = int(trial) + (self.resume_trial_offset or 0)
+        self.trial_suggestions[trial_idx] = list(self.suggestions)
+        self.pending_trials.append(trial_idx)
+
+    def is_trial_feasible(self, trial_idx):
+        """ Checks that the EEG covers the full epoch of the last cycle of
+        the trial. For the last trial, the check of the model is used. Only
+        the window of the trial is checked, so the cost does not grow with
+        the length of the run. """
+        with self.live_dataset.lock:
+            onsets = self.cvep_data.onsets[
+                self.cvep_data.trial_idx == trial_idx]
+            if trial_idx == self.cvep_data.trial_idx[-1]:
+                times_, _, fs = self.get_eeg_data(np.min(onsets))[:3]
+                return self.cvep_model.check_predict_feasibility_signal(
+                    times_, onsets, fs)
+            # Pipelined mode: the next trial has already started
+            seq_len = len(list(
+                self.cvep_data.commands_info[0].values())[0]['sequence'])
+            cycle_dur = seq_len / float(
+                self.app_settings.run_settings.fps_resolution)
+            last_onset = np.max(onsets)
+            times_ = self.get_eeg_data(last_onset)[0]
+        return times_.shape[0] > 0 and times_[-1] >= last_onset + cycle_dur
+
+    def process_trial(self, trial_idx=None):
+        """ This function processes only one trial (the last one if
+        trial_idx is None) to get the selected command. Note that this method
+        is not called in TRAIN_MODE.
         """
         if self.cvep_model is None:
             self.handle_exception(Exception('[cvep_speller] Cannot process the '
                                             'trial if the model has not been'
                                             ' trained before!'))
 
-        # Get current data
-        last_idx = self.cvep_data.trial_idx[-1]
-        times_, signal_, fs, channels, equip = self.get_eeg_data()
-        eeg = meeg.EEG(times_, signal_, fs, channels, equipement=equip)
+        # The retention policy cannot discard onsets while decoding
+        with self.live_dataset.lock:
+            # Get current data (only the window of the trial)
+            last_idx = self.cvep_data.trial_idx[-1] if trial_idx is None \
+                else trial_idx
+            t0 = np.min(self.cvep_data.onsets[
+                            self.cvep_data.trial_idx == last_idx]) - \
+                TRIAL_WINDOW_PAD
+            self.align_onsets(last_idx, t0)
+            times_, signal_, fs, channels, equip = self.get_eeg_data(t0)
 
-        # Process the last trial
-        decoding = self.cvep_model.predict(times=times_, signal=signal_,
-                                           trial_idx=last_idx,
-                                           exp_data=self.cvep_data,
-                                           sig_data=eeg)
+            # The additional models decode the same window in parallel
+            futures = None
+            if self.ensemble is not None:
+                futures = self.ensemble.submit(
+                    self.get_ensemble_window(times_, signal_), fs,
+                    self.get_lsl_worker().receiver.l_cha,
+                    self.live_dataset.copy_trial(last_idx), last_idx,
+                    self.get_non_eeg_channels())
+
+            # get_eeg_data returns read-only views of the buffers, but the
+            # model may process the signal in place (O(trial) copy)
+            times_, signal_ = np.array(times_), np.array(signal_)
+
+            # Only the channels used by the model are processed, with its
+            # data type and at its rate
+            times_, signal_, fs, channels = self.prepare_model_input(
+                times_, signal_, fs, channels)
+            eeg = meeg.EEG(times_, signal_, fs, channels, equipement=equip)
+
+            # Process the last trial
+            decoding = self.cvep_model.predict(times=times_, signal=signal_,
+                                               trial_idx=last_idx,
+                                               exp_data=self.cvep_data,
+                                               sig_data=eeg)
+            if futures is not None:
+                decoding = self.ensemble.fuse(decoding, futures)
         return decoding
 
+    def get_ensemble_window(self, times, signal):
+        """ Returns the EEG window sent to the ensemble workers: the limits
+        of the window in the shared ring buffer, or the data itself if the
+        ring buffer is not available or no longer holds the window. """
+        if self.eeg_ring is None or times.shape[0] == 0 or \
+                not self.eeg_ring.covers(float(times[0])):
+            return {'times': np.array(times), 'signal': np.array(signal)}
+        return {'ring': self.eeg_ring.get_description(),
+                't0': float(times[0]), 't1': float(times[-1])}
+
+    def prepare_model_input(self, times, signal, fs, channels):
+        """ Applies the preprocessing stored in the model when it was
+        trained (see model_input.prepare_model_input).
+
+        Returns
+        -------
+        times, signal, fs, channels
+        """
+        l_cha = list(self.get_lsl_worker().receiver.l_cha)
+        times, signal, fs, l_cha_ = model_input.prepare_model_input(
+            self.cvep_model, times, signal, fs, l_cha,
+            self.get_non_eeg_channels())
+        if l_cha_ != l_cha:
+            channels = meeg.EEGChannelSet()
+            channels.set_standard_montage(l_cha_)
+        return times, signal, fs, channels
+
+    def start_ensemble(self):
+        """ Starts the worker processes of the additional models set in the
+        settings (one per model, loaded in parallel). """
+        run_settings = self.app_settings.run_settings
+        if run_settings.mode != ONLINE_MODE or self.cvep_model is None or \
+                len(run_settings.ensemble_model_paths) == 0:
+            return
+        try:
+            self.ensemble = ModelEnsemble(run_settings.ensemble_model_paths,
+                                          run_settings.ensemble_rule)
+        except Exception as ex:
+            print(self.TAG, 'Cannot start the model ensemble: %s' % str(ex))
+
+    def stop_ensemble(self):
+        if self.ensemble is None:
+            return
+        self.ensemble.shutdown()
+        self.ensemble = None
+
+    def get_warm_up_raster_events(self, commands_info):
+        """ Returns the raster events of the synthetic trial of the warm-up:
+        the last latencies received from Unity (zero for the commands
+        without them), before its first onset. """
+        raster_events = raster_latencies.new_raster_events()
+        for m_commands_info in commands_info:
+            raster_latencies.add_raster_event(
+                raster_events, 0.0, m_commands_info,
+                np.zeros(len(m_commands_info)))
+        with self.live_dataset.lock:
+            received = self.cvep_data.raster_events
+            if raster_latencies.has_raster_events(received):
+                raster_events['event'][-1].update(received['event'][-1])
+        return raster_events
+
+    def prepare_decoding(self):
+        """ Loads the language model, the vocabulary of the word suggestions
+        and the models of the ensemble, and warms up the model. It runs in a
+        thread while Unity is launching, and the trials wait for model_ready.
+        """
+        try:
+            self.load_language_model()
+            self.load_vocabulary()
+            self.start_ensemble()
+            self.warm_up_model()
+        except Exception as ex:
+            self.medusa_interface.error(ex)
+        finally:
+            self.model_ready.set()
+
+    def warm_up_model(self):
+        """ Runs a prediction on synthetic data with the fs and channels of
+        the EEG stream, so the lazy allocations, filter designs and templates
+        of the model are done before the first selection. Errors are raised,
+        and the configuration of the model is not modified. """
+        if self.cvep_model is None:
+            return
+        t0 = time.perf_counter()
+        lsl_worker = self.get_lsl_worker()
+        fs = lsl_worker.receiver.fs
+        fps = self.app_settings.run_settings.fps_resolution
+        n_cycles = self.app_settings.run_settings.test_cycles
+        channels = self.get_eeg_channel_set()
+        # Synthetic trial
+        conf, comms = self.get_conf(ONLINE_MODE)
+        seq_len = len(list(comms[0].values())[0]['sequence'])
+        cycle_dur = seq_len / float(fps)
+        onsets = TRIAL_WINDOW_PAD + np.arange(n_cycles) * cycle_dur
+        exp_data = cvep.CVEPSpellerData(
+            mode='test',
+            paradigm_conf=conf,
+            commands_info=comms,
+            onsets=onsets,
+            command_idx=np.zeros((0,)),
+            unit_idx=np.zeros((n_cycles,)),
+            level_idx=np.zeros((n_cycles,)),
+            matrix_idx=np.zeros((n_cycles,)),
+            cycle_idx=np.arange(n_cycles, dtype=float),
+            trial_idx=np.zeros((n_cycles,)),
+            cvep_model=None,
+            spell_result=[],
+            fps_resolution=fps,
+            spell_target=[]
+        )
+        exp_data.raster_events = self.get_warm_up_raster_events(comms)
+        n_samples = int((onsets[-1] + cycle_dur + TRIAL_WINDOW_PAD) * fs)
+        times = np.arange(n_samples) / fs
+        signal = np.random.randn(n_samples, len(lsl_worker.receiver.l_cha))
+        futures = None
+        if self.ensemble is not None:
+            futures = self.ensemble.submit(
+                {'times': times, 'signal': signal}, fs,
+                lsl_worker.receiver.l_cha, exp_data, 0,
+                self.get_non_eeg_channels())
+        times, signal, fs, channels = self.prepare_model_input(
+            times, signal, fs, channels)
+        eeg = meeg.EEG(times, signal, fs, channels)
+        self.cvep_model.predict(times=times, signal=signal, trial_idx=0,
+                                exp_data=exp_data, sig_data=eeg)
+        if futures is not None:
+            try:
+                for future in futures:
+                    future.result()
+            except Exception as ex:
+                self.send_to_log('Cannot warm up the model ensemble, it is '
+                                 'disabled: %s' % str(ex))
+                self.stop_ensemble()
+        self.send_to_log('Model ready (warm-up: %.0f ms)' %
+                         ((time.perf_counter() - t0) * 1000))
+
     def get_conf(self, mode):
         # TODO: nested matrices (units) are not implemented yet
         cvep_conf = []
@@ -0,0 +1,94 @@
+import numpy as np
+
+from .app_constants import CVEP_DATA_KEY
+from .channel_selection import get_channel_indexes
+from . import decimation
+
+# Data types of the signal supported by the models
+SIGNAL_DTYPES = ('float64', 'float32')
+
+
+def get_signal_dtype(model):
+    """ Returns the data type the model was trained with (float64 for the
+    models trained before the option existed). """
+    return np.dtype(getattr(model, 'signal_dtype', None) or 'float64')
+
+
+def exclude_channels(signal, l_cha, exclude):
+    """ Removes the channels whose label is in `exclude` (e.g., the
+    photodiode, which is recorded in the EEG stream but is not EEG).
+
+    Returns
+    -------
+    signal, l_cha
+    """
+    l_cha = list(l_cha)
+    if not any(label in exclude for label in l_cha):
+        return signal, l_cha
+    idx = [i for i, label in enumerate(l_cha) if label not in exclude]
+    return signal[:, idx], [l_cha[i] for i in idx]
+
+
+def prepare_model_input(model, times, signal, fs, l_cha, exclude=()):
+    """ Applies the preprocessing stored in the model when it was trained
+    (see Config.train_model), in the same order: the signal is sliced to the
+    channel subset, cast to the data type of the model and decimated. Models
+    without these attributes use all the channels, in float64, at the rate
+    of the EEG stream. The channels in `exclude` (not EEG) are never used.
+
+    Returns
+    -------
+    times, signal, fs, l_cha
+    """
+    signal, l_cha = exclude_channels(signal, l_cha, exclude)
+    subset = getattr(model, 'channel_subset', None)
+    if subset is not None:
+        idx = get_channel_indexes(l_cha, subset)
+        signal, l_cha = signal[:, idx], [l_cha[i] for i in idx]
+    # Casting before decimating halves the work of the polyphase filter
+    signal = np.asarray(signal).astype(get_signal_dtype(model), copy=False)
+    factor = getattr(model, 'decimation_factor', 1)
+    if factor > 1:
+        times, signal = decimation.decimate(times, signal, factor, fs)
+        fs = fs / factor
+    return times, signal, fs, l_cha
+
+
+def check_dtype_equivalence(model, recordings, dtype='float32', exclude=()):
+    """ Decodes all the trials of some recordings (e.g., previous online
+    sessions) with the signal in float64 and in `dtype`, to verify that the
+    reduced precision does not change the selections.
+
+    Returns
+    -------
+    n_trials: int
+        Number of decoded trials.
+    n_agree: int
+        Number of trials in which both selections are the same. If all of
+        them agree, the accuracy is the same with both data types.
+    """
+    from medusa import meeg
+    original = getattr(model, 'signal_dtype', None)
+    selections = dict()
+    try:
+        for name in ('float64', np.dtype(dtype).name):
+            model.signal_dtype = name
+            selections[name] = list()
+            for rec in recordings:
+                times, signal, fs, l_cha = prepare_model_input(
+                    model, rec.eeg.times, rec.eeg.signal, rec.eeg.fs,
+                    rec.eeg.channel_set.l_cha, exclude)
+                channels = meeg.EEGChannelSet()
+                channels.set_standard_montage(l_cha)
+                eeg = meeg.EEG(times, signal, fs, channels)
+                cvep_data = getattr(rec, CVEP_DATA_KEY)
+                for trial in np.unique(cvep_data.trial_idx):
+                    decoding = model.predict(times=times, signal=signal,
+                                             trial_idx=trial,
+                                             exp_data=cvep_data,
+                                             sig_data=eeg)
+                    selections[name].append(decoding['spell_result'][0])
+    finally:
+        model.signal_dtype = original
+    reference, reduced = selections.values()
+    return len(reference), sum(a == b for a, b in zip(reference, reduced))
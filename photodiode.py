@@ -0,0 +1,114 @@
+import numpy as np
+
+
+def detect_edges(times, signal, threshold=None):
+    """ Detects the edges of a photodiode signal. The crossing time is
+    linearly interpolated between samples.
+
+    Parameters
+    ----------
+    times: numpy.ndarray
+        Timestamps of the samples.
+    signal: numpy.ndarray
+        Samples of the photodiode channel.
+    threshold: float or None
+        Level that separates both states. If None, the midpoint between the
+        1st and 99th percentiles is used.
+
+    Returns
+    -------
+    edges: numpy.ndarray
+        Timestamps of the edges.
+    rising: numpy.ndarray
+        Boolean array, True for rising edges.
+    state: numpy.ndarray
+        Boolean array, True for the samples above the threshold.
+    """
+    times = np.asarray(times, dtype=float)
+    x = np.asarray(signal, dtype=float).ravel()
+    if x.shape[0] < 2:
+        return np.zeros((0,)), np.zeros((0,), dtype=bool), x > 0
+    if threshold is None:
+        lo, hi = np.percentile(x, [1, 99])
+        threshold = 0.5 * (lo + hi) if hi > lo else np.inf
+    state = x > threshold
+    idx = np.flatnonzero(state[1:] != state[:-1]) + 1
+    x0, x1 = x[idx - 1], x[idx]
+    frac = (threshold - x0) / (x1 - x0)
+    edges = times[idx - 1] + frac * (times[idx] - times[idx - 1])
+    return edges, state[idx], state
+
+
+def detect_pulses(times, signal, threshold=None):
+    """ Returns the start times of the photodiode pulses.
+
+    During the stimulation, Unity shows a one-frame pulse in the photodiode
+    cell at the start of each cycle. The pulses are the minority state of
+    the signal, so the polarity of the sensor does not matter.
+    """
+    edges, rising, state = detect_edges(times, signal, threshold)
+    pulses_high = np.mean(state) < 0.5
+    return edges[rising == pulses_high]
+
+
+def align_onsets(onsets, pulses, max_lag=0.1, tolerance=0.02, groups=None):
+    """ Snaps the onsets reported by Unity to the photodiode pulses.
+
+    For each group of onsets (e.g., a trial), the lag between each onset and
+    the first pulse after it is computed, and the median lag is taken as the
+    display latency of the group. Then, each onset is moved to the pulse
+    closest to onset + latency, which removes the jitter of the reported
+    timestamps. Onsets without a pulse within `tolerance` of the expected
+    time are not modified.
+
+    Parameters
+    ----------
+    onsets: numpy.ndarray
+        Onsets reported by Unity.
+    pulses: numpy.ndarray
+        Sorted start times of the pulses (see `detect_pulses`).
+    max_lag: float
+        Maximum expected latency between an onset and its pulse (s).
+    tolerance: float
+        Maximum distance between the expected time and the pulse (s).
+    groups: numpy.ndarray or None
+        Group of each onset (e.g., trial_idx). If None, all the onsets share
+        the same latency.
+
+    Returns
+    -------
+    aligned: numpy.ndarray
+        Aligned onsets.
+    n_aligned: int
+        Number of onsets that have been snapped to a pulse.
+    """
+    onsets = np.asarray(onsets, dtype=float)
+    aligned = onsets.copy()
+    pulses = np.asarray(pulses, dtype=float)
+    if onsets.shape[0] == 0 or pulses.shape[0] == 0:
+        return aligned, 0
+    groups = np.zeros(onsets.shape) if groups is None else np.asarray(groups)
+    # Lag of each onset to the first pulse after it
+    j = np.searchsorted(pulses, onsets, side='left')
+    lags = np.full(onsets.shape, np.nan)
+    valid = j < pulses.shape[0]
+    lags[valid] = pulses[j[valid]] - onsets[valid]
+    lags[lags > max_lag] = np.nan
+    n_aligned = 0
+    for group in np.unique(groups):
+        mask = groups == group
+        if np.all(np.isnan(lags[mask])):
+            continue
+        expected = onsets[mask] + np.nanmedian(lags[mask])
+        # Closest pulse to the expected time
+        k = np.searchsorted(pulses, expected)
+        k_prev = np.clip(k - 1, 0, pulses.shape[0] - 1)
+        k_next = np.clip(k, 0, pulses.shape[0] - 1)
+        k = np.where(np.abs(pulses[k_prev] - expected) <
+                     np.abs(pulses[k_next] - expected), k_prev, k_next)
+        snap = np.abs(pulses[k] - expected) <= tolerance
+        values = aligned[mask]
+        values[snap] = pulses[k[snap]]
+        aligned[mask] = values
+        n_aligned += int(np.sum(snap))
+    return aligned, n_aligned
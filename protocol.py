@@ -0,0 +1,139 @@
+import json
+import struct
+
+import numpy as np
+
+# Binary events are sent by Unity with this content type. The content
+# encoding is latin-1, which maps each byte to one character, so the payload
+# is recovered exactly even if the TCP server decodes the content as text.
+BINARY_CONTENT_TYPE = 'binary/cvep-event'
+BINARY_CONTENT_ENCODING = 'latin-1'
+
+MAGIC = 0xC5
+EVENT_TRAIN = 1
+EVENT_TEST = 2
+EVENT_TYPES = {EVENT_TRAIN: ('train', 'Train'),
+               EVENT_TEST: ('test', 'Online')}
+
+# magic, event, cycle, trial, matrix_idx, unit_idx, level_idx, command_idx
+# (-1 if not present), onset (little-endian, 22 bytes)
+ONSET_STRUCT = struct.Struct('<BBHHHHHhd')
+# Same layout, used to decode batches of onsets at once
+ONSET_DTYPE = np.dtype([('magic', 'u1'), ('event', 'u1'), ('cycle', '<u2'),
+                        ('trial', '<u2'), ('matrix_idx', '<u2'),
+                        ('unit_idx', '<u2'), ('level_idx', '<u2'),
+                        ('command_idx', '<i2'), ('onset', '<f8')])
+
+# Batch messages contain the onsets of several cycles. In JSON, they have the
+# keys of the onset messages, but each one is a list (except 'mode'). In
+# binary format, they are several onset structs concatenated
+BATCH_EVENT_TYPES = {'train_batch': 'train', 'test_batch': 'test'}
+ONSET_KEYS = ('cycle', 'onset', 'trial', 'matrix_idx', 'unit_idx',
+              'level_idx', 'command_idx')
+
+
+def to_bytes(received_message):
+    """ Returns the raw payload of a received message. """
+    if isinstance(received_message, (bytes, bytearray, memoryview)):
+        return bytes(received_message)
+    return received_message.encode(BINARY_CONTENT_ENCODING)
+
+
+def is_binary_event(received_message):
+    """ Checks if a received message is a binary event (one onset or a
+    batch). JSON messages always start with '{'. """
+    if len(received_message) == 0 or \
+            len(received_message) % ONSET_STRUCT.size != 0:
+        return False
+    first = received_message[0]
+    first = first if isinstance(first, int) else ord(first)
+    return first == MAGIC
+
+
+def encode_onset(msg):
+    """ Encodes an onset message (dict) as bytes. """
+    event = EVENT_TRAIN if msg['event_type'] == 'train' else EVENT_TEST
+    return ONSET_STRUCT.pack(MAGIC, event, msg['cycle'], msg['trial'],
+                             msg['matrix_idx'], msg['unit_idx'],
+                             msg['level_idx'], msg.get('command_idx', -1),
+                             msg['onset'])
+
+
+def decode_binary_event(data):
+    """ Decodes a binary event as an onset or a batch message. """
+    if len(data) == ONSET_STRUCT.size:
+        return decode_onset(data)
+    return decode_onset_batch(data)
+
+
+def decode_onset(data):
+    """ Decodes a binary onset into the dict of the equivalent JSON message
+    (see Manager.cs). """
+    _, event, cycle, trial, matrix_idx, unit_idx, level_idx, command_idx, \
+        onset = ONSET_STRUCT.unpack(to_bytes(data))
+    event_type, mode = EVENT_TYPES[event]
+    msg = {'event_type': event_type, 'cycle': cycle, 'onset': onset,
+           'trial': trial, 'matrix_idx': matrix_idx, 'unit_idx': unit_idx,
+           'level_idx': level_idx, 'mode': mode}
+    if command_idx >= 0:
+        msg['command_idx'] = command_idx
+    return msg
+
+
+def decode_onset_batch(data):
+    """ Decodes concatenated binary onsets into the dict of the equivalent
+    JSON batch message. The values are NumPy arrays. """
+    onsets = np.frombuffer(to_bytes(data), dtype=ONSET_DTYPE)
+    event_type, mode = EVENT_TYPES[int(onsets['event'][0])]
+    msg = {'event_type': event_type + '_batch', 'mode': mode}
+    for key in ONSET_KEYS:
+        msg[key] = onsets[key]
+    if np.any(onsets['command_idx'] < 0):
+        del msg['command_idx']
+    return msg
+
+
+def split_onset_batch(msg):
+    """ Returns the onset messages (one per cycle) of a batch message, e.g.
+    to store them in the spool with the same format as the single onsets. """
+    event_type = BATCH_EVENT_TYPES[msg['event_type']]
+    keys = [key for key in ONSET_KEYS if key in msg]
+    columns = [np.asarray(msg[key]).tolist() for key in keys]
+    return [dict(zip(keys, values), event_type=event_type, mode=msg['mode'])
+            for values in zip(*columns)]
+
+
+def benchmark(n=100000):
+    """ Compares the encoding and decoding time and size of an onset message
+    in JSON and in the binary format (payload only, both share the same
+    framing).
+
+    Returns
+    -------
+    results: dict
+        Size (bytes) and time per message (us) for each format.
+    """
+    import time
+    msg = {'event_type': 'train', 'cycle': 7, 'onset': 1712345678.123456,
+           'trial': 3, 'matrix_idx': 0, 'unit_idx': 0, 'level_idx': 0,
+           'command_idx': 0, 'mode': 'Train'}
+    results = dict()
+    t = time.perf_counter()
+    for _ in range(n):
+        data = json.dumps(msg).encode('utf-8')
+        json.loads(data.decode('utf-8'))
+    results['json'] = {'size': len(data),
+                       'us': (time.perf_counter() - t) / n * 1e6}
+    t = time.perf_counter()
+    for _ in range(n):
+        data = encode_onset(msg)
+        decode_onset(data)
+    results['binary'] = {'size': len(data),
+                         'us': (time.perf_counter() - t) / n * 1e6}
+    return results
+
+
+if __name__ == "__main__":
+    for fmt, res in benchmark().items():
+        print(' * %s: %i bytes, %.2f us/message (encode + decode)' %
+              (fmt, res['size'], res['us']))
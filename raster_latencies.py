@@ -0,0 +1,57 @@
+import numpy as np
+
+
+def new_raster_events():
+    """ Returns an empty record of raster latencies. It is stored as the
+    `raster_events` attribute of CVEPSpellerData, with the format read by
+    medusa (see correct_raster_latencies in CVEPModelCircularShifting):
+        {'onset': numpy.ndarray,
+         'event': [{sequence (tuple): latency (s)} for each onset]}
+    The latencies of an event apply to the trials whose onsets come after
+    the onset of the event. """
+    return {'onset': np.zeros((0,)), 'event': list()}
+
+
+def has_raster_events(raster_events):
+    """ Checks that some latencies have been recorded (recordings made with
+    older versions do not store them). """
+    return raster_events is not None and len(raster_events['event']) > 0
+
+
+def add_raster_event(raster_events, onset, commands_info, latencies):
+    """ Adds the latencies of the commands of a matrix (in the order of
+    commands_info), measured by Unity at the given onset. The template of
+    each command is its sequence, so the latencies are keyed by it. The
+    latencies of the other matrices are kept from the previous event. """
+    events = raster_events['event']
+    event = dict(events[-1]) if len(events) > 0 else dict()
+    for cmd, latency in zip(commands_info.values(), latencies):
+        event[tuple(cmd['sequence'])] = float(latency)
+    onsets = raster_events['onset']
+    if onsets.shape[0] > 0 and onsets[-1] == onset:
+        # Several matrices measured at once
+        events[-1] = event
+    else:
+        raster_events['onset'] = np.append(onsets, float(onset))
+        events.append(event)
+
+
+def to_serializable(raster_events):
+    """ Returns the raster events with lists instead of tuple keys, which
+    cannot be saved in bson or JSON (see from_serializable). """
+    if raster_events is None:
+        return None
+    return {'onset': [float(onset) for onset in raster_events['onset']],
+            'event': [{'sequences': [list(seq) for seq in event.keys()],
+                       'latencies': list(event.values())}
+                      for event in raster_events['event']]}
+
+
+def from_serializable(raster_events):
+    """ Restores the raster events of a loaded recording. """
+    if raster_events is None:
+        return None
+    return {'onset': np.asarray(raster_events['onset'], dtype=float),
+            'event': [dict(zip(map(tuple, event['sequences']),
+                               event['latencies']))
+                      for event in raster_events['event']]}
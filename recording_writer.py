@@ -0,0 +1,202 @@
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+
+class RecordingWriter:
+
+    INDEX_FILE = 'index.json'
+    EVENTS_FILE = 'events.jsonl'
+
+    def __init__(self, spool_dir, info=None):
+        """ Append-only writer that spools the recorded data to disk during
+        the run.
+
+        Signal chunks of each stream are stored as .npy files that can be
+        memory-mapped afterward, and the events received from Unity (e.g.,
+        onsets) are appended as JSON lines. The index of the spool is
+        atomically rewritten at each `flush()`, so the spool can be read back
+        even if the app dies in the middle of the run.
+
+        Parameters
+        ----------
+        spool_dir: basestring
+            Directory of the spool. It is created if it does not exist.
+        info: dict or None
+            Additional information stored in the index (e.g., settings).
+        """
+        self.spool_dir = spool_dir
+        self.streams = dict()
+        self.info = info if info is not None else dict()
+        self.finalized = False
+        self._pending_events = list()
+        self._lock = threading.Lock()
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._events_file = open(
+            os.path.join(self.spool_dir, self.EVENTS_FILE), 'a')
+
+    @classmethod
+    def read_index(cls, spool_dir):
+        """ Returns the index of a spool without opening it for writing. """
+        with open(os.path.join(spool_dir, cls.INDEX_FILE), 'r') as f:
+            return json.load(f)
+
+    @classmethod
+    def open(cls, spool_dir):
+        """ Re-opens an existing spool (e.g., after a crash). """
+        index = cls.read_index(spool_dir)
+        writer = cls(spool_dir, info=index['info'])
+        writer.streams = index['streams']
+        writer.finalized = index['finalized']
+        return writer
+
+    # ------------------------------ WRITING ------------------------------
+    def add_stream(self, uid, medusa_type, fs, l_cha):
+        """ Registers a stream in the spool (does nothing if it exists). """
+        with self._lock:
+            if uid in self.streams:
+                return
+            self.streams[uid] = {
+                'medusa_type': medusa_type,
+                'fs': fs,
+                'l_cha': list(l_cha),
+                'folder': 'stream_%i' % len(self.streams),
+                'chunks': list()
+            }
+            os.makedirs(os.path.join(self.spool_dir,
+                                     self.streams[uid]['folder']),
+                        exist_ok=True)
+
+    def append_samples(self, uid, times, signal):
+        """ Writes a new chunk of samples of the given stream. """
+        if times.shape[0] == 0:
+            return
+        with self._lock:
+            stream = self.streams[uid]
+            k = len(stream['chunks'])
+            folder = os.path.join(self.spool_dir, stream['folder'])
+            np.save(os.path.join(folder, 'times_%i.npy' % k), times)
+            np.save(os.path.join(folder, 'signal_%i.npy' % k), signal)
+            stream['chunks'].append({'n_samples': int(times.shape[0]),
+                                     't0': float(times[0]),
+                                     't1': float(times[-1])})
+
+    def last_timestamp(self, uid):
+        """ Returns the timestamp of the last spooled sample of a stream, or
+        None if nothing has been written yet. """
+        with self._lock:
+            chunks = self.streams[uid]['chunks']
+            return chunks[-1]['t1'] if len(chunks) > 0 else None
+
+    def append_event(self, event):
+        """ Buffers an event (dict) until the next flush. """
+        with self._lock:
+            self._pending_events.append(event)
+
+    def append_events(self, events):
+        """ Buffers several events (list of dicts) until the next flush. """
+        with self._lock:
+            self._pending_events.extend(events)
+
+    def flush(self):
+        """ Writes the buffered events and the index to disk. """
+        with self._lock:
+            for event in self._pending_events:
+                self._events_file.write(json.dumps(event) + '\n')
+            self._pending_events = list()
+            self._events_file.flush()
+            os.fsync(self._events_file.fileno())
+            self._write_index()
+
+    def rewrite_events(self, events):
+        """ Atomically replaces the events written to disk (e.g., to drop
+        the events of an incomplete trial before resuming a run). """
+        with self._lock:
+            self._pending_events = list()
+            self._events_file.close()
+            path = os.path.join(self.spool_dir, self.EVENTS_FILE)
+            with open(path + '.tmp', 'w') as f:
+                for event in events:
+                    f.write(json.dumps(event) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+            self._events_file = open(path, 'a')
+
+    def finalize(self):
+        """ Flushes everything and marks the spool as complete. """
+        self.finalized = True
+        self.flush()
+        with self._lock:
+            self._events_file.close()
+
+    def _write_index(self):
+        index = {'info': self.info,
+                 'streams': self.streams,
+                 'finalized': self.finalized}
+        path = os.path.join(self.spool_dir, self.INDEX_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(index, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    # ------------------------------ READING ------------------------------
+    def read_stream(self, uid):
+        """ Returns the times and signal of a stream by concatenating its
+        memory-mapped chunks. """
+        chunks = list(self.iter_chunks(uid))
+        if len(chunks) == 0:
+            return np.zeros((0,)), \
+                np.zeros((0, len(self.streams[uid]['l_cha'])))
+        times, signal = zip(*chunks)
+        return np.concatenate(times), np.concatenate(signal)
+
+    def iter_chunks(self, uid):
+        """ Yields the (times, signal) chunks of a stream one at a time
+        (memory-mapped), so the stream can be copied to a recording without
+        loading it whole. """
+        with self._lock:
+            stream = self.streams[uid]
+            n_chunks = len(stream['chunks'])
+        folder = os.path.join(self.spool_dir, stream['folder'])
+        for k in range(n_chunks):
+            yield (np.load(os.path.join(folder, 'times_%i.npy' % k),
+                           mmap_mode='r'),
+                   np.load(os.path.join(folder, 'signal_%i.npy' % k),
+                           mmap_mode='r'))
+
+    def read_events(self):
+        """ Returns the list of events written to disk. """
+        events = list()
+        with open(os.path.join(self.spool_dir, self.EVENTS_FILE), 'r') as f:
+            for line in f:
+                line = line.strip()
+                # The last line may be incomplete if the app died while writing
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    continue
+        return events
+
+    def discard(self):
+        """ Removes the spool from disk. """
+        with self._lock:
+            if not self._events_file.closed:
+                self._events_file.close()
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+
+def get_new_samples(times, signal, last_timestamp):
+    """ Returns the samples recorded after `last_timestamp`.
+
+    Timestamps are used instead of sample indexes so the result is correct
+    even if the buffers of the LSL worker have been trimmed.
+    """
+    n = min(times.shape[0], signal.shape[0])
+    start = 0 if last_timestamp is None else \
+        int(np.searchsorted(times[:n], last_timestamp, side='right'))
+    return times[start:n], signal[start:n]
@@ -1,5 +1,4 @@
 from medusa.components import SerializableComponent
-from medusa.bci.cvep_spellers import LFSR, LFSR_PRIMITIVE_POLYNOMIALS
 from .app_constants import *
 import numpy as np
 import os
@@ -155,7 +154,8 @@ class Settings(SerializableComponent):
         lags = np.linspace(0, mseqlen, no_commands + 1)[:-1].astype(int)
         # lags_ = list(range(no_commands))
 
-        # M-sequence generation
+        # M-sequence generation (imported here, as it is slow to load)
+        from medusa.bci.cvep_spellers import LFSR, LFSR_PRIMITIVE_POLYNOMIALS
         if mseqlen == 31:
             poly_ = LFSR_PRIMITIVE_POLYNOMIALS['base'][2]['order'][5]
             m_seq = LFSR(poly_, base=2)
@@ -202,9 +202,23 @@ class Settings(SerializableComponent):
 
 class ConnectionSettings:
 
-    def __init__(self, ip="127.0.0.1", port=50000):
+    def __init__(self, ip="127.0.0.1", port=50000, session_host=False,
+                 binary_events=False, onset_batch_cycles=0,
+                 clock_sync_interval=5.0, clock_sync_correction=False):
         self.ip = ip
         self.port = port
+        # Keep the Unity app open between consecutive runs
+        self.session_host = session_host
+        # Send the onsets in binary format (if Unity supports it)
+        self.binary_events = binary_events
+        # Cycles whose onsets are sent in the same message (0: one message
+        # per cycle, required for dynamic stopping). The last batch of a
+        # trial is always sent when the trial ends
+        self.onset_batch_cycles = onset_batch_cycles
+        # Seconds between ping/pong exchanges to estimate the offset of the
+        # Unity clock (0: disabled), and whether the onsets are corrected
+        self.clock_sync_interval = clock_sync_interval
+        self.clock_sync_correction = clock_sync_correction
 
 class RunSettings:
     def __init__(self, user="S0X", session="Train", run=1,
@@ -213,7 +227,14 @@ class RunSettings:
                  train_cycles=10, train_trials=5,
                  test_cycles=10,
                  cvep_model_path='',
-                 fps_resolution=60):
+                 fps_resolution=60,
+                 online_retention=0.0,
+                 photodiode_channel='', photodiode_stream='',
+                 exclude_bad_cycles=False,
+                 lm_corpus_path='', lm_weight=1.0,
+                 vocabulary_path='', suggestion_cells=None,
+                 pipelined_trials=False,
+                 ensemble_model_paths=None, ensemble_rule='mean'):
         self.user = user
         self.session = session
         self.run = run
@@ -224,6 +245,33 @@ class RunSettings:
         self.test_cycles = test_cycles
         self.cvep_model_path = cvep_model_path
         self.fps_resolution = fps_resolution
+        # Seconds of data kept in memory in online mode (0: keep everything)
+        self.online_retention = online_retention
+        # Photodiode channel used to align the onsets ('': disabled) and
+        # medusa_uid of its LSL stream ('': the EEG stream)
+        self.photodiode_channel = photodiode_channel
+        self.photodiode_stream = photodiode_stream
+        # Online mode: exclude the cycles with dropped frames from decoding
+        self.exclude_bad_cycles = exclude_bad_cycles
+        # Online mode: corpus of the character language model combined with
+        # the scores of the classifier ('': disabled), and its weight
+        self.lm_corpus_path = lm_corpus_path
+        self.lm_weight = lm_weight
+        # Online mode: vocabulary of the word suggestions ('': disabled) and
+        # indexes (row * n_cols + col) of the cells of the first test matrix
+        # that show them
+        self.vocabulary_path = vocabulary_path
+        self.suggestion_cells = suggestion_cells \
+            if suggestion_cells is not None else []
+        # Online mode: the next trial starts while the previous one is
+        # decoded, and the selections are shown as soon as they arrive
+        self.pipelined_trials = pipelined_trials
+        # Online mode: additional models that score each trial in parallel
+        # worker processes, and the rule used to fuse their scores with the
+        # ones of the main model (see ensemble.py)
+        self.ensemble_model_paths = ensemble_model_paths \
+            if ensemble_model_paths is not None else []
+        self.ensemble_rule = ensemble_rule
 
 class Timings:
 
@@ -0,0 +1,86 @@
+import types
+
+import numpy as np
+
+from .. import chunked_recording
+from ..chunked_recording import ChunkedRecording
+
+
+class _ChannelSet:
+
+    def __init__(self, l_cha):
+        self.l_cha = l_cha
+
+    def to_serializable_obj(self):
+        return {'l_cha': self.l_cha}
+
+    @classmethod
+    def from_serializable_obj(cls, data):
+        return cls(data['l_cha'])
+
+
+def _biosignal(n, fs=100.0, t0=0.0):
+    return types.SimpleNamespace(times=t0 + np.arange(n) / fs,
+                                 signal=np.random.randn(n, 2), fs=fs,
+                                 channel_set=_ChannelSet(['Cz', 'Oz']))
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'rec.cvep.chunks')
+    eeg = _biosignal(1050)
+    chunked_recording.save(path, {'subject_id': 'S1', 'recording_id': 'R1'},
+                           {'exp': {'onsets': [1.0, 2.0]}}, {'eeg': eeg},
+                           chunk_duration=1.0)
+    with ChunkedRecording(path) as rec:
+        assert rec.info['subject_id'] == 'S1'
+        assert rec.get_experiment_data('exp') == {'onsets': [1.0, 2.0]}
+        # The last chunk is shorter
+        assert [c['n_samples'] for c in rec.streams['eeg']['chunks']] == \
+            [100] * 10 + [50]
+        times, signal = rec.read('eeg')
+        assert np.array_equal(times, eeg.times)
+        assert np.array_equal(signal, eeg.signal)
+
+
+def test_blocks_are_written_instead_of_the_biosignal(tmp_path):
+    path = str(tmp_path / 'rec.cvep.chunks')
+    eeg = _biosignal(0)
+    full = _biosignal(250)
+    blocks = [(full.times[:120], full.signal[:120]),
+              (full.times[120:], full.signal[120:])]
+    chunked_recording.save(path, {}, {}, {'eeg': eeg}, chunk_duration=1.0,
+                           blocks={'eeg': iter(blocks)})
+    with ChunkedRecording(path) as rec:
+        # Chunks do not span two blocks
+        assert [c['n_samples'] for c in rec.streams['eeg']['chunks']] == \
+            [100, 20, 100, 30]
+        times, signal = rec.read('eeg')
+    assert np.array_equal(times, full.times)
+    assert np.array_equal(signal, full.signal)
+
+
+def test_read_windows(tmp_path):
+    path = str(tmp_path / 'rec.cvep.chunks')
+    eeg = _biosignal(1000, t0=10.0)
+    chunked_recording.save(path, {}, {}, {'eeg': eeg}, chunk_duration=1.0)
+    with ChunkedRecording(path) as rec:
+        times, _ = rec.read_windows('eeg', [(10.5, 11.5), (15.0, 15.0)])
+        expected = eeg.times[((eeg.times >= 10.5) & (eeg.times <= 11.5)) |
+                             (eeg.times == 15.0)]
+        assert np.array_equal(times, expected)
+        times, signal = rec.read('eeg', 100.0, 200.0)
+        assert times.shape == (0,) and signal.shape == (0, 2)
+        assert rec.read('eeg', None, 10.005)[0].shape == (1,)
+
+
+def test_get_trial_windows():
+    cvep_data = types.SimpleNamespace(
+        onsets=np.array([10.0, 10.5, 11.0, 20.0, 20.5, 22.0]),
+        trial_idx=np.array([0, 0, 0, 1, 1, 2]),
+        commands_info=[{'0': {'sequence': [0, 1] * 30}}],
+        fps_resolution=60.0)
+    windows = chunked_recording.get_trial_windows(cvep_data, pad=1.0)
+    # Trials 1 and 2 overlap once extended by the pad and the cycle
+    assert windows == [(9.0, 13.0), (19.0, 24.0)]
+    cvep_data.onsets = np.zeros((0,))
+    assert chunked_recording.get_trial_windows(cvep_data) == []
@@ -0,0 +1,68 @@
+import numpy as np
+
+from ..clock_sync import ClockSynchronizer
+
+
+class _Clock:
+
+    def __init__(self, t=1000.0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+def _exchange(sync, clock, unity_offset, delay_out, delay_back,
+              processing=0.001):
+    """ Simulates a ping/pong exchange with the Unity clock ahead by
+    unity_offset(t) seconds. """
+    ping = sync.make_ping()
+    t1 = ping['t0'] + delay_out
+    t2 = t1 + processing
+    t3 = t2 + delay_back
+    clock.t = t3
+    return sync.on_pong({'seq': ping['seq'], 't1': t1 + unity_offset(t1),
+                         't2': t2 + unity_offset(t2)})
+
+
+def test_constant_offset():
+    clock = _Clock()
+    sync = ClockSynchronizer(clock=clock)
+    assert not sync.is_calibrated()
+    for _ in range(5):
+        offset, rtt = _exchange(sync, clock, lambda t: 0.25, 0.002, 0.002)
+        assert np.isclose(offset, 0.25) and np.isclose(rtt, 0.004)
+    assert sync.is_calibrated()
+    assert np.isclose(sync.to_server_time(10.25), 10.0)
+    assert np.allclose(sync.get_rtt_percentiles(), 0.004)
+
+
+def test_long_rtt_exchanges_are_ignored():
+    clock = _Clock()
+    sync = ClockSynchronizer(clock=clock)
+    for k in range(20):
+        # Every other exchange has a long asymmetric delay
+        delay_out = 0.002 if k % 2 == 0 else 0.050
+        _exchange(sync, clock, lambda t: 0.25, delay_out, 0.002)
+    assert np.isclose(sync.offset, 0.25)
+
+
+def test_drift():
+    clock = _Clock()
+    drift = 50e-6
+    sync = ClockSynchronizer(clock=clock, min_drift_span=30.0)
+    for _ in range(60):
+        _exchange(sync, clock, lambda t: 0.1 + drift * (t - 1000.0),
+                  0.002, 0.002)
+        clock.t += 1.0
+    assert np.isclose(sync.drift, drift, rtol=1e-3)
+    t = 1100.0
+    assert np.isclose(sync.to_server_time(t + 0.1 + drift * (t - 1000.0)),
+                      t, atol=1e-6)
+
+
+def test_unknown_pong():
+    sync = ClockSynchronizer(clock=_Clock())
+    assert sync.on_pong({'seq': 1, 't1': 0.0, 't2': 0.0}) is None
+    assert sync.get_rtt_percentiles() is None
+    assert sync.summary() == 'no pong received'
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from ..decimation import check_decimation, decimate
+
+FS = 256.0
+
+
+def test_factor_one():
+    times, signal = np.arange(10) / FS, np.ones((10, 2))
+    assert decimate(times, signal, 1, FS) == (times, signal)
+
+
+def test_jitter_does_not_split():
+    rng = np.random.RandomState(0)
+    times = np.arange(1000) / FS + rng.uniform(0, 0.5 / FS, 1000)
+    signal = rng.randn(1000, 2)
+    d_times, d_signal = decimate(times, signal, 4, FS)
+    assert np.array_equal(d_times, times[::4])
+    assert d_signal.shape == (250, 2)
+
+
+def test_gaps_are_decimated_separately():
+    # Two windows 10 s apart, the first one flat and the second one not
+    times = np.concatenate((np.arange(400) / FS, 10 + np.arange(398) / FS))
+    signal = np.concatenate((np.zeros((400, 1)), 100 * np.ones((398, 1))))
+    d_times, d_signal = decimate(times, signal, 4, FS)
+    assert np.array_equal(d_times, np.concatenate((times[:400:4],
+                                                   times[400::4])))
+    assert d_signal.shape == (200, 1)
+    # Nothing of the second window leaks into the first one
+    assert np.allclose(d_signal[:100], 0)
+
+
+def test_empty_signal():
+    d_times, d_signal = decimate(np.zeros((0,)), np.zeros((0, 2)), 4, FS)
+    assert d_times.shape == (0,) and d_signal.shape[0] == 0
+
+
+def test_check_decimation():
+    check_decimation(FS, 4, 30.0)
+    check_decimation(FS, 1, 100.0)
+    with pytest.raises(ValueError):
+        check_decimation(FS, 4, 32.0)
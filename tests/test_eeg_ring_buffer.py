@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from ..eeg_ring_buffer import SharedRingBuffer
+
+
+@pytest.fixture
+def ring():
+    ring = SharedRingBuffer(2, 8)
+    yield ring
+    ring.close()
+    ring.unlink()
+
+
+def _samples(k0, k1):
+    times = np.arange(k0, k1, dtype=float)
+    signal = np.stack((times, -times), axis=1)
+    return times, signal
+
+
+def test_wrap_around_is_contiguous(ring):
+    for k0 in range(0, 30, 3):
+        ring.write(*_samples(k0, k0 + 3))
+        times, signal = ring.latest()
+        k1 = k0 + 3
+        assert np.array_equal(times, np.arange(max(0, k1 - 8), k1))
+        assert np.array_equal(signal[:, 1], -times)
+    assert ring.write_index == 30
+    assert ring.first_index == 22
+
+
+def test_write_longer_than_capacity(ring):
+    ring.write(*_samples(0, 5))
+    ring.write(*_samples(5, 25))
+    times, _ = ring.latest()
+    assert np.array_equal(times, np.arange(17, 25))
+    assert ring.write_index == 25
+
+
+def test_views_are_read_only(ring):
+    ring.write(*_samples(0, 4))
+    times, signal = ring.latest(2)
+    assert np.array_equal(times, [2.0, 3.0])
+    with pytest.raises(ValueError):
+        signal[0, 0] = 1.0
+
+
+def test_time_queries(ring):
+    ring.write(*_samples(0, 12))
+    assert ring.last_timestamp() == 11.0
+    assert np.array_equal(ring.since(9.5)[0], [10.0, 11.0])
+    assert np.array_equal(ring.after(10.0)[0], [11.0])
+    assert ring.after(None)[0].shape == (8,)
+    # Samples 0-3 have been overwritten
+    assert ring.covers(4.0) and ring.covers(5.0)
+    assert not ring.covers(3.0)
+    assert not ring.is_valid(3) and ring.is_valid(4)
+
+
+def test_empty(ring):
+    assert ring.last_timestamp() is None
+    assert ring.covers(0.0)
+    times, signal = ring.latest()
+    assert times.shape == (0,) and signal.shape == (0, 2)
+
+
+def test_attach_reads_the_same_samples(ring):
+    ring.write(*_samples(0, 10))
+    other = SharedRingBuffer.attach(**ring.get_description())
+    try:
+        assert np.array_equal(other.latest()[0], ring.latest()[0])
+        ring.write(*_samples(10, 11))
+        assert other.last_timestamp() == 10.0
+    finally:
+        other.close()
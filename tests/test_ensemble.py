@@ -0,0 +1,87 @@
+from concurrent.futures import Future
+
+import numpy as np
+
+from .. import ensemble
+from ..eeg_ring_buffer import SharedRingBuffer
+
+
+def _cmd(row, col, correlation):
+    return {'coords': [0], 'item': {'row': row, 'col': col,
+                                    'label': None, 'text': 'ABCD'[col]},
+            'correlation': correlation}
+
+
+def _decoding(cmds):
+    return {'items_by_no_cycle': [[{'sorted_cmds': cmds}]],
+            'spell_result': [cmds[0]['item']['text']]}
+
+
+def _done(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def test_get_command_scores():
+    scores = ensemble.get_command_scores(
+        _decoding([_cmd(0, 1, 0.5), _cmd(0, 0, None)]))
+    assert scores[0] == ((0, 0, 1), 0.5)
+    assert scores[1][0] == (0, 0, 0) and np.isnan(scores[1][1])
+
+
+def test_fuse_rules():
+    a, b, c = (0, 0, 0), (0, 0, 1), (0, 0, 2)
+    score_lists = [[(a, 0.6), (b, 0.5), (c, 0.1)],
+                   [(b, 0.9), (a, 0.2), (c, 0.1)],
+                   [(b, 0.4), (c, 0.3), (a, 0.3)]]
+    keys, fused = ensemble.fuse_command_scores(score_lists, 'mean')
+    assert keys == [b, a, c]
+    assert np.allclose(fused, [0.6, 1.1 / 3, 0.5 / 3])
+    keys, _ = ensemble.fuse_command_scores(score_lists, 'rank')
+    assert keys == [b, a, c]
+    keys, fused = ensemble.fuse_command_scores(score_lists, 'vote')
+    assert keys == [b, a, c] and np.floor(fused[0]) == 2
+
+
+def test_fuse_without_scores():
+    # The mean falls back to the ranks if a model has no scores, and the
+    # commands missing in a model get its worst rank
+    a, b = (0, 0, 0), (0, 0, 1)
+    keys, _ = ensemble.fuse_command_scores(
+        [[(a, 0.6), (b, 0.5)], [(b, np.nan)]], 'mean')
+    assert keys == [b, a]
+
+
+def test_fuse_decoding():
+    models = ensemble.ModelEnsemble([], 'mean')
+    decoding = _decoding([_cmd(0, 0, 0.5), _cmd(0, 1, 0.4)])
+    decoding = models.fuse(decoding, [_done([((0, 0, 1), 0.9),
+                                             ((0, 0, 0), 0.1)])])
+    sorted_cmds = decoding['items_by_no_cycle'][-1][-1]['sorted_cmds']
+    assert [cmd['item']['col'] for cmd in sorted_cmds] == [1, 0]
+    assert np.allclose([cmd['score'] for cmd in sorted_cmds], [0.65, 0.3])
+    assert all('correlation' not in cmd for cmd in sorted_cmds)
+    assert decoding['spell_result'] == ['B']
+    models.shutdown()
+
+
+def test_window_is_copied():
+    ring = SharedRingBuffer(2, 8)
+    # State of a worker process after _init_worker
+    ensemble._worker['ring'] = None
+    try:
+        ring.write(np.arange(6.0), np.arange(12.0).reshape(6, 2))
+        times, signal = ensemble._get_window(
+            {'ring': ring.get_description(), 't0': 1.0, 't1': 3.0})
+        assert np.array_equal(times, [1.0, 2.0, 3.0])
+        # The window does not change when the ring is overwritten
+        ring.write(np.arange(6.0, 14.0), np.zeros((8, 2)))
+        assert np.array_equal(signal, np.arange(2.0, 8.0).reshape(3, 2))
+        assert signal.flags.writeable
+    finally:
+        attached = ensemble._worker.pop('ring')
+        if attached is not None:
+            attached.close()
+        ring.close()
+        ring.unlink()
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from ..language_model import CharNGramModel, fuse_scores, get_log_perplexity
+
+CORPUS = 'the cat sat on the mat and the dog sat on the log'
+
+
+@pytest.fixture
+def model():
+    return CharNGramModel(order=3).fit(CORPUS)
+
+
+@pytest.mark.parametrize('context', ['', 'th', 'the ', 'zq', 'THE_C'])
+def test_probabilities_sum_to_one(model, context):
+    # The characters of the alphabet and the unseen character
+    probs = [model.probability(c, context) for c in model.alphabet]
+    unseen = model.probability('#', context)
+    assert np.isclose(np.sum(probs) + unseen, 1.0)
+
+
+def test_context(model):
+    # 'h' always follows 't' in the corpus
+    assert model.probability('h', 'at') < model.probability('h', ' t')
+    assert model.probability('e', 'th') > 0.5
+    # Normalization: upper case and '_' as space
+    assert model.probability('E', 'TH') == model.probability('e', 'th')
+    assert model.probability('_', 'the') == model.probability(' ', 'the')
+
+
+def test_empty_model():
+    model = CharNGramModel()
+    assert np.isclose(model.probability('a', 'xyz'), 1.0)
+    model.fit('ab')
+    assert np.isclose(sum(model.probability(c, '') for c in 'ab#'), 1.0)
+
+
+def test_perplexity(model):
+    assert get_log_perplexity(model, 'the cat') < \
+        get_log_perplexity(model, 'xqz jvk')
+
+
+def test_fuse_scores():
+    scores = np.array([0.50, 0.48, 0.20])
+    # Without the language model, the best score wins
+    posterior = fuse_scores(scores, [0.1, 0.8, 0.1], weight=0.0)
+    assert np.isclose(np.sum(posterior), 1.0)
+    assert np.argmax(posterior) == 0
+    # A strong prior overturns a close decision, but not a clear one
+    assert np.argmax(fuse_scores(scores, [0.1, 0.8, 0.1])) == 1
+    assert np.argmax(fuse_scores(scores, [0.1, 0.1, 0.8])) == 0
@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from ..app_constants import CVEP_DATA_KEY
+from ..model_input import check_dtype_equivalence, prepare_model_input
+
+FS = 256.0
+L_CHA = ['Oz', 'PHOTO', 'O1', 'O2']
+
+
+class _Model:
+    """ Decodes the channel with the highest mean in the window of each
+    trial, and records the data type it receives. """
+
+    def __init__(self, **kwargs):
+        self.dtypes = list()
+        self.__dict__.update(kwargs)
+
+    def predict(self, times, signal, trial_idx, exp_data, sig_data):
+        self.dtypes.append(signal.dtype)
+        onsets = exp_data.onsets[exp_data.trial_idx == trial_idx]
+        k0, k1 = np.searchsorted(times, [onsets[0], onsets[-1] + 1.0])
+        label = str(np.argmax(np.mean(signal[k0:k1], axis=0)))
+        return {'spell_result': [label]}
+
+
+def _session(n_trials=4, seed=0):
+    rng = np.random.RandomState(seed)
+    times = np.arange(int(n_trials * 2 * FS)) / FS
+    signal = rng.randn(times.shape[0], len(L_CHA))
+    trial_idx = np.repeat(np.arange(n_trials, dtype=float), 2)
+    onsets = 2.0 * trial_idx + np.tile([0.0, 0.5], n_trials)
+    for t in range(n_trials):
+        signal[(times >= 2 * t) & (times < 2 * t + 2), 2 + t % 2] += 5.0
+    eeg = SimpleNamespace(times=times, signal=signal, fs=FS,
+                          channel_set=SimpleNamespace(l_cha=L_CHA))
+    rec = SimpleNamespace(eeg=eeg)
+    setattr(rec, CVEP_DATA_KEY,
+            SimpleNamespace(onsets=onsets, trial_idx=trial_idx))
+    return rec
+
+
+def test_defaults():
+    rec = _session()
+    times, signal, fs, l_cha = prepare_model_input(
+        _Model(), rec.eeg.times, rec.eeg.signal, FS, L_CHA)
+    assert signal.dtype == np.float64 and fs == FS and l_cha == L_CHA
+    assert np.shares_memory(signal, rec.eeg.signal)
+
+
+def test_float32_subset_and_exclusion():
+    rec = _session()
+    model = _Model(signal_dtype='float32', channel_subset=['O2', 'Oz'])
+    times, signal, fs, l_cha = prepare_model_input(
+        model, rec.eeg.times, rec.eeg.signal, FS, L_CHA, exclude=['PHOTO'])
+    # The subset keeps the order of the stream
+    assert l_cha == ['Oz', 'O2']
+    assert signal.dtype == np.float32
+    assert np.array_equal(signal, rec.eeg.signal[:, [0, 3]].astype('float32'))
+
+
+def test_excluded_channels_are_never_used():
+    rec = _session()
+    _, signal, _, l_cha = prepare_model_input(
+        _Model(), rec.eeg.times, rec.eeg.signal, FS, L_CHA, ['PHOTO'])
+    assert l_cha == ['Oz', 'O1', 'O2'] and signal.shape[1] == 3
+    with pytest.raises(ValueError):
+        prepare_model_input(_Model(channel_subset=['PHOTO']), rec.eeg.times,
+                            rec.eeg.signal, FS, L_CHA, ['PHOTO'])
+
+
+def test_decimation():
+    rec = _session()
+    model = _Model(signal_dtype='float32', decimation_factor=2)
+    times, signal, fs, _ = prepare_model_input(
+        model, rec.eeg.times, rec.eeg.signal, FS, L_CHA)
+    assert fs == FS / 2 and signal.dtype == np.float32
+    assert np.array_equal(times, rec.eeg.times[::2])
+
+
+def test_check_dtype_equivalence():
+    pytest.importorskip('medusa')
+    model = _Model(signal_dtype='float32')
+    n_trials, n_agree = check_dtype_equivalence(
+        model, [_session(), _session(seed=1)], 'float32', ['PHOTO'])
+    assert n_trials == n_agree == 8
+    assert set(model.dtypes) == {np.dtype('float64'), np.dtype('float32')}
+    # The data type of the model is restored
+    assert model.signal_dtype == 'float32'
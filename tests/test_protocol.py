@@ -0,0 +1,60 @@
+import json
+
+import numpy as np
+
+from .. import protocol
+
+
+def _onset(cycle, onset, **kwargs):
+    msg = {'event_type': 'train', 'cycle': cycle, 'onset': onset,
+           'trial': 3, 'matrix_idx': 0, 'unit_idx': 0, 'level_idx': 0,
+           'command_idx': 5, 'mode': 'Train'}
+    msg.update(kwargs)
+    return msg
+
+
+def test_onset_round_trip():
+    msg = _onset(7, 1712345678.123456)
+    data = protocol.encode_onset(msg)
+    assert len(data) == protocol.ONSET_STRUCT.size == 22
+    assert protocol.is_binary_event(data)
+    assert protocol.decode_binary_event(data) == msg
+
+
+def test_onset_without_command():
+    msg = _onset(0, 2.5, event_type='test', mode='Online')
+    del msg['command_idx']
+    assert protocol.decode_onset(protocol.encode_onset(msg)) == msg
+
+
+def test_decode_latin1_text():
+    # The TCP server may have decoded the payload as text
+    msg = _onset(1, 10.0)
+    text = protocol.encode_onset(msg).decode(protocol.BINARY_CONTENT_ENCODING)
+    assert protocol.is_binary_event(text)
+    assert protocol.decode_binary_event(text) == msg
+
+
+def test_json_is_not_binary():
+    assert not protocol.is_binary_event(json.dumps(_onset(0, 1.0)))
+    assert not protocol.is_binary_event('')
+    assert not protocol.is_binary_event(b'\xc5' * 21)
+
+
+def test_batch_round_trip():
+    msgs = [_onset(c, 1.0 + c) for c in range(4)]
+    data = b''.join(protocol.encode_onset(m) for m in msgs)
+    batch = protocol.decode_binary_event(data)
+    assert batch['event_type'] == 'train_batch'
+    assert np.array_equal(batch['cycle'], np.arange(4))
+    assert np.array_equal(batch['onset'], 1.0 + np.arange(4))
+    assert protocol.split_onset_batch(batch) == msgs
+
+
+def test_batch_without_command():
+    msgs = [_onset(c, 1.0 + c, command_idx=-1) for c in range(2)]
+    batch = protocol.decode_onset_batch(
+        b''.join(protocol.encode_onset(m) for m in msgs))
+    assert 'command_idx' not in batch
+    assert all('command_idx' not in m
+               for m in protocol.split_onset_batch(batch))
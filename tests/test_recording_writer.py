@@ -0,0 +1,108 @@
+import numpy as np
+
+from ..recording_writer import RecordingWriter, get_new_samples
+
+
+def _writer(tmp_path):
+    writer = RecordingWriter(str(tmp_path / 'spool'), info={'mode': 'Train'})
+    writer.add_stream('eeg', 'EEG', 256.0, ['Cz', 'Oz'])
+    return writer
+
+
+def test_chunks_round_trip(tmp_path):
+    writer = _writer(tmp_path)
+    times = np.arange(100) / 256.0
+    signal = np.random.randn(100, 2)
+    writer.append_samples('eeg', times[:40], signal[:40])
+    writer.append_samples('eeg', times[40:40], signal[40:40])   # Ignored
+    writer.append_samples('eeg', times[40:], signal[40:])
+    r_times, r_signal = writer.read_stream('eeg')
+    assert np.array_equal(r_times, times)
+    assert np.array_equal(r_signal, signal)
+    assert [c[0].shape[0] for c in writer.iter_chunks('eeg')] == [40, 60]
+    assert writer.last_timestamp('eeg') == times[-1]
+
+
+def test_empty_stream(tmp_path):
+    writer = _writer(tmp_path)
+    times, signal = writer.read_stream('eeg')
+    assert times.shape == (0,) and signal.shape == (0, 2)
+    assert writer.last_timestamp('eeg') is None
+
+
+def test_add_stream_is_idempotent(tmp_path):
+    writer = _writer(tmp_path)
+    writer.append_samples('eeg', np.zeros(1), np.zeros((1, 2)))
+    writer.add_stream('eeg', 'EEG', 256.0, ['Cz', 'Oz'])
+    assert len(writer.streams['eeg']['chunks']) == 1
+
+
+def test_events_are_written_on_flush(tmp_path):
+    writer = _writer(tmp_path)
+    writer.append_event({'event_type': 'train', 'onset': 1.0})
+    assert writer.read_events() == []
+    writer.append_events([{'event_type': 'train', 'onset': 2.0}])
+    writer.flush()
+    assert [e['onset'] for e in writer.read_events()] == [1.0, 2.0]
+
+
+def test_get_new_samples():
+    times = np.array([1.0, 2.0, 3.0, 4.0])
+    signal = np.arange(8.0).reshape(4, 2)
+    new_times, new_signal = get_new_samples(times, signal, 2.0)
+    assert np.array_equal(new_times, [3.0, 4.0])
+    assert np.array_equal(new_signal, signal[2:])
+    assert get_new_samples(times, signal, None)[0].shape == (4,)
+    assert get_new_samples(times, signal, 4.0)[0].shape == (0,)
+    # Samples whose timestamp has arrived before the data are not returned
+    assert get_new_samples(times, signal[:3], 1.0)[0].shape == (2,)
+
+
+def _crash(tmp_path):
+    """ Writes a spool as the app would before dying in the middle of the
+    run: the last chunk and event are not in the index, and the last line of
+    the events is incomplete. """
+    writer = _writer(tmp_path)
+    writer.append_samples('eeg', np.arange(10.0), np.ones((10, 2)))
+    writer.append_events([{'event_type': 'train', 'trial': 0, 'onset': 1.0},
+                          {'event_type': 'train', 'trial': 1, 'onset': 5.0}])
+    writer.flush()
+    writer.append_samples('eeg', np.arange(10.0, 15.0), np.ones((5, 2)))
+    writer._events_file.write('{"event_type": "tra')
+    writer._events_file.flush()
+    return writer.spool_dir
+
+
+def test_open_after_crash(tmp_path):
+    spool_dir = _crash(tmp_path)
+    writer = RecordingWriter.open(spool_dir)
+    assert not writer.finalized
+    assert writer.info == {'mode': 'Train'}
+    # Only the chunks written to the index are recovered
+    times, signal = writer.read_stream('eeg')
+    assert np.array_equal(times, np.arange(10.0))
+    assert writer.last_timestamp('eeg') == 9.0
+    # The incomplete line is skipped
+    assert [e['trial'] for e in writer.read_events()] == [0, 1]
+
+
+def test_resume_after_crash(tmp_path):
+    spool_dir = _crash(tmp_path)
+    writer = RecordingWriter.open(spool_dir)
+    # Drop the events of the incomplete trial and keep recording
+    writer.rewrite_events(writer.read_events()[:1])
+    writer.append_samples('eeg', np.arange(10.0, 20.0), np.ones((10, 2)))
+    writer.append_event({'event_type': 'train', 'trial': 1, 'onset': 12.0})
+    writer.finalize()
+    writer = RecordingWriter.open(spool_dir)
+    assert writer.finalized
+    assert np.array_equal(writer.read_stream('eeg')[0], np.arange(20.0))
+    assert [e['onset'] for e in writer.read_events()] == [1.0, 12.0]
+
+
+def test_discard(tmp_path):
+    writer = _writer(tmp_path)
+    writer.append_samples('eeg', np.arange(10.0), np.ones((10, 2)))
+    writer.flush()
+    writer.discard()
+    assert not (tmp_path / 'spool').exists()
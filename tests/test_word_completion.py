@@ -0,0 +1,58 @@
+from ..word_completion import VocabularyTrie, apply_selection, get_prefix
+
+
+def _trie(max_suggestions=3):
+    trie = VocabularyTrie(max_suggestions)
+    for word, count in [('the', 50), ('then', 5), ('there', 8), ('they', 20),
+                        ('this', 30), ('cat', 3)]:
+        trie.insert(word, count)
+    return trie.finalize()
+
+
+def test_prefix_lookup():
+    trie = _trie()
+    assert trie.n_words == 6
+    assert trie.complete('th', 3) == ['the', 'this', 'they']
+    assert trie.complete('the', 3) == ['the', 'they', 'there']
+    assert trie.complete('THE', 2) == ['the', 'they']
+    assert trie.complete('c', 3) == ['cat']
+    assert trie.complete('x', 3) == []
+    # The empty prefix returns the most frequent words
+    assert trie.complete('', 1) == ['the']
+
+
+def test_counts_are_accumulated():
+    trie = _trie()
+    trie.insert('cat', 100)
+    trie.finalize()
+    assert trie.n_words == 6
+    assert trie.complete('', 1) == ['cat']
+
+
+def test_load(tmp_path):
+    freq = tmp_path / 'freq.txt'
+    freq.write_text('hello 3\nhelp 7\n', encoding='utf-8')
+    assert VocabularyTrie.load(str(freq)).complete('hel', 2) == \
+        ['help', 'hello']
+    corpus = tmp_path / 'corpus.txt'
+    corpus.write_text('Hello, hello world!\nhelp 42 hello\n',
+                      encoding='utf-8')
+    trie = VocabularyTrie.load(str(corpus))
+    assert trie.complete('hel', 2) == ['hello', 'help']
+    assert trie.complete('4', 1) == []
+
+
+def test_get_prefix():
+    assert get_prefix('') == ''
+    assert get_prefix('HEL') == 'HEL'
+    assert get_prefix('I_AM HE') == 'HE'
+    assert get_prefix('I_AM_') == ''
+
+
+def test_apply_selection():
+    assert apply_selection('I AM HE', 'L') == 'I AM HEL'
+    assert apply_selection('I AM HE', 'HELLO', is_word=True) == \
+        'I AM HELLO '
+    assert apply_selection('I_AM_', 'HELLO', is_word=True) == 'I_AM_HELLO '
+    # An empty suggestion cell does not change the text
+    assert apply_selection('I AM HE', '', is_word=True) == 'I AM HE'
@@ -0,0 +1,216 @@
+import abc
+import glob
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+
+class MonitorRatesBackend(abc.ABC):
+    """ Base class of the backends that return the connected monitors and
+    their refresh rates. """
+
+    @abc.abstractmethod
+    def get_monitor_rates(self):
+        """ Returns the connected monitors and their refresh rates.
+
+        Returns
+        ---------------
+        list of tuples(name, rate)
+            Returned list of tuples composed of the monitor's name and monitor's
+            rate for each connected device.
+        """
+        pass
+
+
+class Win32MonitorRatesBackend(MonitorRatesBackend):
+    """ Backend that calls to the win32 API (see utils_win_monitor_rates.py).
+    """
+
+    def get_monitor_rates(self):
+        from .utils_win_monitor_rates import get_monitor_rates
+        return get_monitor_rates()
+
+
+class LinuxMonitorRatesBackend(MonitorRatesBackend):
+    """ Backend for Linux. It parses the output of xrandr (X11) and, if it is
+    not available, it reads the EDID of the connected DRM connectors from
+    sysfs (preferred mode of each monitor). """
+
+    DRM_PATH = '/sys/class/drm'
+
+    def get_monitor_rates(self):
+        monitors = self.get_xrandr_rates()
+        if monitors is None:
+            monitors = self.get_drm_rates()
+        return monitors
+
+    def get_xrandr_rates(self):
+        try:
+            output = subprocess.run(['xrandr', '--query'], capture_output=True,
+                                    text=True, timeout=5)
+        except (OSError, subprocess.SubprocessError):
+            return None
+        if output.returncode != 0:
+            return None
+        return self.parse_xrandr_output(output.stdout)
+
+    @staticmethod
+    def parse_xrandr_output(text):
+        """ Parses the output of `xrandr --query`. The current rate of each
+        connected output is the one marked with an asterisk. """
+        monitors = list()
+        monitor_name = None
+        for line in text.splitlines():
+            if not line.startswith((' ', '\t')):
+                match = re.match(r'^(\S+) connected', line)
+                monitor_name = match.group(1) if match else None
+                continue
+            if monitor_name is None or '*' not in line:
+                continue
+            for token in line.split()[1:]:
+                if '*' in token:
+                    rate = float(token.replace('*', '').replace('+', ''))
+                    monitors.append((monitor_name, int(round(rate))))
+                    monitor_name = None
+                    break
+        return monitors
+
+    def get_drm_rates(self):
+        monitors = list()
+        for connector in sorted(glob.glob(os.path.join(self.DRM_PATH,
+                                                       'card*-*'))):
+            try:
+                with open(os.path.join(connector, 'status')) as f:
+                    if f.read().strip() != 'connected':
+                        continue
+                with open(os.path.join(connector, 'edid'), 'rb') as f:
+                    edid = f.read()
+            except OSError:
+                continue
+            monitor = self.parse_edid(edid)
+            if monitor is not None:
+                name, rate = monitor
+                if name == '':
+                    name = os.path.basename(connector).split('-', 1)[-1]
+                monitors.append((name, rate))
+        return monitors
+
+    @staticmethod
+    def parse_edid(edid):
+        """ Returns the name and the refresh rate of the preferred timing of
+        an EDID block, or None if it cannot be decoded. """
+        if len(edid) < 128:
+            return None
+        rate = None
+        name = ''
+        for offset in (54, 72, 90, 108):
+            desc = edid[offset:offset + 18]
+            pixel_clock = int.from_bytes(desc[0:2], 'little') * 10000
+            if pixel_clock > 0:
+                # Detailed timing descriptor (the first one is the preferred)
+                if rate is not None:
+                    continue
+                h_total = desc[2] + ((desc[4] & 0xF0) << 4) + \
+                    desc[3] + ((desc[4] & 0x0F) << 8)
+                v_total = desc[5] + ((desc[7] & 0xF0) << 4) + \
+                    desc[6] + ((desc[7] & 0x0F) << 8)
+                if h_total > 0 and v_total > 0:
+                    rate = int(round(pixel_clock / (h_total * v_total)))
+            elif desc[3] == 0xFC:
+                # Monitor name descriptor
+                name = desc[5:18].decode('ascii', errors='ignore').strip()
+        if rate is None:
+            return None
+        return name, rate
+
+
+class StubMonitorRatesBackend(MonitorRatesBackend):
+    """ Backend for unsupported platforms: no monitor is detected. """
+
+    def get_monitor_rates(self):
+        return list()
+
+
+def get_default_backend():
+    """ Returns the monitor rates backend for the current platform. """
+    if sys.platform == 'win32':
+        return Win32MonitorRatesBackend()
+    elif sys.platform.startswith('linux'):
+        return LinuxMonitorRatesBackend()
+    return StubMonitorRatesBackend()
+
+
+class MonitorRatesCache:
+
+    def __init__(self, backend=None, max_age=30.0):
+        """ Class that caches the monitor rates returned by a backend.
+
+        Parameters
+        ----------
+        backend: MonitorRatesBackend or None
+            Backend to query. If None, the one of the current platform is used.
+        max_age: float
+            Time (in seconds) after which the cached rates are queried again.
+        """
+        self.backend = backend if backend is not None else \
+            get_default_backend()
+        self.max_age = max_age
+        self._monitors = None
+        self._timestamp = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """ Discards the cached rates (e.g., a display has been connected). """
+        with self._lock:
+            self._monitors = None
+
+    def get(self, force=False):
+        """ Returns the cached monitor rates, querying the backend if they are
+        not available or too old. This is a blocking method. """
+        with self._lock:
+            if not force and self._monitors is not None and \
+                    time.monotonic() - self._timestamp < self.max_age:
+                return list(self._monitors)
+        try:
+            monitors = self.backend.get_monitor_rates()
+        except Exception as ex:
+            print('[cvep_speller/utils_monitor_rates] Cannot get the monitor '
+                  'rates: %s' % str(ex))
+            monitors = list()
+        with self._lock:
+            self._monitors = list(monitors)
+            self._timestamp = time.monotonic()
+        return monitors
+
+    def get_async(self, callback, force=False):
+        """ Queries the monitor rates in a separate thread and calls
+        `callback(monitors)` from that thread. """
+        def query():
+            monitors = self.get(force)
+            try:
+                callback(monitors)
+            except RuntimeError:
+                # The receiver has been deleted (e.g., a closed dialog)
+                pass
+        thread = threading.Thread(target=query, daemon=True)
+        thread.start()
+        return thread
+
+
+# Cache shared by all the config dialogs of this process
+monitor_rates_cache = MonitorRatesCache()
+
+
+def get_monitor_rates():
+    """ Returns the (cached) connected monitors and their refresh rates.
+
+    Returns
+    ---------------
+    list of tuples(name, rate)
+        Returned list of tuples composed of the monitor's name and monitor's
+        rate for each connected device.
+    """
+    return monitor_rates_cache.get()
@@ -0,0 +1,90 @@
+import importlib
+import sys
+import time
+
+
+class StartupProfiler:
+
+    def __init__(self, tag, enabled=True, t0=None):
+        """ Class that measures the startup time of an entry point of the app.
+
+        Checkpoints are stored along with the elapsed time since `t0`, so the
+        time-to-first-window (config) and time-to-server-up (app) can be
+        printed afterward.
+
+        Parameters
+        ----------
+        tag: basestring
+            Tag that is printed before the report.
+        enabled: bool
+            If False, checkpoints are ignored and nothing is printed.
+        t0: float or None
+            Reference time obtained with `time.perf_counter()`. If None, the
+            current time is taken.
+        """
+        self.tag = tag
+        self.enabled = enabled
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self.checkpoints = []
+
+    def checkpoint(self, label):
+        """ Stores the elapsed time for the given label. """
+        if not self.enabled:
+            return
+        self.checkpoints.append((label, time.perf_counter() - self.t0))
+
+    def report(self):
+        """ Prints the stored checkpoints. """
+        if not self.enabled or len(self.checkpoints) == 0:
+            return
+        text = 'Startup profiling:\n'
+        prev = 0.0
+        for label, elapsed in self.checkpoints:
+            text += ' * %s: %.1f ms (+%.1f ms)\n' % (
+                label, elapsed * 1000, (elapsed - prev) * 1000)
+            prev = elapsed
+        print(self.tag, text)
+
+
+def profile_imports(module_names):
+    """ Measures the import time of the given modules.
+
+    Modules that were already imported are reported with a time of 0, so this
+    function should be called in a fresh interpreter.
+
+    Parameters
+    ----------
+    module_names: list of basestring
+        Names of the modules to import.
+
+    Returns
+    ---------------
+    list of tuples(name, seconds)
+        Import time of each module, or None if it could not be imported.
+    """
+    times = list()
+    for name in module_names:
+        if name in sys.modules:
+            times.append((name, 0.0))
+            continue
+        t = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except Exception:
+            times.append((name, None))
+            continue
+        times.append((name, time.perf_counter() - t))
+    return times
+
+
+if __name__ == "__main__":
+    # Usage (from MEDUSA's src directory): python <path>/utils_profiling.py
+    heavy_modules = ['numpy', 'PySide6.QtWidgets', 'medusa.components',
+                     'medusa.meeg', 'medusa.bci.cvep_spellers', 'medusa.ecg',
+                     'medusa.emg', 'medusa.nirs', 'matplotlib.pyplot',
+                     'matplotlib.backends.backend_qt5agg']
+    for name, seconds in profile_imports(heavy_modules):
+        if seconds is None:
+            print(' * %s: not available' % name)
+        else:
+            print(' * %s: %.1f ms' % (name, seconds * 1000))
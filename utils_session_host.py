@@ -0,0 +1,96 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+SESSION_FILE = os.path.join(tempfile.gettempdir(),
+                            'medusa_cvep_speller_session.json')
+
+
+def read_session():
+    """ Returns the info of the Unity session host (pid, ip, port and last
+    parameters sent to it), or None if there is no session. """
+    try:
+        with open(SESSION_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_session(session):
+    """ Atomically writes the info of the Unity session host. """
+    with open(SESSION_FILE + '.tmp', 'w') as f:
+        json.dump(session, f)
+    os.replace(SESSION_FILE + '.tmp', SESSION_FILE)
+
+
+def get_process_start_time(pid):
+    """ Returns the start time of a running process (in an OS-specific
+    unit), or None if it is not running. Together with the pid, it
+    identifies the process even if the pid is reused later. """
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        STILL_ACTIVE = 259
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION,
+                                      False, pid)
+        if not handle:
+            return None
+        try:
+            exit_code = ctypes.c_ulong()
+            if not kernel32.GetExitCodeProcess(handle,
+                                               ctypes.byref(exit_code)) or \
+                    exit_code.value != STILL_ACTIVE:
+                return None
+            times = [wintypes.FILETIME() for _ in range(4)]
+            if not kernel32.GetProcessTimes(
+                    handle, *[ctypes.byref(t) for t in times]):
+                return None
+            creation = times[0]
+            return (creation.dwHighDateTime << 32) + creation.dwLowDateTime
+        finally:
+            kernel32.CloseHandle(handle)
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/%i/stat' % pid, 'r') as f:
+                stat = f.read()
+        except OSError:
+            return None
+        # Field 22 (start time in clock ticks since boot), counted after the
+        # command name, which may contain spaces
+        return int(stat[stat.rindex(')') + 2:].split()[19])
+    try:
+        output = subprocess.run(['ps', '-o', 'lstart=', '-p', str(pid)],
+                                capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return output.stdout.strip() or None
+
+
+def is_process_alive(pid, start_time):
+    """ Checks if the process that started at start_time (see
+    get_process_start_time) is still running. A different process with the
+    same pid (pids are reused) is not considered alive. """
+    return start_time is not None and \
+        get_process_start_time(pid) == start_time
+
+
+def start_detached(args):
+    """ Starts a process that outlives the current one. Returns its pid. """
+    if sys.platform == 'win32':
+        flags = subprocess.DETACHED_PROCESS | \
+            subprocess.CREATE_NEW_PROCESS_GROUP
+        proc = subprocess.Popen(args, creationflags=flags, close_fds=True)
+    else:
+        proc = subprocess.Popen(args, start_new_session=True, close_fds=True)
+    return proc.pid
+
+
+def get_parameters_diff(params, prev_params):
+    """ Returns the parameters whose value differs from prev_params. Both
+    must be JSON-compatible dicts. """
+    return {key: value for key, value in params.items()
+            if key not in prev_params or prev_params[key] != value}
@@ -6,8 +6,6 @@ import io
 import subprocess
 import sys
 
-user32 = ctypes.windll.user32
-
 CCHFORMNAME = 32
 CCHDEVICENAME = 32
 DM_BITSPERPEL = 0x00040000
@@ -131,6 +129,8 @@ def get_monitor_rates():
         rate for each connected device.
     """
     monitors = list()
+    # Bound here, so this module can be imported in non-Windows platforms
+    user32 = ctypes.windll.user32
 
     # Initialize pointers for the adapters
     adapter = DISPLAY_DEVICE()
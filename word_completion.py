@@ -0,0 +1,104 @@
+import collections
+import heapq
+import re
+
+# Characters that separate words in the spelled text
+WORD_SEPARATORS = (' ', '_')
+
+
+class _Node:
+    __slots__ = ('children', 'count', 'top')
+
+    def __init__(self):
+        self.children = dict()
+        self.count = 0
+        # Most frequent words of the subtree: list of (count, word)
+        self.top = list()
+
+
+class VocabularyTrie:
+
+    def __init__(self, max_suggestions=8):
+        """ Prefix trie of a vocabulary with frequency ranking.
+
+        Each node stores the most frequent words of its subtree (computed in
+        `finalize`), so the completions of a prefix are obtained in
+        O(len(prefix)), regardless of the size of the vocabulary.
+
+        Parameters
+        ----------
+        max_suggestions: int
+            Maximum number of completions that can be requested.
+        """
+        self.max_suggestions = max_suggestions
+        self.root = _Node()
+        self.n_words = 0
+
+    def insert(self, word, count=1):
+        node = self.root
+        for char in word.lower():
+            node = node.children.setdefault(char, _Node())
+        if node.count == 0:
+            self.n_words += 1
+        node.count += count
+
+    def finalize(self):
+        """ Computes the ranking of each node (iterative post-order, so long
+        words do not reach the recursion limit). """
+        stack = [(self.root, '', False)]
+        while stack:
+            node, prefix, visited = stack.pop()
+            if not visited:
+                stack.append((node, prefix, True))
+                for char, child in node.children.items():
+                    stack.append((child, prefix + char, False))
+                continue
+            candidates = [(node.count, prefix)] if node.count > 0 else []
+            for child in node.children.values():
+                candidates.extend(child.top)
+            node.top = heapq.nlargest(self.max_suggestions, candidates)
+        return self
+
+    def complete(self, prefix, n):
+        """ Returns the n most frequent words that start with prefix (or
+        fewer if there are not enough). """
+        node = self.root
+        for char in prefix.lower():
+            node = node.children.get(char)
+            if node is None:
+                return list()
+        return [word for _, word in node.top[:n]]
+
+    @classmethod
+    def load(cls, file_path, max_suggestions=8):
+        """ Builds the trie from a UTF-8 text file. Lines with the format
+        "word frequency" are read as a frequency list. Otherwise, the file is
+        treated as a corpus and the words are counted. """
+        counts = collections.Counter()
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                tokens = line.split()
+                if len(tokens) == 2 and tokens[1].isdigit():
+                    counts[tokens[0].lower()] += int(tokens[1])
+                else:
+                    counts.update(re.findall(r"[^\W\d_]+", line.lower()))
+        trie = cls(max_suggestions)
+        for word, count in counts.items():
+            trie.insert(word, count)
+        return trie.finalize()
+
+
+def get_prefix(text):
+    """ Returns the word that is being spelled (after the last separator). """
+    idx = max(text.rfind(sep) for sep in WORD_SEPARATORS)
+    return text[idx + 1:]
+
+
+def apply_selection(text, label, is_word=False):
+    """ Returns the spelled text after a selection. A word replaces the
+    partial word that was being spelled and is followed by a space. """
+    if is_word:
+        if label == '':
+            return text
+        return text[:len(text) - len(get_prefix(text))] + label + ' '
+    return text + label